@@ -0,0 +1,51 @@
+from fastapi import APIRouter, HTTPException
+from fastapi import Header
+from fastapi.responses import Response
+from typing import Optional
+from config.settings import debug_settings
+from api.v1.batches_endpoint import require_api_key
+from utils.profiling import PROFILE_FORMATS, ProfilerBusy, render_profile, worker_profiler
+from utils.request_keys import api_key_fingerprint
+import logging
+import os
+import time
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+def require_admin(authorization: Optional[str], x_api_key: Optional[str]):
+    admin_fingerprints = debug_settings.admin_fingerprints
+    if not admin_fingerprints:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if api_key_fingerprint(require_api_key(authorization, x_api_key)) not in admin_fingerprints:
+        raise HTTPException(status_code=403, detail="This endpoint requires an admin API key.")
+
+
+@router.get("/debug/profile", response_model=None)
+async def profile_worker(
+    seconds: float = 10.0,
+    format: str = "pstats",
+    limit: int = 100,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None, alias="x-api-key"),
+):
+    require_admin(authorization, x_api_key)
+    if not 0 < seconds <= debug_settings.max_profile_seconds:
+        raise HTTPException(
+            status_code=400, detail=f"'seconds' must be greater than 0 and at most {debug_settings.max_profile_seconds:g}.")
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"'format' must be one of {', '.join(PROFILE_FORMATS)}.")
+
+    try:
+        profiler = await worker_profiler.capture(seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    pid = os.getpid()
+    headers = {"X-Worker-Pid": str(pid)}
+    if format == "text":
+        return Response(render_profile(profiler, format, limit), media_type="text/plain; charset=utf-8", headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="worker-{pid}-{int(time.time())}.prof"'
+    return Response(render_profile(profiler, format), media_type="application/octet-stream", headers=headers)
@@ -0,0 +1,103 @@
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import Header
+from typing import Optional
+from config.settings import batch_settings
+from dependencies.upstream import get_upstream_session
+from services.batch_runner import BatchBusy, BatchJob, create_batch_job, load_batch_job, new_batch_id
+from services.batch_runner import validate_batch_options
+from utils.request_keys import api_key_fingerprint
+from utils.streaming import CancellableStreamingResponse
+from starlette.background import BackgroundTask
+import asyncio
+import httpx
+import logging
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+def require_api_key(authorization: Optional[str], x_api_key: Optional[str]) -> str:
+    poe_api_key = x_api_key
+    if authorization and authorization.lower().startswith("bearer "):
+        poe_api_key = authorization.split(" ", 1)[1]
+    if not poe_api_key:
+        raise HTTPException(
+            status_code=401, detail="API key not found in 'Authorization' or 'X-Api-Key' header.")
+    return poe_api_key
+
+
+def find_batch_job(batch_id: str, poe_api_key: str) -> BatchJob:
+    job = load_batch_job(batch_id)
+    if job is None or job.owner != api_key_fingerprint(poe_api_key):
+        raise HTTPException(status_code=404, detail=f"Batch with id '{batch_id}' not found.")
+    return job
+
+
+def stream_batch(
+        batch_id: str, job: BatchJob, poe_api_key: str,
+        upstream_session: Optional[httpx.AsyncClient], replay: bool,
+) -> CancellableStreamingResponse:
+    try:
+        job.acquire()
+    except BatchBusy:
+        raise HTTPException(status_code=409, detail=f"Batch with id '{batch_id}' is already running.")
+    return CancellableStreamingResponse(
+        job.stream(poe_api_key, upstream_session, replay=replay),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id},
+        background=BackgroundTask(job.release),
+    )
+
+
+@router.post("/v1/batches", response_model=None)
+async def create_batch(
+    request: Request,
+    endpoint: str = "/v1/responses",
+    order: str = "input",
+    concurrency: int = batch_settings.concurrency,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None, alias="x-api-key"),
+    upstream_session: Optional[httpx.AsyncClient] = Depends(get_upstream_session)
+):
+    poe_api_key = require_api_key(authorization, x_api_key)
+    try:
+        concurrency = validate_batch_options(endpoint, order, concurrency)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    batch_id = new_batch_id()
+    job = create_batch_job(batch_id, endpoint, order, concurrency, api_key_fingerprint(poe_api_key))
+    try:
+        received = await job.receive_input(request.stream())
+    except Exception:
+        await asyncio.to_thread(job.discard)
+        raise
+    if not received:
+        await asyncio.to_thread(job.discard)
+        raise HTTPException(status_code=400, detail="Batch body must contain at least one JSONL line.")
+    await asyncio.to_thread(job.save)
+    logger.info(f"Batch {batch_id} accepted: {received} bytes for {endpoint}, {order} order, concurrency {concurrency}")
+    return stream_batch(batch_id, job, poe_api_key, upstream_session, replay=False)
+
+
+@router.post("/v1/batches/{batch_id}/resume", response_model=None)
+async def resume_batch(
+    batch_id: str,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None, alias="x-api-key"),
+    upstream_session: Optional[httpx.AsyncClient] = Depends(get_upstream_session)
+):
+    poe_api_key = require_api_key(authorization, x_api_key)
+    job = find_batch_job(batch_id, poe_api_key)
+    return stream_batch(batch_id, job, poe_api_key, upstream_session, replay=True)
+
+
+@router.get("/v1/batches/{batch_id}")
+async def get_batch(
+    batch_id: str,
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None, alias="x-api-key"),
+):
+    job = find_batch_job(batch_id, require_api_key(authorization, x_api_key))
+    return {"id": batch_id, **job.status()}
@@ -1,13 +1,21 @@
 from fastapi import APIRouter, HTTPException, Depends
-from typing import List
 from fastapi import Header
-from typing import Optional
-from models.request_models import ClientRequest
+from typing import Optional, Tuple
+from models.request_models import DecodedClientRequest
 from dependencies.logging import log_request_body, log_request_header
-from fastapi.responses import StreamingResponse, JSONResponse
+from dependencies.request_body import decode_responses_request, decode_chat_completions_request
+from dependencies.upstream import get_upstream_session
+from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTask
 from services.poe_service import get_poe_response_streaming, get_poe_response_non_streaming
 from services.poe_service import get_poe_chat_completion_non_streaming, get_poe_chat_completion_streaming
+from services.admission import AdmissionRejected, Permit, admission_controller
+from services.conversation_store import conversation_store
+from utils.request_keys import api_key_fingerprint
+from utils.streaming import CancellableStreamingResponse
+from utils.tracing import span
 import fastapi_poe as fp
+import httpx
 import logging
 
 router = APIRouter()
@@ -15,6 +23,45 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+async def admit_request(poe_api_key: str, bot_name: str) -> Optional[Permit]:
+    if admission_controller is None:
+        return None
+    try:
+        with span("admission"):
+            return await admission_controller.admit(poe_api_key, bot_name)
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected request for bot '{bot_name}': {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def guard_stream(stream, permit: Optional[Permit]):
+    return stream if permit is None else permit.guard(stream)
+
+
+def release_permit(permit: Optional[Permit]) -> Optional[BackgroundTask]:
+    return None if permit is None else BackgroundTask(permit.release)
+
+
+async def load_previous_messages(previous_response_id: Optional[str], poe_api_key: str) -> Tuple[fp.ProtocolMessage, ...]:
+    if previous_response_id is None:
+        return ()
+    history = None
+    if conversation_store is not None:
+        with span("load_history"):
+            history = await conversation_store.load(previous_response_id, api_key_fingerprint(poe_api_key))
+    if history is None:
+        raise HTTPException(
+            status_code=400, detail=f"Previous response with id '{previous_response_id}' not found.")
+    return history
+
+
+async def guard_call(call, permit: Optional[Permit]):
+    if permit is None:
+        return await call
+    async with permit:
+        return await call
+
+
 @router.post(
         "/v1/responses",
         response_model=None,
@@ -24,9 +71,10 @@ logger = logging.getLogger(__name__)
         ]
 )
 async def create_model_responses(
-    request_data: ClientRequest,
+    request_data: DecodedClientRequest = Depends(decode_responses_request),
     authorization: Optional[str] = Header(None),
-    x_api_key: Optional[str] = Header(None, alias="x-api-key")
+    x_api_key: Optional[str] = Header(None, alias="x-api-key"),
+    upstream_session: Optional[httpx.AsyncClient] = Depends(get_upstream_session)
 ):
     poe_api_key = x_api_key
     if authorization and authorization.lower().startswith("bearer "):
@@ -36,47 +84,52 @@ async def create_model_responses(
             status_code=401, detail="API key not found in 'Authorization' or 'X-Api-Key' header.")
     
     poe_bot_name = request_data.model
-    protocol_messages: List[fp.ProtocolMessage] = []
-    instructions_str = "You are a helpful assistant."
-
-    for msg in request_data.input:
-        text_content = msg.get_text_content()
-        poe_role = msg.role
-
-        if msg.role == "system":
-            instructions_str = text_content
-        if msg.role == "assistant":
-            poe_role = "bot"
-        elif msg.role not in ["system", "user", "bot"]:
-            logger.warning(f"Warning: Unknown role '{msg.role}', defaulting to 'user'.")
-            poe_role = "user"
-
-        protocol_messages.append(fp.ProtocolMessage(
-            role=poe_role, content=text_content))
+    protocol_messages = request_data.protocol_messages
+    instructions_str = request_data.instructions_str
 
     if not protocol_messages:
         raise HTTPException(
             status_code=400, detail="Messages list (derived from 'input') cannot be empty.")
+
+    previous_response_id = request_data.previous_response_id
+    history = await load_previous_messages(previous_response_id, poe_api_key)
+    store = request_data.store and conversation_store is not None
     
+    permit = await admit_request(poe_api_key, poe_bot_name)
     if request_data.stream:
-        return StreamingResponse(
-            get_poe_response_streaming(
+        return CancellableStreamingResponse(
+            guard_stream(get_poe_response_streaming(
                 bot_name=poe_bot_name,
                 poe_api_key=poe_api_key,
                 protocol_messages=protocol_messages,
                 instructions_str=instructions_str,
                 request_model_name=request_data.model,
-            ),
-            media_type="text/event-stream"
+                session=upstream_session,
+                previous_response_id=previous_response_id,
+                history=history,
+                store=store,
+                truncation=request_data.truncation,
+                max_output_tokens=request_data.max_output_tokens,
+                stop=request_data.stop,
+            ), permit),
+            media_type="text/event-stream",
+            background=release_permit(permit)
         )
     else:
-        response = await get_poe_response_non_streaming(
+        response = await guard_call(get_poe_response_non_streaming(
             bot_name=poe_bot_name,
             poe_api_key=poe_api_key,
             protocol_messages=protocol_messages,
             instructions_str=instructions_str,
             request_model_name=request_data.model,
-            )
+            session=upstream_session,
+            previous_response_id=previous_response_id,
+            history=history,
+            store=store,
+            truncation=request_data.truncation,
+            max_output_tokens=request_data.max_output_tokens,
+            stop=request_data.stop,
+            ), permit)
         return JSONResponse(response)
     
 
@@ -89,9 +142,10 @@ async def create_model_responses(
         ]
 )
 async def create_model_chat_completions(
-    request_data: ClientRequest,
+    request_data: DecodedClientRequest = Depends(decode_chat_completions_request),
     authorization: Optional[str] = Header(None),
-    x_api_key: Optional[str] = Header(None, alias="x-api-key")
+    x_api_key: Optional[str] = Header(None, alias="x-api-key"),
+    upstream_session: Optional[httpx.AsyncClient] = Depends(get_upstream_session)
 ):
     poe_api_key = x_api_key
     if authorization and authorization.lower().startswith("bearer "):
@@ -101,39 +155,35 @@ async def create_model_chat_completions(
             status_code=401, detail="API key not found in 'Authorization' or 'X-Api-Key' header.")
     
     poe_bot_name = request_data.model
-    protocol_messages: List[fp.ProtocolMessage] = []
-
-    for msg in request_data.messages:
-        text_content = msg.content
-        poe_role = msg.role
-
-        if msg.role == "assistant":
-            poe_role = "bot"
-        elif msg.role not in ["system", "user", "bot"]:
-            poe_role = "user"
-
-        protocol_messages.append(fp.ProtocolMessage(
-            role=poe_role, content=text_content))
+    protocol_messages = request_data.protocol_messages
 
     if not protocol_messages:
         raise HTTPException(
             status_code=400, detail="Messages list (derived from 'message') cannot be empty.")
 
+    permit = await admit_request(poe_api_key, poe_bot_name)
     if request_data.stream:
-        return StreamingResponse(
-            get_poe_chat_completion_streaming(
+        return CancellableStreamingResponse(
+            guard_stream(get_poe_chat_completion_streaming(
                 bot_name=poe_bot_name,
                 poe_api_key=poe_api_key,
                 protocol_messages=protocol_messages,
                 request_model_name=request_data.model,
-            ),
-            media_type="text/event-stream"
+                session=upstream_session,
+                max_tokens=request_data.max_output_tokens,
+                stop=request_data.stop,
+            ), permit),
+            media_type="text/event-stream",
+            background=release_permit(permit)
         )
     else:
-        response =  await get_poe_chat_completion_non_streaming(
+        response =  await guard_call(get_poe_chat_completion_non_streaming(
             bot_name=poe_bot_name,
             poe_api_key=poe_api_key,
             protocol_messages=protocol_messages,
             request_model_name=request_data.model,
-            )
+            session=upstream_session,
+            max_tokens=request_data.max_output_tokens,
+            stop=request_data.stop,
+            ), permit)
         return JSONResponse(response)
\ No newline at end of file
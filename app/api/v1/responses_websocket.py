@@ -0,0 +1,197 @@
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from typing import Any, Dict, Optional, Tuple, Union
+from api.v1.batches_endpoint import require_api_key
+from api.v1.responses_endpoint import admit_request, load_previous_messages
+from config.settings import WebSocketSettings, websocket_settings
+from dependencies.request_body import decode_responses_data
+from models.openai_types import ResponseTypes
+from services.conversation_store import conversation_store
+from services.metrics import metrics_registry
+from services.poe_service import get_poe_response_streaming
+from contextlib import aclosing
+import asyncio
+import httpx
+import json
+import logging
+import uuid
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+def frame_prefix(response_id: str, request_id: Optional[str]) -> str:
+    tags = {"response_id": response_id}
+    if request_id is not None:
+        tags["request_id"] = request_id
+    return json.dumps(tags, separators=(",", ":"))[:-1]
+
+
+def websocket_message(sse_frame: Union[str, bytes], prefix: str) -> str:
+    # SSE frames are "event: <type>\ndata: {...}\n\n"; splice the tags into the
+    # JSON object instead of decoding and re-encoding every frame.
+    if isinstance(sse_frame, bytes):
+        sse_frame = sse_frame.decode("utf-8")
+    payload = sse_frame[sse_frame.index("\ndata: ") + 7:].rstrip()
+    return prefix + ("}" if payload == "{}" else "," + payload[1:])
+
+
+class ResponseMultiplexer:
+    def __init__(
+            self,
+            websocket: WebSocket,
+            poe_api_key: str,
+            upstream_session: Optional[httpx.AsyncClient],
+            settings: WebSocketSettings,
+    ):
+        self.websocket = websocket
+        self.poe_api_key = poe_api_key
+        self.upstream_session = upstream_session
+        self.max_responses = settings.max_responses
+        # Response frames need a send credit, so a slow reader stalls its
+        # upstream streams; control messages skip the credit so cancels and
+        # errors still go out while the queue is full.
+        self.outbox: asyncio.Queue[Tuple[str, bool]] = asyncio.Queue()
+        self.credits = asyncio.Semaphore(settings.send_queue_size)
+        self.responses: Dict[str, asyncio.Task] = {}
+        self.request_ids: Dict[str, str] = {}
+
+    def control(self, message: Dict[str, Any]):
+        self.outbox.put_nowait((json.dumps(message, separators=(",", ":")), False))
+
+    def error(self, status_code: int, detail: Any, **tags: Any):
+        self.control({"type": "error", **tags, "error": {"status": status_code, "detail": detail}})
+
+    async def run(self):
+        writer = asyncio.create_task(self._write())
+        try:
+            while True:
+                try:
+                    text = await self.websocket.receive_text()
+                except WebSocketDisconnect:
+                    break
+                self.handle(text)
+        finally:
+            responses = list(self.responses.values())
+            for task in responses:
+                task.cancel()
+            await asyncio.gather(*responses, return_exceptions=True)
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+
+    async def _write(self):
+        while True:
+            text, credited = await self.outbox.get()
+            try:
+                await self.websocket.send_text(text)
+            finally:
+                if credited:
+                    self.credits.release()
+
+    def handle(self, text: str):
+        try:
+            message = json.loads(text)
+        except json.JSONDecodeError as e:
+            self.error(400, f"Invalid JSON message: {e}")
+            return
+        if not isinstance(message, dict):
+            self.error(400, "Messages must be JSON objects.")
+            return
+
+        kind = message.get("type")
+        request_id = message.get("request_id")
+        tags = {} if request_id is None else {"request_id": request_id}
+        if request_id is not None and not isinstance(request_id, str):
+            self.error(400, "'request_id' must be a string.")
+        elif kind == "response.create":
+            self.create(message.get("response"), request_id, tags)
+        elif kind == "response.cancel":
+            self.cancel(message.get("response_id"), request_id, tags)
+        else:
+            self.error(400, f"Unknown message type '{kind}', expected 'response.create' or 'response.cancel'.", **tags)
+
+    def create(self, body: Any, request_id: Optional[str], tags: Dict[str, str]):
+        if len(self.responses) >= self.max_responses:
+            self.error(429, f"At most {self.max_responses} responses can run on one connection.", **tags)
+            return
+        if request_id is not None and request_id in self.request_ids:
+            self.error(400, f"Request id '{request_id}' is already in use on this connection.", **tags)
+            return
+        response_id = f"resp-{uuid.uuid4().hex}"
+        if request_id is not None:
+            self.request_ids[request_id] = response_id
+        self.responses[response_id] = asyncio.create_task(self._respond(response_id, request_id, body))
+
+    def cancel(self, response_id: Any, request_id: Optional[str], tags: Dict[str, str]):
+        if response_id is None and request_id is not None:
+            response_id = self.request_ids.get(request_id)
+        task = self.responses.get(response_id) if isinstance(response_id, str) else None
+        if task is None:
+            self.error(404, "No running response matches 'response_id' or 'request_id'.", **tags)
+            return
+        task.cancel()
+
+    async def _respond(self, response_id: str, request_id: Optional[str], body: Any):
+        tags = {"response_id": response_id} if request_id is None else {"response_id": response_id, "request_id": request_id}
+        prefix = frame_prefix(response_id, request_id)
+        outcome = "failed"
+        permit = None
+        try:
+            request_data = decode_responses_data(body)
+            if not request_data.protocol_messages:
+                raise HTTPException(
+                    status_code=400, detail="Messages list (derived from 'input') cannot be empty.")
+            history = await load_previous_messages(request_data.previous_response_id, self.poe_api_key)
+            permit = await admit_request(self.poe_api_key, request_data.model)
+            stream = get_poe_response_streaming(
+                bot_name=request_data.model,
+                poe_api_key=self.poe_api_key,
+                protocol_messages=request_data.protocol_messages,
+                instructions_str=request_data.instructions_str,
+                request_model_name=request_data.model,
+                session=self.upstream_session,
+                previous_response_id=request_data.previous_response_id,
+                history=history,
+                store=request_data.store and conversation_store is not None,
+                truncation=request_data.truncation,
+                max_output_tokens=request_data.max_output_tokens,
+                stop=request_data.stop,
+                response_id=response_id,
+            )
+            async with aclosing(stream):
+                async for sse_frame in stream:
+                    await self.credits.acquire()
+                    self.outbox.put_nowait((websocket_message(sse_frame, prefix), True))
+            outcome = "completed"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            self.control({"type": ResponseTypes.CANCELLED.value, **tags})
+            raise
+        except HTTPException as e:
+            self.error(e.status_code, e.detail, **tags)
+        except RequestValidationError as e:
+            self.error(422, jsonable_encoder(e.errors()), **tags)
+        except Exception as e:
+            logger.exception(f"WebSocket response {response_id} failed: {e}")
+            self.error(500, "Internal error while streaming the response.", **tags)
+        finally:
+            if permit is not None:
+                permit.release()
+            self.responses.pop(response_id, None)
+            if request_id is not None:
+                self.request_ids.pop(request_id, None)
+            metrics_registry.inc("poe_adapter_websocket_responses_total", (("outcome", outcome),))
+
+
+@router.websocket("/v1/responses")
+async def responses_websocket(websocket: WebSocket):
+    try:
+        poe_api_key = require_api_key(websocket.headers.get("authorization"), websocket.headers.get("x-api-key"))
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    await websocket.accept()
+    upstream_session = getattr(websocket.app.state, "upstream_session", None)
+    await ResponseMultiplexer(websocket, poe_api_key, upstream_session, websocket_settings).run()
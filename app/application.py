@@ -0,0 +1,157 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager, suppress
+from api.v1.responses_endpoint import router as responses_router
+from api.v1.responses_websocket import router as responses_websocket_router
+from api.v1.batches_endpoint import router as batches_router
+from api.debug_endpoint import router as debug_router
+from config.settings import batch_settings, compression_settings, conversation_settings, metrics_settings, startup_settings
+from config.settings import upstream_settings
+from services.upstream_client import UpstreamPoolStats, create_upstream_client, warm_upstream_pool
+from services.admission import admission_controller
+from services.batch_runner import run_batch_sweeper
+from services.response_cache import response_cache
+from services.single_flight import single_flight_group
+from services.conversation_store import conversation_store, run_conversation_pruner
+from services.key_pool import key_pool_registry
+from services.model_router import model_router
+from services.metrics import collect_metrics, create_metrics_store, flush_metrics, metrics_registry, run_metrics_flusher
+from utils.log_pipeline import DroppingQueueHandler
+from utils.streaming import stream_stats
+from utils.message_mappers import message_interner
+from utils.startup import ROOT_PAYLOAD, startup_timer
+from utils.compression import CompressionMiddleware
+from utils.tracing import TracingMiddleware, request_tracer
+
+import asyncio
+import logging
+
+
+def collect_runtime_series(app: FastAPI):
+    pool_stats = getattr(app.state, "upstream_pool_stats", None)
+    if pool_stats is not None:
+        yield "poe_adapter_upstream_pool_connections_total", (("result", "hit"),), pool_stats.hits
+        yield "poe_adapter_upstream_pool_connections_total", (("result", "miss"),), pool_stats.misses
+    for endpoint, count in stream_stats.completed.items():
+        yield "poe_adapter_streams_total", (("endpoint", endpoint), ("outcome", "completed")), count
+    for endpoint, count in stream_stats.cancelled.items():
+        yield "poe_adapter_streams_total", (("endpoint", endpoint), ("outcome", "cancelled")), count
+    if admission_controller is not None:
+        admission_stats = admission_controller.stats
+        for outcome in ("admitted", "queued", "rejected"):
+            yield "poe_adapter_admission_requests_total", (("outcome", outcome),), getattr(admission_stats, outcome)
+        yield "poe_adapter_admission_wait_seconds_total", (), admission_stats.total_wait_seconds
+        for scope, name, limiter in admission_controller.limiters():
+            labels = (("scope", scope), ("name", metrics_registry.bot_label(name) if scope == "bot" else name))
+            yield "poe_adapter_admission_queue_depth", labels, limiter.queue_depth
+            yield "poe_adapter_admission_active", labels, limiter.active
+    if response_cache is not None:
+        yield "poe_adapter_response_cache_lookups_total", (("result", "hit"),), response_cache.hits
+        yield "poe_adapter_response_cache_lookups_total", (("result", "miss"),), response_cache.misses
+        yield "poe_adapter_response_cache_bytes", (), response_cache.current_bytes
+    if single_flight_group is not None:
+        yield "poe_adapter_single_flight_requests_total", (("role", "started"),), single_flight_group.started
+        yield "poe_adapter_single_flight_requests_total", (("role", "joined"),), single_flight_group.joined
+    if message_interner is not None:
+        yield "poe_adapter_message_cache_lookups_total", (("result", "hit"),), message_interner.hits
+        yield "poe_adapter_message_cache_lookups_total", (("result", "miss"),), message_interner.misses
+        yield "poe_adapter_message_cache_bytes", (), message_interner.current_bytes
+    if conversation_store is not None:
+        yield "poe_adapter_conversation_lookups_total", (("result", "memory"),), conversation_store.memory_hits
+        yield "poe_adapter_conversation_lookups_total", (("result", "disk"),), conversation_store.disk_hits
+        yield "poe_adapter_conversation_lookups_total", (("result", "miss"),), conversation_store.misses
+        yield "poe_adapter_conversation_memory_bytes", (), conversation_store.memory.current_bytes
+    if key_pool_registry is not None:
+        for pool in key_pool_registry.pools.values():
+            for health in pool.keys:
+                labels = (("pool", pool.name), ("key", health.label))
+                yield "poe_adapter_upstream_key_in_flight", labels, health.in_flight
+                yield "poe_adapter_upstream_key_requests_total", labels, health.requests
+                yield "poe_adapter_upstream_key_rate_limits_total", labels, health.rate_limits
+    dropped = sum(handler.dropped for handler in logging.getLogger().handlers if isinstance(handler, DroppingQueueHandler))
+    yield "poe_adapter_log_records_dropped_total", (), dropped
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup_timer.phase("lifespan"):
+        app.state.upstream_pool_stats = UpstreamPoolStats()
+        app.state.upstream_session = create_upstream_client(upstream_settings, app.state.upstream_pool_stats)
+        app.state.metrics_store = create_metrics_store(metrics_settings)
+    metrics_flusher = asyncio.create_task(
+        run_metrics_flusher(metrics_registry, app.state.metrics_store, metrics_settings.flush_interval)
+    )
+    pool_warmer = asyncio.create_task(warm_upstream_pool(app.state.upstream_session, startup_settings, upstream_settings.base_url))
+    batch_sweeper = asyncio.create_task(run_batch_sweeper(batch_settings))
+    conversation_pruner = asyncio.create_task(run_conversation_pruner(conversation_store, conversation_settings))
+    if not startup_settings.defer_imports:
+        startup_timer.mark_ready()
+    try:
+        yield
+    finally:
+        for task in (pool_warmer, metrics_flusher, batch_sweeper, conversation_pruner):
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        with suppress(OSError):
+            await flush_metrics(metrics_registry, app.state.metrics_store)
+        await app.state.upstream_session.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+metrics_registry.add_collector(lambda: collect_runtime_series(app))
+app.include_router(responses_router)
+app.include_router(responses_websocket_router)
+app.include_router(batches_router)
+app.include_router(debug_router)
+if compression_settings.enabled:
+    app.add_middleware(CompressionMiddleware, settings=compression_settings)
+if request_tracer is not None:
+    app.add_middleware(TracingMiddleware, tracer=request_tracer)
+
+
+@app.get("/")
+@app.head("/")
+async def root():
+    return ROOT_PAYLOAD
+
+
+@app.get("/startup")
+async def startup():
+    return startup_timer.to_dict()
+
+
+@app.get("/upstream/pool")
+async def upstream_pool(request: Request):
+    # Without the lifespan (uvicorn --lifespan off) there is no shared pool.
+    pool_stats = getattr(request.app.state, "upstream_pool_stats", None)
+    return pool_stats.to_dict() if pool_stats is not None else {"enabled": False}
+
+
+@app.get("/upstream/keys")
+async def upstream_keys():
+    return key_pool_registry.to_dict() if key_pool_registry is not None else {"enabled": False}
+
+
+@app.get("/routes")
+async def routes():
+    return model_router.to_dict() if model_router is not None else {"enabled": False}
+
+
+@app.get("/admission")
+async def admission():
+    return admission_controller.to_dict() if admission_controller is not None else {"enabled": False}
+
+
+@app.get("/streams")
+async def streams():
+    return stream_stats.to_dict()
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    return PlainTextResponse(
+        await collect_metrics(metrics_registry, getattr(request.app.state, "metrics_store", None)),
+        media_type="text/plain; version=0.0.4",
+    )
+
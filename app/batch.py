@@ -0,0 +1,68 @@
+from config.settings import batch_settings, log_settings, upstream_settings
+from services.batch_runner import BATCH_ENDPOINTS, BATCH_ORDERS, BatchBusy, BatchJob, validate_batch_options
+from services.upstream_client import UpstreamPoolStats, create_upstream_client
+from utils.log_pipeline import configure_logging
+from contextlib import aclosing
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+
+async def run_batch(job: BatchJob, poe_api_key: str):
+    session = create_upstream_client(upstream_settings, UpstreamPoolStats())
+    try:
+        async with aclosing(job.run(poe_api_key, session)) as records:
+            async for _ in records:
+                pass
+    finally:
+        await session.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of requests through the adapter's service layer.")
+    parser.add_argument("input", help="JSONL file with one ClientRequest (or {custom_id, url, body}) per line.")
+    parser.add_argument("output", help="JSONL file results are written to.")
+    parser.add_argument("--endpoint", choices=BATCH_ENDPOINTS, default="/v1/responses")
+    parser.add_argument("--order", choices=BATCH_ORDERS, default="input")
+    parser.add_argument("--concurrency", type=int, default=batch_settings.concurrency)
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint.json).")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint if one exists.")
+    parser.add_argument("--api-key-env", default="POE_API_KEY", help="Environment variable holding the Poe API key.")
+    args = parser.parse_args()
+
+    configure_logging(log_settings, sys.stderr)
+    poe_api_key = os.environ.get(args.api_key_env)
+    if not poe_api_key:
+        parser.error(f"set the Poe API key in ${args.api_key_env}")
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint.json"
+    concurrency = validate_batch_options(args.endpoint, args.order, args.concurrency)
+
+    job = None
+    if args.resume:
+        job = BatchJob.load(args.input, args.output, checkpoint_path)
+        if job is not None:
+            job.concurrency = concurrency
+            logger.info(f"Resuming {args.input} at line {job.next_index} ({job.lines_done} lines already written)")
+    elif os.path.exists(checkpoint_path):
+        parser.error(f"{checkpoint_path} exists; pass --resume to continue it or delete it to start over")
+    if job is None:
+        job = BatchJob(args.input, args.output, checkpoint_path, args.endpoint, args.order, concurrency)
+
+    try:
+        asyncio.run(run_batch(job, poe_api_key))
+    except BatchBusy as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        logger.info(f"Interrupted after {job.lines_done} lines; rerun with --resume to continue")
+        sys.exit(130)
+    print(f"{job.succeeded} succeeded, {job.failed} failed, results in {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+from services import poe_service
+from services.single_flight import SingleFlightGroup
+from services.upstream_client import UpstreamPoolStats, create_upstream_client
+from config.settings import upstream_settings
+from utils.streaming import stream_stats
+from benchmarks.fake_poe_server import FakePoe, FakePoeSettings, serve
+from application import app
+
+import fastapi_poe as fp
+import asyncio
+import json
+import time
+
+
+MAX_CANCEL_SECONDS = 0.25
+
+
+def request_body(path: str) -> bytes:
+    if path == "/v1/responses":
+        return json.dumps({"model": "fake-bot", "stream": True, "input": [{"role": "user", "content": "hi"}]}).encode()
+    return json.dumps({"model": "fake-bot", "stream": True, "messages": [{"role": "user", "content": "hi"}]}).encode()
+
+
+async def disconnect_after_first_delta(path: str, fake: FakePoe) -> float:
+    first_delta = asyncio.Event()
+    delivered = False
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": b"", "server": ("testserver", 80), "client": ("127.0.0.1", 1234), "app": app,
+        "headers": [(b"content-type", b"application/json"), (b"authorization", b"Bearer test-key")],
+    }
+
+    async def receive():
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return {"type": "http.request", "body": request_body(path), "more_body": False}
+        await first_delta.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and b"xxx" in message.get("body", b""):
+            first_delta.set()
+
+    closed_before = len(fake.closed_at)
+    call = asyncio.create_task(app(scope, receive, send))
+    await first_delta.wait()
+    disconnected_at = time.monotonic()
+    await asyncio.wait_for(call, 5)
+    while len(fake.closed_at) == closed_before:
+        if time.monotonic() - disconnected_at > 5:
+            raise AssertionError(f"upstream for {path} still open 5s after disconnect")
+        await asyncio.sleep(0.001)
+    return fake.closed_at[-1] - disconnected_at
+
+
+async def close_before_first_read(fake: FakePoe, base_url: str) -> float:
+    # A single-flight subscriber that is closed before it reads anything must
+    # still cancel the upstream call once it was the only subscriber.
+    group = SingleFlightGroup()
+    closed_before = len(fake.closed_at)
+    requests_before = fake.requests_by_bot["fake-bot"]
+    subscription = group.subscribe("disconnect-benchmark", lambda: fp.get_bot_response(
+        messages=[fp.ProtocolMessage(role="user", content="hi")], bot_name="fake-bot", api_key="test-key",
+        session=app.state.upstream_session, base_url=base_url,
+    ))
+    while fake.requests_by_bot["fake-bot"] == requests_before:
+        await asyncio.sleep(0.001)
+    disconnected_at = time.monotonic()
+    await subscription.aclose()
+    while len(fake.closed_at) == closed_before:
+        if time.monotonic() - disconnected_at > 5:
+            raise AssertionError("single-flight upstream still open 5s after its only subscriber closed")
+        await asyncio.sleep(0.001)
+    return fake.closed_at[-1] - disconnected_at
+
+
+async def run_case(name: str, fake: FakePoe, base_url: str):
+    upstream_settings.base_url = base_url
+    app.state.upstream_session = create_upstream_client(upstream_settings, UpstreamPoolStats())
+    try:
+        for path in ("/v1/responses", "/v1/chat/completions"):
+            elapsed = await disconnect_after_first_delta(path, fake)
+            status = "ok" if elapsed <= MAX_CANCEL_SECONDS else "TOO SLOW"
+            print(f"{name:>10} {path:>22}: upstream closed {elapsed * 1000:7.1f}ms after disconnect [{status}]")
+            assert elapsed <= MAX_CANCEL_SECONDS
+        elapsed = await close_before_first_read(fake, base_url)
+        status = "ok" if elapsed <= MAX_CANCEL_SECONDS else "TOO SLOW"
+        print(f"{name:>10} {'single-flight':>22}: upstream closed {elapsed * 1000:7.1f}ms after close before first read [{status}]")
+        assert elapsed <= MAX_CANCEL_SECONDS
+    finally:
+        await app.state.upstream_session.aclose()
+
+
+def main():
+    cases = (
+        ("streaming", FakePoe(FakePoeSettings(chunks=0, interval_ms=10, first_token_ms=0))),
+        ("stalled", FakePoe(FakePoeSettings(chunks=0, interval_ms=10, first_token_ms=0, stall_after=1))),
+    )
+    original_base_url = poe_service.upstream_settings.base_url
+    try:
+        for name, fake in cases:
+            with serve(fake) as base_url:
+                asyncio.run(run_case(name, fake, base_url))
+    finally:
+        upstream_settings.base_url = original_base_url
+    print(f"stream stats: {stream_stats.to_dict()}")
+
+
+if __name__ == "__main__":
+    main()
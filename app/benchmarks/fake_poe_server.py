@@ -0,0 +1,118 @@
+from config.settings import EnvSettings
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from collections import Counter
+from contextlib import contextmanager
+from typing import AsyncIterator, ClassVar, Iterator, List
+
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+import uvicorn
+
+
+class FakePoeSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "FAKE_POE_"
+
+    chunk_size: int = 16
+    chunks: int = 50
+    interval_ms: float = 5.0
+    first_token_ms: float = 50.0
+    slow_rate: float = 0.0
+    slow_first_token_ms: float = 3000.0
+    stall_after: int = 0
+    error_rate: float = 0.0
+    error_kind: str = "event"
+    error_after: int = 5
+    rate_limited_keys: str = ""
+    failing_bots: str = ""
+    bot_first_token_ms: str = ""
+
+
+class FakePoe:
+    def __init__(self, settings: FakePoeSettings):
+        self.settings = settings
+        self.closed_at: List[float] = []
+        self.requests_by_key: Counter = Counter()
+        self.rate_limited_keys = {key for key in settings.rate_limited_keys.split(",") if key}
+        self.failing_bots = {bot for bot in settings.failing_bots.split(",") if bot}
+        self.bot_first_token_ms = {
+            bot: float(ms) for bot, ms in (item.split("=", 1) for item in settings.bot_first_token_ms.split(",") if item)
+        }
+        self.requests_by_bot: Counter = Counter()
+        self.chunk_text = ("x" * (settings.chunk_size - 1)) + " "
+
+    def _error_event(self, allow_retry: bool) -> str:
+        data = {"text": "Injected upstream failure", "error_type": "injected", "allow_retry": allow_retry}
+        return f"event: error\ndata: {json.dumps(data)}\n\n"
+
+    async def events(self, bot_name: str, fail: bool, slow: bool) -> AsyncIterator[str]:
+        settings = self.settings
+        try:
+            yield "event: meta\ndata: {\"content_type\": \"text/markdown\"}\n\n"
+            if bot_name in self.failing_bots:
+                yield self._error_event(allow_retry=False)
+                return
+            first_token_ms = self.bot_first_token_ms.get(bot_name, settings.first_token_ms)
+            if slow:
+                first_token_ms = settings.slow_first_token_ms
+            if first_token_ms:
+                await asyncio.sleep(first_token_ms / 1000)
+            index = 0
+            while settings.chunks <= 0 or index < settings.chunks:
+                if fail and index == settings.error_after:
+                    yield self._error_event(allow_retry=settings.error_kind == "retryable")
+                    return
+                if settings.stall_after and index >= settings.stall_after:
+                    await asyncio.sleep(3600)
+                yield f"event: text\ndata: {json.dumps({'text': self.chunk_text})}\n\n"
+                index += 1
+                await asyncio.sleep(settings.interval_ms / 1000)
+            yield "event: done\ndata: {}\n\n"
+        finally:
+            self.closed_at.append(time.monotonic())
+
+    async def bot(self, request: Request) -> Response:
+        payload = await request.json()
+        if payload.get("type") != "query":
+            return JSONResponse({})
+        bot_name = request.path_params["name"]
+        self.requests_by_bot[bot_name] += 1
+        api_key = request.headers.get("authorization", "").removeprefix("Bearer ")
+        self.requests_by_key[api_key] += 1
+        if api_key in self.rate_limited_keys:
+            return JSONResponse({"detail": "Rate limit exceeded"}, status_code=429, headers={"Retry-After": "5"})
+        fail = self.settings.error_rate > 0 and random.random() < self.settings.error_rate
+        if fail and self.settings.error_kind == "http":
+            return JSONResponse({"detail": "Injected upstream failure"}, status_code=500)
+        slow = self.settings.slow_rate > 0 and random.random() < self.settings.slow_rate
+        return StreamingResponse(self.events(bot_name, fail, slow), media_type="text/event-stream")
+
+
+def create_app(fake: FakePoe) -> Starlette:
+    return Starlette(routes=[Route("/bot/{name}", fake.bot, methods=["POST"])])
+
+
+@contextmanager
+def serve(fake: FakePoe) -> Iterator[str]:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(fake), log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}/bot/"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+app = create_app(FakePoe(FakePoeSettings.from_env()))
@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from typing import List, Optional
+
+import fastapi_poe as fp
+import asyncio
+
+
+def make_chunks(count: int, size: int) -> List[str]:
+    return [("x" * (size - 1)) + " " for _ in range(count)]
+
+
+def fake_bot_response(chunks: List[str], interval: float = 0.0, first_token_delay: float = 0.0):
+    async def get_bot_response(messages, bot_name, api_key, **kwargs):
+        if first_token_delay:
+            await asyncio.sleep(first_token_delay)
+        for chunk in chunks:
+            yield fp.PartialResponse(text=chunk)
+            if interval:
+                await asyncio.sleep(interval)
+            else:
+                await asyncio.sleep(0)
+    return get_bot_response
+
+
+@contextmanager
+def patched_upstream(chunks: List[str], interval: float = 0.0, first_token_delay: float = 0.0):
+    original = fp.get_bot_response
+    fp.get_bot_response = fake_bot_response(chunks, interval, first_token_delay)
+    try:
+        yield
+    finally:
+        fp.get_bot_response = original
+
+
+def sample_messages(count: int = 1, text: Optional[str] = None) -> List[fp.ProtocolMessage]:
+    return [
+        fp.ProtocolMessage(role="user", content=text or f"message {i}")
+        for i in range(count)
+    ]
@@ -0,0 +1,117 @@
+from benchmarks.fake_upstream import make_chunks, patched_upstream, sample_messages
+from config.settings import StreamSettings
+from services import poe_service
+from contextlib import aclosing
+from utils import stream_flush
+
+import fastapi_poe as fp
+import argparse
+import asyncio
+import sys
+import time
+
+
+POLICIES = {
+    "legacy_sleep_10ms": StreamSettings(flush_policy="immediate"),
+    "immediate": StreamSettings(flush_policy="immediate"),
+    "window_20ms": StreamSettings(flush_policy="window", flush_window_ms=20),
+    "bytes_512": StreamSettings(flush_policy="bytes", flush_max_bytes=512),
+}
+
+
+def _streams():
+    return {
+        "responses": lambda: poe_service.get_poe_response_streaming(
+            bot_name="bench", poe_api_key="bench",
+            protocol_messages=sample_messages(),
+            instructions_str="You are a helpful assistant.",
+            request_model_name="bench",
+        ),
+        "chat": lambda: poe_service.get_poe_chat_completion_streaming(
+            bot_name="bench", poe_api_key="bench",
+            protocol_messages=sample_messages(),
+            request_model_name="bench",
+        ),
+    }
+
+
+async def _run_once(make_stream, legacy_sleep: bool):
+    started = time.perf_counter()
+    first_byte = first_token = None
+    events = 0
+    async for frame in make_stream():
+        if isinstance(frame, bytes):
+            frame = frame.decode("utf-8")
+        now = time.perf_counter()
+        if first_byte is None:
+            first_byte = now - started
+        if first_token is None and ("output_text.delta" in frame or '"content"' in frame):
+            first_token = now - started
+        events += 1
+        if legacy_sleep:
+            await asyncio.sleep(0.01)
+    total = time.perf_counter() - started
+    return first_byte, first_token, events, total
+
+# Upstream partials any policy may read while the client is busy writing the
+# previous event; the window pump's queue is well under this.
+MAX_READ_AHEAD = 64
+
+
+async def _read_ahead(settings: StreamSettings, chunk_count: int, client_delay: float) -> int:
+    # A fast upstream and a slow client: count the partials upstream produces
+    # while the client is away, which a policy without backpressure buffers.
+    produced = 0
+
+    async def upstream():
+        nonlocal produced
+        for index in range(chunk_count):
+            produced += 1
+            yield fp.PartialResponse(text=f"{index} ")
+            await asyncio.sleep(0)
+
+    read_ahead = 0
+    async with aclosing(stream_flush.coalesce_partials(upstream(), settings)) as partials:
+        async for _ in partials:
+            before = produced
+            await asyncio.sleep(client_delay)
+            read_ahead = max(read_ahead, produced - before)
+    return read_ahead
+
+
+async def main(chunk_count: int, chunk_size: int, interval_ms: float) -> bool:
+    chunks = make_chunks(chunk_count, chunk_size)
+    print(f"upstream: {chunk_count} chunks x {chunk_size} bytes, {interval_ms} ms apart")
+    print(f"{'stream':<10} {'policy':<18} {'ttfb_ms':>9} {'ttft_ms':>9} {'events':>7} {'events/s':>10} {'total_ms':>9}")
+    for stream_name, make_stream in _streams().items():
+        for policy_name, settings in POLICIES.items():
+            stream_flush.stream_settings = settings
+            with patched_upstream(chunks, interval=interval_ms / 1000):
+                first_byte, first_token, events, total = await _run_once(
+                    make_stream, legacy_sleep=policy_name.startswith("legacy"))
+            print(
+                f"{stream_name:<10} {policy_name:<18} {first_byte * 1000:>9.2f} "
+                f"{(first_token or 0) * 1000:>9.2f} {events:>7} {events / total:>10.0f} {total * 1000:>9.1f}"
+            )
+
+    print(f"\n{'policy':<18} {'read_ahead':>10}  (slow client, {chunk_count} fast upstream chunks)")
+    failed = False
+    for policy_name, settings in POLICIES.items():
+        if policy_name.startswith("legacy"):
+            continue
+        read_ahead = await _read_ahead(settings, chunk_count, client_delay=0.005)
+        print(f"{policy_name:<18} {read_ahead:>10}")
+        failed = failed or read_ahead > MAX_READ_AHEAD
+    if failed:
+        print(f"a policy read more than {MAX_READ_AHEAD} partials ahead of a slow client")
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time-to-first-byte and events/s per stream flush policy.")
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--chunk-size", type=int, default=8)
+    parser.add_argument("--interval-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    if not asyncio.run(main(args.chunks, args.chunk_size, args.interval_ms)):
+        sys.exit(1)
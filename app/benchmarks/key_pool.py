@@ -0,0 +1,47 @@
+from config.settings import KeyPoolSettings
+from services.key_pool import KeyHealth, KeyPool
+
+import argparse
+import random
+import sys
+import time
+
+
+def cooling_pool(size: int, cooling: int) -> KeyPool:
+    settings = KeyPoolSettings()
+    keys = [KeyHealth(f"key-pool-benchmark-{index}", settings) for index in range(size)]
+    until = time.monotonic() + 3600
+    for index, health in enumerate(random.Random(size).sample(keys, cooling)):
+        health.cooldown_until = until + index
+    return KeyPool("benchmark", keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Key selection cost, and how often a cooling key is picked.")
+    parser.add_argument("--selections", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"{'keys':>5} {'cooling':>8} {'cooling_picks':>14} {'us/select':>10}")
+    failed = False
+    for size, cooling in ((4, 3), (16, 15), (16, 8), (64, 63), (64, 0), (4, 4)):
+        pool = cooling_pool(size, cooling)
+        now = time.monotonic()
+        started = time.perf_counter()
+        picks = [pool.select() for _ in range(args.selections)]
+        seconds = time.perf_counter() - started
+        cooling_picks = sum(1 for health in picks if health.cooldown_until > now)
+        print(f"{size:>5} {cooling:>8} {cooling_picks:>14} {seconds / args.selections * 1e6:>10.2f}")
+        # A cooling key may only be picked when every key is cooling, and
+        # then it must be the one that comes back first.
+        if cooling < size:
+            failed = failed or cooling_picks > 0
+        else:
+            soonest = min(pool.keys, key=lambda health: health.cooldown_until)
+            failed = failed or any(health is not soonest for health in picks)
+    if failed:
+        print("cooling keys were picked while keys that are not cooling were available")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
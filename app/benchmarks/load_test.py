@@ -0,0 +1,314 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = {
+    "responses": "/v1/responses",
+    "chat": "/v1/chat/completions",
+}
+
+DELTA_MARKERS = {
+    "responses": b'"type": "response.output_text.delta"',
+    "chat": b'"delta": {"content"',
+}
+
+FAILURE_MARKERS = (b'"status": "failed"', b'"refusal": "')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+@contextmanager
+def run_server(
+        target: str, port: int, env: Dict[str, str], log_path: str, workers: int = 1, extra_args: Sequence[str] = (),
+) -> Iterator[subprocess.Popen]:
+    command = [
+        sys.executable, "-m", "uvicorn", target,
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning", *extra_args,
+    ]
+    with open(log_path, "ab") as log_file:
+        process = subprocess.Popen(
+            command, cwd=APP_DIR, env={**os.environ, **env}, stdout=log_file, stderr=subprocess.STDOUT
+        )
+        try:
+            yield process
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def worker_pids(server_pid: int) -> List[int]:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                command = f.read()
+        except OSError:
+            continue
+        if int(fields[1]) == server_pid and b"resource_tracker" not in command:
+            pids.append(int(entry))
+    return pids
+
+
+def rss_by_pid(server_pid: int) -> Dict[str, Dict[str, float]]:
+    usage = {}
+    for pid in worker_pids(server_pid) or [server_pid]:
+        values = {}
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    name, _, value = line.partition(":")
+                    if name in ("VmRSS", "VmHWM"):
+                        values[name] = int(value.split()[0]) / 1024
+        except OSError:
+            continue
+        usage[str(pid)] = {"rss_mb": values.get("VmRSS", 0.0), "peak_rss_mb": values.get("VmHWM", 0.0)}
+    return usage
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "p50": percentile(values, 0.50),
+        "p99": percentile(values, 0.99),
+        "mean": sum(values) / len(values) if values else None,
+    }
+
+
+def request_payload(endpoint: str, stream: bool, prompt: str) -> Dict[str, Any]:
+    if endpoint == "responses":
+        return {"model": "fake-bot", "stream": stream, "input": [{"role": "user", "content": prompt}]}
+    return {"model": "fake-bot", "stream": stream, "messages": [{"role": "user", "content": prompt}]}
+
+
+async def timed_request(client: httpx.AsyncClient, endpoint: str, stream: bool, prompt: str, result: Dict[str, list]):
+    started = time.perf_counter()
+    marker = DELTA_MARKERS[endpoint]
+    failed = False
+    first_token_at = None
+    last_token_at = None
+    try:
+        async with client.stream("POST", ENDPOINTS[endpoint], json=request_payload(endpoint, stream, prompt)) as response:
+            if response.status_code != 200:
+                failed = True
+            async for line in response.aiter_lines():
+                encoded = line.encode()
+                if any(failure in encoded for failure in FAILURE_MARKERS):
+                    failed = True
+                if stream and marker in encoded:
+                    now = time.perf_counter()
+                    if first_token_at is None:
+                        first_token_at = now
+                    else:
+                        result["inter_token"].append(now - last_token_at)
+                    last_token_at = now
+    except httpx.HTTPError:
+        failed = True
+
+    finished = time.perf_counter()
+    result["latency"].append(finished - started)
+    if failed:
+        result["errors"].append(1)
+        return
+    result["ttft"].append((first_token_at if stream and first_token_at else finished) - started)
+
+
+async def run_scenario(base_url: str, endpoint: str, stream: bool, requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"authorization": "Bearer load-test-key"}
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=120.0) as client:
+        scratch: Dict[str, list] = {"latency": [], "ttft": [], "inter_token": [], "errors": []}
+        await asyncio.gather(*(timed_request(client, endpoint, stream, f"warmup {i}", scratch) for i in range(warmup)))
+
+        result: Dict[str, list] = {"latency": [], "ttft": [], "inter_token": [], "errors": []}
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(requests):
+            queue.put_nowait(index)
+
+        async def worker():
+            while not queue.empty():
+                index = queue.get_nowait()
+                await timed_request(client, endpoint, stream, f"prompt {index}", result)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    to_ms = lambda values: [value * 1000 for value in values]
+    return {
+        "endpoint": ENDPOINTS[endpoint],
+        "stream": stream,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(result["errors"]),
+        "duration_s": elapsed,
+        "rps": requests / elapsed if elapsed else 0.0,
+        "latency_ms": summarize(to_ms(result["latency"])),
+        "ttft_ms": summarize(to_ms(result["ttft"])),
+        "inter_token_ms": summarize(to_ms(result["inter_token"])),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(scenario["endpoint"], scenario["stream"]): scenario for scenario in baseline["scenarios"]}
+    print(f"\nChange vs {baseline_path} ({baseline.get('commit')}):")
+    for scenario in results["scenarios"]:
+        old = previous.get((scenario["endpoint"], scenario["stream"]))
+        if old is None:
+            continue
+        changes = []
+        for label, new_value, old_value in (
+            ("rps", scenario["rps"], old["rps"]),
+            ("ttft p50", scenario["ttft_ms"]["p50"], old["ttft_ms"]["p50"]),
+            ("ttft p99", scenario["ttft_ms"]["p99"], old["ttft_ms"]["p99"]),
+            ("itl p99", scenario["inter_token_ms"]["p99"], old["inter_token_ms"]["p99"]),
+        ):
+            if new_value is not None and old_value:
+                changes.append(f"{label} {100 * (new_value - old_value) / old_value:+.1f}%")
+        mode = "stream" if scenario["stream"] else "json"
+        print(f"  {scenario['endpoint']:>22} {mode:>6}: {', '.join(changes)}")
+
+
+def format_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def format_rss(rss_by_worker: Dict[str, Dict[str, float]]) -> str:
+    return ", ".join(f"{usage['rss_mb']:.0f}MB" for usage in rss_by_worker.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the adapter against a local fake Poe server.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario.")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--endpoints", default="responses,chat")
+    parser.add_argument("--modes", default="stream,json")
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--chunks", type=int, default=50)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of upstream calls with a slow first token.")
+    parser.add_argument("--slow-first-token-ms", type=float, default=3000.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-after", type=int, default=5, help="Chunks sent before an injected error.")
+    parser.add_argument("--error-kind", choices=("event", "retryable", "http"), default="event")
+    parser.add_argument("--adapter-env", action="append", default=[], help="Extra KEY=VALUE for the adapter.")
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--server-log", default=os.devnull, help="File receiving the fake server and adapter output.")
+    parser.add_argument("--baseline", help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    fake_env = {
+        "FAKE_POE_CHUNK_SIZE": str(args.chunk_size),
+        "FAKE_POE_CHUNKS": str(args.chunks),
+        "FAKE_POE_INTERVAL_MS": str(args.interval_ms),
+        "FAKE_POE_FIRST_TOKEN_MS": str(args.first_token_ms),
+        "FAKE_POE_ERROR_RATE": str(args.error_rate),
+        "FAKE_POE_ERROR_KIND": args.error_kind,
+        "FAKE_POE_ERROR_AFTER": str(args.error_after),
+        "FAKE_POE_SLOW_RATE": str(args.slow_rate),
+        "FAKE_POE_SLOW_FIRST_TOKEN_MS": str(args.slow_first_token_ms),
+    }
+    fake_port, adapter_port = free_port(), free_port()
+    adapter_env = {
+        "UPSTREAM_BASE_URL": f"http://127.0.0.1:{fake_port}/bot/",
+        "LOG_SAMPLE_RATE": "0",
+        "METRICS_DIR": tempfile.mkdtemp(prefix="poe-adapter-load-test-"),
+    }
+    adapter_env.update(item.split("=", 1) for item in args.adapter_env)
+
+    scenarios = []
+    with run_server("benchmarks.fake_poe_server:app", fake_port, fake_env, args.server_log) as fake_server:
+        wait_until_ready(f"http://127.0.0.1:{fake_port}/bot/ready", fake_server)
+        with run_server("main:app", adapter_port, adapter_env, args.server_log, args.workers) as adapter:
+            wait_until_ready(f"http://127.0.0.1:{adapter_port}/", adapter)
+            for endpoint in args.endpoints.split(","):
+                for mode in args.modes.split(","):
+                    scenario = asyncio.run(run_scenario(
+                        f"http://127.0.0.1:{adapter_port}", endpoint, mode == "stream",
+                        args.requests, args.concurrency, args.warmup,
+                    ))
+                    scenario["rss_by_worker"] = rss_by_pid(adapter.pid)
+                    scenarios.append(scenario)
+                    print(
+                        f"{scenario['endpoint']:>22} {mode:>6}: {scenario['rps']:8.1f} req/s"
+                        f"  ttft p50 {format_ms(scenario['ttft_ms']['p50'])}ms p99 {format_ms(scenario['ttft_ms']['p99'])}ms"
+                        f"  itl p50 {format_ms(scenario['inter_token_ms']['p50'])}ms p99 {format_ms(scenario['inter_token_ms']['p99'])}ms"
+                        f"  errors {scenario['errors']}"
+                        f"  rss {format_rss(scenario['rss_by_worker'])}"
+                    )
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": {**vars(args), "adapter_env": dict(item.split("=", 1) for item in args.adapter_env)},
+        "scenarios": scenarios,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from utils.message_mappers import MessageInterner, map_chat_messages, map_input_messages
+
+import argparse
+import json
+import time
+
+
+def conversation(turns: int):
+    items = [{"role": "system", "content": "You are terse."}]
+    for i in range(turns - 1):
+        if i % 2 == 0:
+            items.append({"role": "user", "content": f"question {i} " + "lorem " * 30})
+        else:
+            items.append({"role": "assistant", "content": f"answer {i} " + "ipsum " * 60})
+    return items
+
+
+def request_turns(items, length: int):
+    # Each request re-parses its body, so every content string is a fresh object.
+    parsed = json.loads(json.dumps(items[:length]))
+    return [(item["role"], item["content"]) for item in parsed]
+
+
+def replay(map_messages, items, step: int, interner):
+    requests = [request_turns(items, length) for length in range(step, len(items) + 1, step)]
+    outputs = []
+    started = time.perf_counter()
+    for turns in requests:
+        outputs.append(map_messages(turns, interner=interner))
+    return (time.perf_counter() - started) / len(requests) * 1000, outputs
+
+
+def dump(output):
+    messages = output[0] if isinstance(output, tuple) else output
+    return [m.model_dump() for m in messages]
+
+
+def main(turns: int, step: int, cache_bytes: int):
+    items = conversation(turns)
+    print(f"conversation of {turns} messages growing by {step} per request")
+    print(f"{'mapper':<20} {'uncached_ms':>12} {'interned_ms':>12} {'speedup':>8} {'hit_ratio':>10} {'cache_kb':>9}")
+    for name, map_messages in (("map_input_messages", map_input_messages), ("map_chat_messages", map_chat_messages)):
+        uncached_ms, uncached = replay(map_messages, items, step, None)
+        interner = MessageInterner(cache_bytes)
+        interned_ms, interned = replay(map_messages, items, step, interner)
+        assert [dump(output) for output in uncached] == [dump(output) for output in interned]
+        hit_ratio = interner.hits / max(interner.hits + interner.misses, 1)
+        print(f"{name:<20} {uncached_ms:>12.3f} {interned_ms:>12.3f} {uncached_ms / interned_ms:>7.1f}x "
+              f"{hit_ratio:>10.3f} {interner.current_bytes / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ProtocolMessage construction cost for a growing conversation.")
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--step", type=int, default=2)
+    parser.add_argument("--cache-bytes", type=int, default=16 * 1024 * 1024)
+    args = parser.parse_args()
+    main(args.turns, args.step, args.cache_bytes)
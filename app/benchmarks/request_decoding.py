@@ -0,0 +1,107 @@
+from starlette.requests import Request
+from models.request_models import ClientRequest
+from dependencies.request_body import decode_responses_request, decode_chat_completions_request
+
+import argparse
+import asyncio
+import json
+import time
+import fastapi_poe as fp
+
+
+def responses_body(turns: int) -> bytes:
+    items = [{"role": "system", "content": "You are terse."}]
+    for i in range(turns - 1):
+        if i % 2 == 0:
+            items.append({"role": "user", "content": [{"type": "input_text", "text": f"question {i} " + "lorem " * 30}]})
+        else:
+            items.append({"role": "assistant", "content": f"answer {i} " + "ipsum " * 60})
+    return json.dumps({"model": "bench", "input": items, "stream": True}).encode("utf-8")
+
+
+def chat_body(turns: int) -> bytes:
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} " + "lorem " * 40}
+        for i in range(turns)
+    ]
+    return json.dumps({"model": "bench", "messages": messages}).encode("utf-8")
+
+
+def make_request(body: bytes) -> Request:
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+    scope = {
+        "type": "http", "method": "POST", "path": "/", "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+    }
+    return Request(scope, receive)
+
+
+def legacy_responses(body: bytes):
+    request_data = ClientRequest.model_validate(json.loads(body), from_attributes=True)
+    protocol_messages = []
+    instructions_str = "You are a helpful assistant."
+    for msg in request_data.input:
+        text_content = msg.get_text_content()
+        poe_role = msg.role
+        if msg.role == "system":
+            instructions_str = text_content
+        if msg.role == "assistant":
+            poe_role = "bot"
+        elif msg.role not in ["system", "user", "bot"]:
+            poe_role = "user"
+        protocol_messages.append(fp.ProtocolMessage(role=poe_role, content=text_content))
+    return protocol_messages, instructions_str
+
+
+def legacy_chat(body: bytes):
+    request_data = ClientRequest.model_validate(json.loads(body), from_attributes=True)
+    protocol_messages = []
+    for msg in request_data.messages:
+        poe_role = msg.role
+        if msg.role == "assistant":
+            poe_role = "bot"
+        elif msg.role not in ["system", "user", "bot"]:
+            poe_role = "user"
+        protocol_messages.append(fp.ProtocolMessage(role=poe_role, content=msg.content))
+    return protocol_messages
+
+
+def _time_sync(fn, body: bytes, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(body)
+    return (time.perf_counter() - started) / iterations * 1000
+
+
+async def _time_async(decode, body: bytes, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await decode(make_request(body))
+    return (time.perf_counter() - started) / iterations * 1000
+
+
+async def main(turns: int, iterations: int):
+    rows = []
+    for name, body, legacy, decode in (
+        ("/v1/responses", responses_body(turns), legacy_responses, decode_responses_request),
+        ("/v1/chat/completions", chat_body(turns), legacy_chat, decode_chat_completions_request),
+    ):
+        decoded = await decode(make_request(body))
+        legacy_messages = legacy(body)
+        legacy_messages = legacy_messages[0] if isinstance(legacy_messages, tuple) else legacy_messages
+        assert [m.model_dump() for m in decoded.protocol_messages] == [m.model_dump() for m in legacy_messages]
+        rows.append((name, len(body), _time_sync(legacy, body, iterations), await _time_async(decode, body, iterations)))
+
+    print(f"{turns} messages per request, {iterations} iterations")
+    print(f"{'endpoint':<22} {'body_kb':>8} {'pydantic_ms':>12} {'fast_ms':>9} {'speedup':>8}")
+    for name, size, legacy_ms, fast_ms in rows:
+        print(f"{name:<22} {size / 1024:>8.0f} {legacy_ms:>12.2f} {fast_ms:>9.2f} {legacy_ms / fast_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Request decoding cost for large multi-turn payloads.")
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.iterations))
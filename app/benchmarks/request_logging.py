@@ -0,0 +1,129 @@
+from fastapi import Depends, FastAPI, Request
+from config.settings import LogSettings
+from dependencies import logging as request_logging
+from utils.log_pipeline import configure_logging
+
+import argparse
+import asyncio
+import httpx
+import io
+import json
+import logging
+import statistics
+import time
+
+
+legacy_logger = logging.getLogger("benchmarks.legacy_request_logging")
+
+
+async def legacy_log_request_body(request: Request) -> Request:
+    try:
+        body = await request.body()
+        if body:
+            legacy_logger.info(f"[{request.method} {request.url.path}] Request Body:\n {body.decode('utf-8')}")
+        else:
+            legacy_logger.info(f"[{request.method} {request.url.path}] Empty request body")
+    except Exception as e:
+        legacy_logger.error(f"[{request.method} {request.url.path}] Failed to log request body: {e}")
+
+
+async def legacy_log_request_header(request: Request) -> Request:
+    legacy_logger.info(f"[{request.url.path}] Headers: {dict(request.headers)}")
+
+
+class SlowSink(io.TextIOBase):
+    def __init__(self, latency_per_kb: float):
+        self.latency_per_kb = latency_per_kb
+        self.bytes_written = 0
+
+    def write(self, text: str) -> int:
+        self.bytes_written += len(text)
+        time.sleep(self.latency_per_kb * len(text) / 1024)
+        return len(text)
+
+
+def build_app(dependencies) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions", dependencies=[Depends(dependency) for dependency in dependencies])
+    async def endpoint(request: Request):
+        await request.body()
+        return {"ok": True}
+
+    return app
+
+
+def sample_body(turns: int) -> bytes:
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} " + "lorem ipsum " * 40}
+        for i in range(turns)
+    ]
+    return json.dumps({"model": "bench", "messages": messages}).encode("utf-8")
+
+
+async def drive(app: FastAPI, body: bytes, requests: int, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                await client.post(
+                    "/v1/chat/completions", content=body,
+                    headers={"Authorization": "Bearer secret", "Content-Type": "application/json"},
+                )
+                latencies.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return (
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        requests / elapsed,
+    )
+
+
+def report(name: str, result, sink: SlowSink):
+    p50, p99, rps = result
+    print(f"{name:<28} {p50:>8.2f} {p99:>8.2f} {rps:>8.0f} {sink.bytes_written / 1024:>10.0f}")
+
+
+def main(requests: int, concurrency: int, turns: int, latency_per_kb_ms: float):
+    body = sample_body(turns)
+    print(f"{requests} requests, concurrency {concurrency}, body {len(body) / 1024:.0f} KB, "
+          f"sink {latency_per_kb_ms} ms/KB")
+    print(f"{'pipeline':<28} {'p50_ms':>8} {'p99_ms':>8} {'req/s':>8} {'logged_kb':>10}")
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+
+    sink = SlowSink(latency_per_kb_ms / 1000)
+    root_logger.handlers[:] = [logging.StreamHandler(sink)]
+    result = asyncio.run(drive(build_app([legacy_log_request_body, legacy_log_request_header]), body, requests, concurrency))
+    report("legacy synchronous", result, sink)
+
+    variants = {
+        "queue, 4 KB cap": LogSettings(),
+        "queue, 4 KB cap, json": LogSettings(json_format=True),
+        "queue, 4 KB cap, 10% sample": LogSettings(sample_rate=0.1),
+    }
+    for name, settings in variants.items():
+        sink = SlowSink(latency_per_kb_ms / 1000)
+        request_logging.log_settings = settings
+        listener = configure_logging(settings, stream=sink)
+        app = build_app([request_logging.log_request_body, request_logging.log_request_header])
+        result = asyncio.run(drive(app, body, requests, concurrency))
+        listener.stop()
+        report(name, result, sink)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="p99 latency of request logging dependencies under load.")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=400)
+    parser.add_argument("--sink-ms-per-kb", type=float, default=0.02)
+    args = parser.parse_args()
+    main(args.requests, args.concurrency, args.turns, args.sink_ms_per_kb)
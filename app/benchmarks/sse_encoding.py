@@ -0,0 +1,78 @@
+from models.openai_types import ResponseTypes, OutputTextDelta, DeltaBase, ChoiceDelta, ChatCompletionBase
+from services.poe_service import compile_output_text_delta_frame, compile_chat_chunk_frame
+from utils.sse_utils import SSEFormatter
+
+import argparse
+import time
+import uuid
+
+
+SAMPLE_DELTAS = [
+    "Hello", " world", ", ", "\"quoted\"", "\n\n", "tab\there", "naïve café", "日本語",
+    "emoji 🚀", "back\\slash", "</script>", " ", " " * 40, "x" * 200,
+]
+
+
+def legacy_output_text_delta(item_id: str, text: str) -> str:
+    delta_data = OutputTextDelta(
+        type=ResponseTypes.OUTPUT_TEXT_DELTA.value,
+        item_id=item_id,
+        delta=text
+    )
+    return SSEFormatter.format_reponse(ResponseTypes.OUTPUT_TEXT_DELTA.value, delta_data.to_dict())
+
+
+def legacy_chat_chunk(base_response_args, system_fingerprint: str, text: str) -> str:
+    choice_data = ChoiceDelta(delta=DeltaBase(content=text).to_dict(), index=0)
+    chat_completion_data = ChatCompletionBase(
+        **base_response_args,
+        choices=[choice_data.to_dict()],
+        system_fingerprint=system_fingerprint
+    )
+    return SSEFormatter.format_chat_completion(chat_completion_data.to_dict())
+
+
+def _per_chunk_us(render, iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        render(SAMPLE_DELTAS[i % len(SAMPLE_DELTAS)])
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main(iterations: int):
+    item_id = f"msg-{uuid.uuid4().hex}"
+    base_response_args = {
+        "response_id": f"chatcmpl-{uuid.uuid4().hex}",
+        "model_name": "bench",
+        "created_at": int(time.time()),
+    }
+    system_fingerprint = f"fp_{uuid.uuid4().hex[:10]}"
+
+    delta_frame = compile_output_text_delta_frame(item_id)
+    chunk_frame = compile_chat_chunk_frame(base_response_args, system_fingerprint)
+
+    for text in SAMPLE_DELTAS:
+        assert delta_frame.render(text) == legacy_output_text_delta(item_id, text).encode("utf-8")
+        assert chunk_frame.render(text) == legacy_chat_chunk(base_response_args, system_fingerprint, text).encode("utf-8")
+
+    rows = [
+        ("response.output_text.delta", "pydantic+json.dumps",
+         _per_chunk_us(lambda text: legacy_output_text_delta(item_id, text).encode("utf-8"), iterations)),
+        ("response.output_text.delta", "frame template",
+         _per_chunk_us(delta_frame.render, iterations)),
+        ("chat.completion chunk", "pydantic+json.dumps",
+         _per_chunk_us(lambda text: legacy_chat_chunk(base_response_args, system_fingerprint, text).encode("utf-8"), iterations)),
+        ("chat.completion chunk", "frame template",
+         _per_chunk_us(chunk_frame.render, iterations)),
+    ]
+    print(f"outputs byte-identical for {len(SAMPLE_DELTAS)} sample deltas")
+    print(f"{'frame':<28} {'encoder':<22} {'us/chunk':>9}")
+    for frame, encoder, cost in rows:
+        print(f"{frame:<28} {encoder:<22} {cost:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-chunk SSE serialization cost.")
+    parser.add_argument("--iterations", type=int, default=50000)
+    args = parser.parse_args()
+    main(args.iterations)
@@ -0,0 +1,158 @@
+from typing import Dict, List
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BOT_NAME = "memory-benchmark-bot"
+INSTRUCTIONS = "You are a helpful assistant."
+MODES = ("responses-stream", "responses-json", "chat-stream", "chat-json")
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "\"quoted\"", "naïve", "line\n", "tab\t", "emoji 🙂")
+
+
+def status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+class GcMonitor:
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.pauses = [0.0, 0.0, 0.0]
+        self._started = 0.0
+
+    def __call__(self, phase: str, info: Dict[str, int]):
+        if phase == "start":
+            self._started = time.perf_counter()
+        else:
+            self.collections[info["generation"]] += 1
+            self.pauses[info["generation"]] += time.perf_counter() - self._started
+
+
+def upstream_chunks(chunks: int, chunk_size: int) -> List[str]:
+    rng = random.Random(0)
+    text = []
+    for _ in range(chunks):
+        chunk = ""
+        while len(chunk) < chunk_size:
+            chunk += rng.choice(WORDS) + " "
+        text.append(chunk)
+    return text
+
+
+async def consume_stream(stream) -> int:
+    size = 0
+    async for frame in stream:
+        size += len(frame)
+        # Hand control back like a socket write would, so every stream is
+        # in flight at once.
+        await asyncio.sleep(0)
+    return size
+
+
+async def run_streams(mode: str, streams: int) -> int:
+    from services import poe_service
+    from starlette.responses import JSONResponse
+    import fastapi_poe as fp
+
+    messages = [fp.ProtocolMessage(role="user", content="hello")]
+    endpoint, kind = mode.split("-")
+
+    async def one() -> int:
+        if endpoint == "responses":
+            args = dict(
+                bot_name=BOT_NAME, poe_api_key="memory-benchmark-key", protocol_messages=messages,
+                instructions_str=INSTRUCTIONS, request_model_name=BOT_NAME,
+            )
+            if kind == "stream":
+                return await consume_stream(poe_service.get_poe_response_streaming(**args))
+            return len(JSONResponse(await poe_service.get_poe_response_non_streaming(**args)).body)
+        args = dict(
+            bot_name=BOT_NAME, poe_api_key="memory-benchmark-key", protocol_messages=messages,
+            request_model_name=BOT_NAME,
+        )
+        if kind == "stream":
+            return await consume_stream(poe_service.get_poe_chat_completion_streaming(**args))
+        return len(JSONResponse(await poe_service.get_poe_chat_completion_non_streaming(**args)).body)
+
+    sizes = await asyncio.gather(*(one() for _ in range(streams)))
+    return sum(sizes)
+
+
+def child(mode: str, streams: int, chunks: int, chunk_size: int):
+    from services import poe_service
+    import fastapi_poe as fp
+
+    encoded_chunks = [chunk.encode("utf-8") for chunk in upstream_chunks(chunks, chunk_size)]
+
+    async def fake_upstream(*args, **kwargs):
+        # Decode every chunk like the HTTP client does, so each stream gets
+        # its own text objects instead of sharing cached ones.
+        for chunk in encoded_chunks:
+            yield fp.PartialResponse(text=chunk.decode("utf-8"))
+
+    poe_service.open_upstream = fake_upstream
+
+    gc.collect()
+    baseline_kb = status_kb("VmRSS")
+    monitor = GcMonitor()
+    gc.callbacks.append(monitor)
+    started = time.perf_counter()
+    sent = asyncio.run(run_streams(mode, streams))
+    elapsed = time.perf_counter() - started
+    gc.callbacks.remove(monitor)
+    print(json.dumps({
+        "mode": mode,
+        "peak_mb": (status_kb("VmHWM") - baseline_kb) / 1024,
+        "seconds": elapsed,
+        "sent_mb": sent / 1024 / 1024,
+        "gc_collections": monitor.collections,
+        "gc_pause_ms": [round(pause * 1000, 1) for pause in monitor.pauses],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS and GC work while many long responses finish at once.")
+    parser.add_argument("--streams", type=int, default=5000)
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--chunk-size", type=int, default=32)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.streams, args.chunks, args.chunk_size)
+        return
+
+    env = {
+        **os.environ,
+        "LOG_SAMPLE_RATE": "0",
+        "METRICS_DIR": tempfile.mkdtemp(prefix="poe-adapter-stream-memory-"),
+    }
+    print(f"{args.streams} concurrent responses of {args.chunks} chunks x {args.chunk_size} chars, one process per mode")
+    print(f"{'mode':<18} {'peak_rss_mb':>11} {'seconds':>8} {'sent_mb':>8} {'gc_gen0/1/2':>16} {'gc_pause_ms_gen2':>16}")
+    for mode in args.modes.split(","):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.stream_memory", "--child", mode,
+             "--streams", str(args.streams), "--chunks", str(args.chunks), "--chunk-size", str(args.chunk_size)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        collections = "/".join(str(count) for count in result["gc_collections"])
+        print(f"{mode:<18} {result['peak_mb']:>11.0f} {result['seconds']:>8.1f} {result['sent_mb']:>8.0f} "
+              f"{collections:>16} {result['gc_pause_ms'][2]:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
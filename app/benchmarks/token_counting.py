@@ -0,0 +1,109 @@
+from services.token_usage import IncrementalTokenCounter, count_input_tokens
+from utils.tokenizers import get_tokenizer
+from benchmarks.fake_upstream import sample_messages
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+
+WORDS = (
+    "the adapter streams partial responses from upstream bots while counting tokens "
+    "incrementally, 1234567 numbers, punctuation!? naïve café 日本語のテキスト emoji 🚀 "
+    "def function(argument): return value don't we'll it's 'quoted'"
+).split(" ")
+
+
+def sample_deltas(total_chars: int, delta_chars: int):
+    rng = random.Random(7)
+    text = []
+    size = 0
+    while size < total_chars:
+        word = rng.choice(WORDS) + rng.choice((" ", " ", " ", "  ", "\n", ", "))
+        text.append(word)
+        size += len(word)
+    joined = "".join(text)
+    return [joined[i:i + delta_chars] for i in range(0, len(joined), delta_chars)]
+
+
+async def incremental(bot_name: str, deltas, offload_chars: int) -> int:
+    counter = IncrementalTokenCounter(bot_name, offload_chars=offload_chars)
+    for delta in deltas:
+        counter.feed(delta)
+    return await counter.total()
+
+
+def random_splits(text: str, rng: random.Random, max_delta_chars: int):
+    deltas = []
+    start = 0
+    while start < len(text):
+        end = start + rng.randint(1, max_delta_chars)
+        deltas.append(text[start:end])
+        start = end
+    return deltas
+
+
+def split_mismatches(bot_name: str, text: str, checks: int) -> int:
+    # Carry the tail across deltas the way the counters do; wherever the
+    # deltas are cut, the total must equal the count of the whole text.
+    tokenizer = get_tokenizer(bot_name)
+    rng = random.Random(11)
+    mismatches = 0
+    for _ in range(checks):
+        sample_start = rng.randrange(max(len(text) - 400, 1))
+        sample = text[sample_start:sample_start + rng.randint(1, 400)]
+        tokens, tail = 0, ""
+        for delta in random_splits(sample, rng, rng.choice((2, 4, 12))):
+            complete, tail = tokenizer.count_complete(tail + delta)
+            tokens += complete
+        tokens += tokenizer.count(tail) if tail else 0
+        mismatches += tokens != tokenizer.count(sample)
+    return mismatches
+
+
+def main(bot_name: str, total_chars: int, delta_chars: int, split_checks: int):
+    deltas = sample_deltas(total_chars, delta_chars)
+    text = "".join(deltas)
+    tokenizer = get_tokenizer(bot_name)
+    megabytes = len(text.encode("utf-8")) / 1e6
+    print(f"bot {bot_name} ({type(tokenizer).__name__}/{tokenizer.family}), "
+          f"{megabytes:.1f} MB in {len(deltas)} deltas of {delta_chars} chars")
+    print(f"{'path':<34} {'tokens':>9} {'seconds':>8} {'MB/s':>7} {'Mtok/s':>7}")
+
+    def report(name, tokens, seconds):
+        print(f"{name:<34} {tokens:>9} {seconds:>8.3f} {megabytes / seconds:>7.1f} {tokens / seconds / 1e6:>7.2f}")
+
+    started = time.perf_counter()
+    full_tokens = tokenizer.count(text)
+    report("recount accumulated_text", full_tokens, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    naive_tokens = sum(tokenizer.count(delta) for delta in deltas)
+    report("count each delta separately", naive_tokens, time.perf_counter() - started)
+
+    for offload_chars in (512, 2048, 16384):
+        started = time.perf_counter()
+        tokens = asyncio.run(incremental(bot_name, deltas, offload_chars))
+        report(f"incremental, offload {offload_chars} chars", tokens, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    input_tokens = count_input_tokens(bot_name, sample_messages(500, text[:2000]))
+    report("input: 500 x 2000-char messages", input_tokens, time.perf_counter() - started)
+
+    if split_checks:
+        mismatches = split_mismatches(bot_name, text, split_checks)
+        print(f"random delta splits: {mismatches} of {split_checks} incremental counts differ from the whole-text count")
+        if mismatches:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput of the token counting path.")
+    parser.add_argument("--bot", default="GPT-4o")
+    parser.add_argument("--chars", type=int, default=2_000_000)
+    parser.add_argument("--delta-chars", type=int, default=12)
+    parser.add_argument("--split-checks", type=int, default=1000)
+    args = parser.parse_args()
+    main(args.bot, args.chars, args.delta_chars, args.split_checks)
@@ -0,0 +1,251 @@
+from pydantic import BaseModel
+from typing import ClassVar, List, Set, Tuple
+
+import os
+
+
+class EnvSettings(BaseModel):
+    env_prefix: ClassVar[str] = ""
+
+    @classmethod
+    def from_env(cls):
+        values = {}
+        for field_name in cls.model_fields:
+            env_name = f"{cls.env_prefix}{field_name}".upper()
+            if env_name in os.environ:
+                values[field_name] = os.environ[env_name]
+        return cls(**values)
+
+
+class StreamSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "STREAM_"
+
+    flush_policy: str = "immediate"
+    flush_window_ms: float = 20.0
+    flush_max_bytes: int = 512
+
+
+class UpstreamSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "UPSTREAM_"
+
+    base_url: str = "https://api.poe.com/bot/"
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 600.0
+    drain_timeout: float = 1.0
+
+
+class HedgeSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "HEDGE_"
+
+    enabled: bool = False
+    percentile: float = 95.0
+    min_samples: int = 20
+    fallback_delay: float = 2.0
+    min_delay: float = 0.25
+    max_delay: float = 10.0
+
+
+class RetrySettings(EnvSettings):
+    env_prefix: ClassVar[str] = "RETRY_"
+
+    attempts: int = 0
+    backoff: float = 0.25
+    max_backoff: float = 4.0
+
+
+class KeyPoolSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "KEY_POOL_"
+
+    file: str = ""
+    cooldown: float = 30.0
+    latency_alpha: float = 0.2
+    penalty_half_life: float = 60.0
+
+
+class RoutingSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "ROUTING_"
+
+    file: str = ""
+    reload_interval: float = 5.0
+    min_samples: int = 5
+    explore_rate: float = 0.05
+    error_penalty: float = 5.0
+    alpha: float = 0.2
+
+
+class CacheSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "CACHE_"
+
+    enabled: bool = False
+    max_bytes: int = 64 * 1024 * 1024
+    ttl_seconds: float = 300.0
+
+
+class SingleFlightSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "SINGLE_FLIGHT_"
+
+    enabled: bool = False
+
+
+class LogSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "LOG_"
+
+    sample_rate: float = 1.0
+    max_body_bytes: int = 4096
+    redact_headers: str = "authorization,x-api-key,cookie,proxy-authorization"
+    json_format: bool = False
+    queue_size: int = 10000
+
+    @property
+    def redacted_header_names(self) -> Set[str]:
+        return {name.strip().lower() for name in self.redact_headers.split(",") if name.strip()}
+
+
+class AdmissionSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "ADMISSION_"
+
+    per_key_limit: int = 0
+    per_bot_limit: int = 0
+    max_queue: int = 32
+    queue_timeout: float = 10.0
+    retry_after: int = 1
+
+
+class UsageSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "USAGE_"
+
+    use_tiktoken: bool = False
+    tokenizer_threads: int = 2
+    offload_chars: int = 2048
+    message_cache_size: int = 65536
+
+
+class MapperSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "MAPPER_"
+
+    cache_bytes: int = 16 * 1024 * 1024
+
+
+class TruncationSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "TRUNCATION_"
+
+    default_budget: int = 32000
+    bot_budgets: str = ""
+    reserve_tokens: int = 4096
+
+    @property
+    def budgets_by_prefix(self) -> List[Tuple[str, int]]:
+        budgets = []
+        for item in self.bot_budgets.split(","):
+            prefix, _, tokens = item.partition("=")
+            if prefix.strip() and tokens.strip():
+                budgets.append((prefix.strip().lower(), int(tokens)))
+        return sorted(budgets, key=lambda budget: len(budget[0]), reverse=True)
+
+
+class MetricsSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "METRICS_"
+
+    dir: str = ""
+    flush_interval: float = 1.0
+    max_bots: int = 100
+
+
+class ConversationSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "CONVERSATION_"
+
+    enabled: bool = False
+    db_path: str = ""
+    memory_bytes: int = 32 * 1024 * 1024
+    busy_timeout: float = 5.0
+    ttl_seconds: float = 30 * 24 * 3600.0
+    max_responses: int = 0
+    prune_interval: float = 300.0
+
+
+class BatchSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "BATCH_"
+
+    dir: str = ""
+    concurrency: int = 8
+    max_concurrency: int = 64
+    reorder_window: int = 1024
+    max_line_bytes: int = 4 * 1024 * 1024
+    checkpoint_interval: float = 1.0
+    retention_seconds: float = 86400.0
+
+
+class CompressionSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "COMPRESSION_"
+
+    enabled: bool = False
+    min_size: int = 1024
+    encodings: str = "zstd,br,gzip"
+    gzip_level: int = 6
+    brotli_quality: int = 4
+    zstd_level: int = 3
+
+    @property
+    def encoding_order(self) -> List[str]:
+        return [name.strip().lower() for name in self.encodings.split(",") if name.strip()]
+
+
+class WebSocketSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "WEBSOCKET_"
+
+    max_responses: int = 16
+    send_queue_size: int = 64
+
+
+class TraceSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "TRACE_"
+
+    sample_rate: float = 0.0
+    exporter: str = "stdout"
+    file: str = ""
+    queue_size: int = 10000
+
+
+class DebugSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "DEBUG_"
+
+    admin_keys: str = ""
+    max_profile_seconds: float = 60.0
+
+    @property
+    def admin_fingerprints(self) -> Set[str]:
+        return {key.strip().lower() for key in self.admin_keys.split(",") if key.strip()}
+
+
+class StartupSettings(EnvSettings):
+    env_prefix: ClassVar[str] = "STARTUP_"
+
+    defer_imports: bool = False
+    warm_connections: int = 0
+    warm_timeout: float = 5.0
+
+
+stream_settings = StreamSettings.from_env()
+upstream_settings = UpstreamSettings.from_env()
+hedge_settings = HedgeSettings.from_env()
+retry_settings = RetrySettings.from_env()
+key_pool_settings = KeyPoolSettings.from_env()
+routing_settings = RoutingSettings.from_env()
+cache_settings = CacheSettings.from_env()
+single_flight_settings = SingleFlightSettings.from_env()
+log_settings = LogSettings.from_env()
+admission_settings = AdmissionSettings.from_env()
+usage_settings = UsageSettings.from_env()
+mapper_settings = MapperSettings.from_env()
+truncation_settings = TruncationSettings.from_env()
+metrics_settings = MetricsSettings.from_env()
+conversation_settings = ConversationSettings.from_env()
+batch_settings = BatchSettings.from_env()
+startup_settings = StartupSettings.from_env()
+trace_settings = TraceSettings.from_env()
+debug_settings = DebugSettings.from_env()
+websocket_settings = WebSocketSettings.from_env()
+compression_settings = CompressionSettings.from_env()
@@ -1,20 +1,80 @@
-import logging
 from fastapi import Request
+from config.settings import log_settings
+from dependencies.request_body import RequestBody, load_request_body
+from utils.tracing import span
+
+import logging
+import random
 
 
 logger = logging.getLogger(__name__)
 
 
-async def log_request_body(request: Request) -> Request:
+def is_request_sampled(request: Request) -> bool:
+    sampled = getattr(request.state, "log_sampled", None)
+    if sampled is None:
+        sampled = log_settings.sample_rate >= 1.0 or random.random() < log_settings.sample_rate
+        request.state.log_sampled = sampled
+    return sampled
+
+
+def truncate_body(body: bytes, max_bytes: int) -> str:
+    if max_bytes <= 0 or len(body) <= max_bytes:
+        return body.decode("utf-8", errors="replace")
+    text = body[:max_bytes].decode("utf-8", errors="ignore")
+    return f"{text}... [truncated {len(body) - max_bytes} of {len(body)} bytes]"
+
+
+def redact_headers(headers) -> dict:
+    redacted_names = log_settings.redacted_header_names
+    return {
+        name: "[REDACTED]" if name.lower() in redacted_names else value
+        for name, value in headers.items()
+    }
+
+
+def summarize_body(request_body: RequestBody) -> dict:
     try:
-        body = await request.body()
-        if body:
-            logger.info(f"[{request.method} {request.url.path}] Request Body:\n {body.decode('utf-8')}")
-        else:
-            logger.info(f"[{request.method} {request.url.path}] Empty request body")
-    except Exception as e:
-        logger.error(f"[{request.method} {request.url.path}] Failed to log request body: {e}")
+        data = request_body.parse()
+    except Exception:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    summary = {"model": data.get("model"), "stream": data.get("stream", False)}
+    for field_name in ("input", "messages"):
+        if isinstance(data.get(field_name), list):
+            summary[f"{field_name}_count"] = len(data[field_name])
+    return summary
+
+
+async def log_request_body(request: Request) -> Request:
+    if not is_request_sampled(request):
+        return
+    with span("log_request_body"):
+        try:
+            request_body = await load_request_body(request)
+            body = request_body.raw
+            body_text = truncate_body(body, log_settings.max_body_bytes) if body else ""
+            if log_settings.json_format:
+                logger.info("Request body", extra={"request_log": {
+                    "method": request.method, "path": request.url.path,
+                    "body": body_text, "body_bytes": len(body),
+                    **summarize_body(request_body),
+                }})
+            elif body:
+                logger.info(f"[{request.method} {request.url.path}] Request Body:\n {body_text}")
+            else:
+                logger.info(f"[{request.method} {request.url.path}] Empty request body")
+        except Exception as e:
+            logger.error(f"[{request.method} {request.url.path}] Failed to log request body: {e}")
     
 
 async def log_request_header(request: Request) -> Request:
-    logger.info(f"[{request.url.path}] Headers: {dict(request.headers)}")
+    if not is_request_sampled(request):
+        return
+    with span("log_request_header"):
+        headers = redact_headers(request.headers)
+        if log_settings.json_format:
+            logger.info("Request headers", extra={"request_log": {"path": request.url.path, "headers": headers}})
+        else:
+            logger.info(f"[{request.url.path}] Headers: {headers}")
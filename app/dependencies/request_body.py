@@ -0,0 +1,227 @@
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from typing import Any, List, Optional, Tuple
+from models.request_models import MAX_STOP_SEQUENCES, ClientRequest, DecodedClientRequest
+from utils.message_mappers import map_chat_messages, map_input_messages
+from services.metrics import metrics_registry
+from utils.tracing import span
+
+import email.message
+import json
+import time
+
+
+_UNSET = object()
+
+Turns = List[Tuple[str, str]]
+DecodedFields = Tuple[
+    str, bool, Optional[str], Turns, Turns, Optional[str], bool, str, Optional[int], Optional[int], Tuple[str, ...]
+]
+
+TRUNCATION_MODES = ("auto", "disabled")
+
+
+class RequestBody:
+    def __init__(self, raw: bytes, content_type: Optional[str]):
+        self.raw = raw
+        self.content_type = content_type
+        self._parsed: Any = _UNSET
+        self._error: Optional[Exception] = None
+
+    def parse(self) -> Any:
+        if self._parsed is _UNSET and self._error is None:
+            try:
+                self._parsed = self._decode()
+            except Exception as e:
+                self._error = e
+        if self._error is not None:
+            raise self._error
+        return self._parsed
+
+    def _decode(self) -> Any:
+        if not self.raw:
+            return None
+        if not self.content_type:
+            return json.loads(self.raw)
+        message = email.message.Message()
+        message["content-type"] = self.content_type
+        if message.get_content_maintype() == "application":
+            subtype = message.get_content_subtype()
+            if subtype == "json" or subtype.endswith("+json"):
+                return json.loads(self.raw)
+        return self.raw
+
+
+async def load_request_body(request: Request) -> RequestBody:
+    request_body = getattr(request.state, "request_body", None)
+    if request_body is None:
+        request_body = RequestBody(await request.body(), request.headers.get("content-type"))
+        request.state.request_body = request_body
+    return request_body
+
+
+def _parse_or_raise(request_body: RequestBody) -> Any:
+    try:
+        return request_body.parse()
+    except json.JSONDecodeError as e:
+        raise RequestValidationError(
+            [
+                {
+                    "type": "json_invalid",
+                    "loc": ("body", e.pos),
+                    "msg": "JSON decode error",
+                    "input": {},
+                    "ctx": {"error": e.msg},
+                }
+            ],
+            body=e.doc,
+        ) from e
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="There was an error parsing the body") from e
+
+
+def _fast_turns(items: Any, allow_content_list: bool) -> Optional[Turns]:
+    if type(items) is not list:
+        return None
+    turns: Turns = []
+    for item in items:
+        if type(item) is not dict:
+            return None
+        role = item.get("role")
+        content = item.get("content")
+        if type(role) is not str:
+            return None
+        if type(content) is str:
+            turns.append((role, content))
+            continue
+        if not allow_content_list or type(content) is not list:
+            return None
+        for part in content:
+            if type(part) is not dict or type(part.get("text")) is not str:
+                return None
+            part_type = part.get("type")
+            if part_type is not None and type(part_type) is not str:
+                return None
+        turns.append((role, content[0]["text"] if content else ""))
+    return turns
+
+
+def _is_token_limit(value: Any) -> bool:
+    return value is None or (type(value) is int and value >= 1)
+
+
+def _fast_stop(value: Any) -> Optional[Tuple[str, ...]]:
+    if value is None:
+        return ()
+    if type(value) is str:
+        return (value,) if value else ()
+    if type(value) is not list or len(value) > MAX_STOP_SEQUENCES or any(type(stop) is not str for stop in value):
+        return None
+    return tuple(stop for stop in value if stop)
+
+
+def _fast_decode(data: Any) -> Optional[DecodedFields]:
+    if type(data) is not dict:
+        return None
+    model = data.get("model")
+    stream = data.get("stream", False)
+    service_tier = data.get("service_tier")
+    previous_response_id = data.get("previous_response_id")
+    store = data.get("store", True)
+    truncation = data.get("truncation", "disabled")
+    if type(model) is not str or type(stream) is not bool or type(store) is not bool:
+        return None
+    if type(truncation) is not str or truncation not in TRUNCATION_MODES:
+        return None
+    if service_tier is not None and type(service_tier) is not str:
+        return None
+    if previous_response_id is not None and type(previous_response_id) is not str:
+        return None
+    max_output_tokens = data.get("max_output_tokens")
+    max_completion_tokens = data.get("max_completion_tokens")
+    max_tokens = data.get("max_tokens")
+    if not (_is_token_limit(max_output_tokens) and _is_token_limit(max_completion_tokens) and _is_token_limit(max_tokens)):
+        return None
+    stop = _fast_stop(data.get("stop"))
+    if stop is None:
+        return None
+    input_turns = _fast_turns(data.get("input", []), allow_content_list=True)
+    message_turns = _fast_turns(data.get("messages", []), allow_content_list=False)
+    if input_turns is None or message_turns is None:
+        return None
+    return (
+        model, stream, service_tier, input_turns, message_turns, previous_response_id, store, truncation,
+        max_output_tokens, max_completion_tokens if max_completion_tokens is not None else max_tokens, stop,
+    )
+
+
+def _validated_decode(data: Any) -> DecodedFields:
+    if data is None:
+        raise RequestValidationError(
+            [{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}],
+            body=data,
+        )
+    try:
+        client_request = ClientRequest.model_validate(data, from_attributes=True)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)],
+            body=data,
+        ) from e
+    input_turns = [(msg.role, msg.get_text_content()) for msg in client_request.input]
+    message_turns = [(msg.role, msg.content) for msg in client_request.messages]
+    return (
+        client_request.model, client_request.stream, client_request.service_tier, input_turns, message_turns,
+        client_request.previous_response_id, client_request.store, client_request.truncation,
+        client_request.max_output_tokens,
+        client_request.max_completion_tokens if client_request.max_completion_tokens is not None else client_request.max_tokens,
+        client_request.stop_sequences(),
+    )
+
+
+def decode_responses_data(data: Any) -> DecodedClientRequest:
+    (
+        model, stream, service_tier, input_turns, _, previous_response_id, store, truncation, max_output_tokens, _, stop
+    ) = _fast_decode(data) or _validated_decode(data)
+    with span("map_messages"):
+        protocol_messages, instructions_str = map_input_messages(input_turns)
+    return DecodedClientRequest(
+        model, stream, service_tier, protocol_messages, instructions_str, previous_response_id, store, truncation,
+        max_output_tokens, stop,
+    )
+
+
+def decode_chat_completions_data(data: Any) -> DecodedClientRequest:
+    (
+        model, stream, service_tier, _, message_turns, _, _, _, _, max_tokens, stop
+    ) = _fast_decode(data) or _validated_decode(data)
+    with span("map_messages"):
+        protocol_messages = map_chat_messages(message_turns)
+    return DecodedClientRequest(
+        model, stream, service_tier, protocol_messages, max_output_tokens=max_tokens, stop=stop
+    )
+
+
+async def decode_responses_request(request: Request) -> DecodedClientRequest:
+    started = time.perf_counter()
+    with span("read_body"):
+        request_body = await load_request_body(request)
+    with span("parse_json"):
+        data = _parse_or_raise(request_body)
+    with span("decode"):
+        decoded = decode_responses_data(data)
+    metrics_registry.observe_parse("/v1/responses", time.perf_counter() - started)
+    return decoded
+
+
+async def decode_chat_completions_request(request: Request) -> DecodedClientRequest:
+    started = time.perf_counter()
+    with span("read_body"):
+        request_body = await load_request_body(request)
+    with span("parse_json"):
+        data = _parse_or_raise(request_body)
+    with span("decode"):
+        decoded = decode_chat_completions_data(data)
+    metrics_registry.observe_parse("/v1/chat/completions", time.perf_counter() - started)
+    return decoded
@@ -0,0 +1,8 @@
+from fastapi import Request
+from typing import Optional
+
+import httpx
+
+
+def get_upstream_session(request: Request) -> Optional[httpx.AsyncClient]:
+    return getattr(request.app.state, "upstream_session", None)
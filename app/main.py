@@ -1,27 +1,19 @@
-from fastapi import FastAPI, Request
-from api.v1.responses_endpoint import router as responses_router
+from config.settings import log_settings, startup_settings
+from utils.log_pipeline import configure_logging
+from utils.startup import DeferredApp, load_application
 
 import uvicorn
-import logging
-import sys
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
-)
+APPLICATION = "application:app"
 
+configure_logging(log_settings)
 
-app = FastAPI()
-app.include_router(responses_router)
-
-
-@app.get("/")
-@app.head("/")
-async def root():
-    return {"message": "API is running", "endpoint": "/v1/responses"}
+if startup_settings.defer_imports:
+    app = DeferredApp(APPLICATION)
+else:
+    app = load_application(APPLICATION)
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=2026)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=2026)
@@ -7,6 +7,8 @@ class ResponseTypes(Enum):
     CREATED = "response.created"
     IN_PROGRESS = "response.in_progress"
     COMPLETED = "response.completed"
+    INCOMPLETE = "response.incomplete"
+    CANCELLED = "response.cancelled"
     
     OUTPUT_ITEM_ADDED = "response.output_item.added"
     OUTPUT_ITEM_DONE = "response.output_item.done"
@@ -21,6 +23,7 @@ class ResponseTypes(Enum):
 class ResponseStatus(Enum):
     IN_PROGRESS = "in_progress"
     COMPLETED = "completed"
+    INCOMPLETE = "incomplete"
 
 
 class CustomBaseModel(BaseModel):
@@ -47,7 +50,7 @@ class ResponseBase(CustomBaseModel):
     incomplete_details: Optional[Any] = None
     max_output_tokens: Optional[Any] = None
     parallel_tool_calls: bool = True
-    previous_response_id: int = None
+    previous_response_id: Optional[str] = None
     reasoning: Dict[str, None] = Field(default_factory=lambda: {"effort": None, "summary": None})
     store: bool = True
     text: Dict[str, Dict[str, str]] = Field(default_factory=lambda: {"format": {"type": "text"}})
@@ -1,5 +1,10 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Union
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Literal, Optional, Tuple, Union
+
+import fastapi_poe as fp
+
+
+MAX_STOP_SEQUENCES = 4
 
 class ClientInputContentItem(BaseModel):
     text: str
@@ -33,3 +38,44 @@ class ClientRequest(BaseModel):
     messages: List[ClientMessage] = Field(default_factory=list) 
     stream: bool = False
     service_tier: Optional[str] = None
+    previous_response_id: Optional[str] = None
+    store: bool = True
+    truncation: Literal["auto", "disabled"] = "disabled"
+    max_output_tokens: Optional[int] = Field(None, ge=1)
+    max_tokens: Optional[int] = Field(None, ge=1)
+    max_completion_tokens: Optional[int] = Field(None, ge=1)
+    stop: Union[str, List[str], None] = None
+
+    @field_validator("stop")
+    @classmethod
+    def check_stop(cls, value: Union[str, List[str], None]) -> Union[str, List[str], None]:
+        if isinstance(value, list) and len(value) > MAX_STOP_SEQUENCES:
+            raise ValueError(f"at most {MAX_STOP_SEQUENCES} stop sequences are supported")
+        return value
+
+    def stop_sequences(self) -> Tuple[str, ...]:
+        stops = [self.stop] if isinstance(self.stop, str) else self.stop or []
+        return tuple(stop for stop in stops if stop)
+
+
+class DecodedClientRequest:
+    def __init__(
+            self, model: str, stream: bool, service_tier: Optional[str],
+            protocol_messages: List[fp.ProtocolMessage],
+            instructions_str: Optional[str] = None,
+            previous_response_id: Optional[str] = None,
+            store: bool = True,
+            truncation: str = "disabled",
+            max_output_tokens: Optional[int] = None,
+            stop: Tuple[str, ...] = (),
+    ):
+        self.model = model
+        self.stream = stream
+        self.service_tier = service_tier
+        self.protocol_messages = protocol_messages
+        self.instructions_str = instructions_str
+        self.previous_response_id = previous_response_id
+        self.store = store
+        self.truncation = truncation
+        self.max_output_tokens = max_output_tokens
+        self.stop = stop
@@ -0,0 +1,193 @@
+from config.settings import AdmissionSettings, admission_settings
+from collections import deque
+from contextlib import aclosing
+from services.metrics import metrics_registry
+from utils.request_keys import api_key_fingerprint
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+import asyncio
+import time
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, scope: str, retry_after: int):
+        super().__init__(f"Too many concurrent requests for this {scope}.")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: int, max_queue: int, queue_timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def idle(self) -> bool:
+        return self.active == 0 and not self._waiters
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done():
+                return True
+            waiter.cancel()
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionStats:
+    def __init__(self):
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def observe_wait(self, wait_seconds: float):
+        self.queued += 1
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+
+class Permit:
+    def __init__(self, limiters: List[Tuple[Dict[str, ConcurrencyLimiter], str, ConcurrencyLimiter]]):
+        self._limiters = limiters
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        for registry, name, limiter in self._limiters:
+            limiter.release()
+            if limiter.idle and registry.get(name) is limiter:
+                del registry[name]
+
+    async def __aenter__(self) -> "Permit":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    async def guard(self, stream: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        try:
+            async with aclosing(stream):
+                async for item in stream:
+                    yield item
+        finally:
+            self.release()
+
+
+class AdmissionController:
+    def __init__(self, settings: AdmissionSettings):
+        self.settings = settings
+        self.stats = AdmissionStats()
+        self._key_limiters: Dict[str, ConcurrencyLimiter] = {}
+        self._bot_limiters: Dict[str, ConcurrencyLimiter] = {}
+
+    @staticmethod
+    def key_label(poe_api_key: str) -> str:
+        return api_key_fingerprint(poe_api_key)[:12]
+
+    def _limiter(self, registry: Dict[str, ConcurrencyLimiter], name: str, limit: int) -> ConcurrencyLimiter:
+        limiter = registry.get(name)
+        if limiter is None:
+            limiter = ConcurrencyLimiter(limit, self.settings.max_queue, self.settings.queue_timeout)
+            registry[name] = limiter
+        return limiter
+
+    async def admit(self, poe_api_key: str, bot_name: str) -> Permit:
+        started = time.monotonic()
+        acquired = []
+        scopes = (
+            ("key", self._key_limiters, self.key_label(poe_api_key), self.settings.per_key_limit),
+            ("bot", self._bot_limiters, bot_name, self.settings.per_bot_limit),
+        )
+        for scope, registry, name, limit in scopes:
+            if limit <= 0:
+                continue
+            limiter = self._limiter(registry, name, limit)
+            try:
+                admitted = await limiter.acquire()
+            except BaseException:
+                Permit(acquired).release()
+                raise
+            if not admitted:
+                Permit(acquired).release()
+                if limiter.idle and registry.get(name) is limiter:
+                    del registry[name]
+                self.stats.rejected += 1
+                raise AdmissionRejected(scope, self.settings.retry_after)
+            acquired.append((registry, name, limiter))
+
+        wait_seconds = time.monotonic() - started
+        self.stats.admitted += 1
+        metrics_registry.histogram("poe_adapter_admission_wait_seconds", ()).observe(wait_seconds)
+        if wait_seconds > 0.001:
+            self.stats.observe_wait(wait_seconds)
+        return Permit(acquired)
+
+    def limiters(self) -> Iterator[Tuple[str, str, ConcurrencyLimiter]]:
+        # Copied first: the metrics flusher reads these from another thread.
+        for scope, registry in (("key", self._key_limiters), ("bot", self._bot_limiters)):
+            for name, limiter in list(registry.items()):
+                yield scope, name, limiter
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.stats.admitted,
+            "queued": self.stats.queued,
+            "rejected": self.stats.rejected,
+            "total_wait_seconds": self.stats.total_wait_seconds,
+            "max_wait_seconds": self.stats.max_wait_seconds,
+            "keys": {
+                name: {"active": limiter.active, "queue_depth": limiter.queue_depth}
+                for name, limiter in self._key_limiters.items()
+            },
+            "bots": {
+                name: {"active": limiter.active, "queue_depth": limiter.queue_depth}
+                for name, limiter in self._bot_limiters.items()
+            },
+        }
+
+
+def create_admission_controller(settings: AdmissionSettings) -> Optional[AdmissionController]:
+    if settings.per_key_limit <= 0 and settings.per_bot_limit <= 0:
+        return None
+    return AdmissionController(settings)
+
+
+admission_controller = create_admission_controller(admission_settings)
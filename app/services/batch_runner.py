@@ -0,0 +1,540 @@
+from config.settings import BatchSettings, batch_settings
+from dependencies.request_body import decode_chat_completions_data, decode_responses_data
+from fastapi.exceptions import RequestValidationError
+from services.poe_service import get_poe_response_non_streaming, get_poe_chat_completion_non_streaming
+from services.admission import AdmissionRejected, admission_controller
+from services.conversation_store import conversation_store
+from services.metrics import metrics_registry
+from utils.request_keys import api_key_fingerprint
+from fastapi_poe.client import BotError
+from collections import deque
+from contextlib import aclosing
+from functools import partial
+from typing import Any, AsyncIterator, BinaryIO, Callable, Deque, Dict, List, Optional, Tuple
+
+import fastapi_poe as fp
+import asyncio
+import fcntl
+import httpx
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+
+BATCH_ENDPOINTS = ("/v1/responses", "/v1/chat/completions")
+BATCH_ORDERS = ("input", "completion")
+BATCH_ID_PATTERN = re.compile(r"batch_[0-9a-f]{32}")
+
+READ_AHEAD_LINES = 256
+COPY_CHUNK_BYTES = 64 * 1024
+SWEEP_INTERVAL_SECONDS = 300.0
+
+
+class BatchLineError(Exception):
+    def __init__(self, status_code: int, code: str, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+class BatchBusy(Exception):
+    pass
+
+
+def validate_batch_options(endpoint: str, order: str, concurrency: int, settings: BatchSettings = batch_settings) -> int:
+    if endpoint not in BATCH_ENDPOINTS:
+        raise ValueError(f"Unsupported batch endpoint '{endpoint}'. Expected one of: {', '.join(BATCH_ENDPOINTS)}.")
+    if order not in BATCH_ORDERS:
+        raise ValueError(f"Unsupported batch order '{order}'. Expected one of: {', '.join(BATCH_ORDERS)}.")
+    return max(1, min(concurrency, settings.max_concurrency))
+
+
+def read_chunk(source: BinaryIO, max_line_bytes: int) -> List[Tuple[int, Optional[bytes]]]:
+    lines = []
+    while len(lines) < READ_AHEAD_LINES:
+        line = source.readline(max_line_bytes + 1)
+        if not line:
+            break
+        size = len(line)
+        if size > max_line_bytes and not line.endswith(b"\n"):
+            while line and not line.endswith(b"\n"):
+                line = source.readline(COPY_CHUNK_BYTES)
+                size += len(line)
+            lines.append((size, None))
+        else:
+            lines.append((size, line))
+    return lines
+
+
+def format_record(
+        index: int, custom_id: Optional[str],
+        response: Optional[Dict[str, Any]] = None, error: Optional[Dict[str, Any]] = None,
+) -> bytes:
+    record = {
+        "id": f"batch_req_{uuid.uuid4().hex}", "custom_id": custom_id, "line": index,
+        "response": response, "error": error,
+    }
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def format_validation_errors(e: RequestValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc'][1:]) or 'body'}: {error['msg']}" for error in e.errors()
+    )
+
+
+async def load_history(previous_response_id: Optional[str], poe_api_key: str) -> Tuple[fp.ProtocolMessage, ...]:
+    if previous_response_id is None:
+        return ()
+    history = None
+    if conversation_store is not None:
+        history = await conversation_store.load(previous_response_id, api_key_fingerprint(poe_api_key))
+    if history is None:
+        raise BatchLineError(400, "invalid_request", f"Previous response with id '{previous_response_id}' not found.")
+    return history
+
+
+async def call_admitted(call: Callable[[], Any], poe_api_key: str, bot_name: str) -> Dict[str, Any]:
+    if admission_controller is None:
+        return await call()
+    while True:
+        try:
+            permit = await admission_controller.admit(poe_api_key, bot_name)
+            break
+        except AdmissionRejected as e:
+            await asyncio.sleep(e.retry_after)
+    async with permit:
+        return await call()
+
+
+async def execute_request(
+        endpoint: str, body: Any, poe_api_key: str, session: Optional[httpx.AsyncClient] = None,
+) -> Dict[str, Any]:
+    if endpoint == "/v1/responses":
+        request_data = decode_responses_data(body)
+        if not request_data.protocol_messages:
+            raise BatchLineError(400, "invalid_request", "Messages list (derived from 'input') cannot be empty.")
+        history = await load_history(request_data.previous_response_id, poe_api_key)
+        call = partial(
+            get_poe_response_non_streaming,
+            bot_name=request_data.model,
+            poe_api_key=poe_api_key,
+            protocol_messages=request_data.protocol_messages,
+            instructions_str=request_data.instructions_str,
+            request_model_name=request_data.model,
+            session=session,
+            previous_response_id=request_data.previous_response_id,
+            history=history,
+            store=request_data.store and conversation_store is not None,
+            truncation=request_data.truncation,
+            max_output_tokens=request_data.max_output_tokens,
+            stop=request_data.stop,
+        )
+    elif endpoint == "/v1/chat/completions":
+        request_data = decode_chat_completions_data(body)
+        if not request_data.protocol_messages:
+            raise BatchLineError(400, "invalid_request", "Messages list (derived from 'message') cannot be empty.")
+        call = partial(
+            get_poe_chat_completion_non_streaming,
+            bot_name=request_data.model,
+            poe_api_key=poe_api_key,
+            protocol_messages=request_data.protocol_messages,
+            request_model_name=request_data.model,
+            session=session,
+            max_tokens=request_data.max_output_tokens,
+            stop=request_data.stop,
+        )
+    else:
+        raise BatchLineError(400, "invalid_url", f"Unsupported batch url '{endpoint}'.")
+    return await call_admitted(call, poe_api_key, request_data.model)
+
+
+async def execute_line(
+        index: int, raw: Optional[bytes], default_endpoint: str,
+        poe_api_key: str, session: Optional[httpx.AsyncClient] = None,
+) -> Tuple[bytes, bool]:
+    custom_id = None
+    try:
+        if raw is None:
+            raise BatchLineError(413, "line_too_large", "Line exceeds the maximum batch line size.")
+        try:
+            data = json.loads(raw)
+        except ValueError as e:
+            raise BatchLineError(400, "invalid_json", f"JSON decode error: {e}")
+        if type(data) is not dict:
+            raise BatchLineError(400, "invalid_request", "Each line must be a JSON object.")
+        if data.get("custom_id") is not None:
+            custom_id = str(data["custom_id"])
+        endpoint, body = default_endpoint, data
+        if type(data.get("body")) is dict:
+            endpoint, body = data.get("url") or default_endpoint, data["body"]
+        response = await execute_request(endpoint, body, poe_api_key, session)
+        return format_record(index, custom_id, response={"status_code": 200, "body": response}), True
+    except BatchLineError as e:
+        error = {"status_code": e.status_code, "code": e.code, "message": str(e)}
+    except RequestValidationError as e:
+        error = {"status_code": 422, "code": "invalid_request", "message": format_validation_errors(e)}
+    except BotError as e:
+        logger.error(f"Batch line {index} failed upstream: {e}")
+        error = {"status_code": 502, "code": "upstream_error", "message": str(e)}
+    except Exception as e:
+        logger.exception(f"Batch line {index} failed: {e}")
+        error = {"status_code": 500, "code": "internal_error", "message": "Internal error while running the request."}
+    return format_record(index, custom_id, error=error), False
+
+
+class BatchJob:
+    def __init__(
+            self, input_path: str, output_path: str, checkpoint_path: str,
+            endpoint: str, order: str, concurrency: int, owner: Optional[str] = None,
+            settings: BatchSettings = batch_settings,
+    ):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path
+        self.endpoint = endpoint
+        self.order = order
+        self.concurrency = concurrency
+        self.owner = owner
+        self.settings = settings
+        self.next_index = 0
+        self.input_offset = 0
+        self.written_ahead: Dict[int, int] = {}
+        self.output_bytes = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.done = False
+        self._output: Optional[BinaryIO] = None
+        self._lock_file = None
+        self._running = 0
+
+    @classmethod
+    def load(
+            cls, input_path: str, output_path: str, checkpoint_path: str,
+            settings: BatchSettings = batch_settings,
+    ) -> Optional["BatchJob"]:
+        try:
+            with open(checkpoint_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        job = cls(
+            input_path, output_path, checkpoint_path,
+            state["endpoint"], state["order"], state["concurrency"], state.get("owner"), settings,
+        )
+        job.next_index = state["next_index"]
+        job.input_offset = state["input_offset"]
+        job.written_ahead = {index: end_offset for index, end_offset in state["written_ahead"]}
+        job.output_bytes = state["output_bytes"]
+        job.succeeded = state["succeeded"]
+        job.failed = state["failed"]
+        job.done = state["done"]
+        return job
+
+    @property
+    def lines_done(self) -> int:
+        return self.next_index + len(self.written_ahead)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.endpoint, "order": self.order, "concurrency": self.concurrency, "owner": self.owner,
+            "next_index": self.next_index, "input_offset": self.input_offset,
+            "written_ahead": sorted(self.written_ahead.items()),
+            "output_bytes": self.output_bytes, "succeeded": self.succeeded, "failed": self.failed, "done": self.done,
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.endpoint, "order": self.order, "concurrency": self.concurrency,
+            "lines_done": self.lines_done, "succeeded": self.succeeded, "failed": self.failed, "done": self.done,
+        }
+
+    def acquire(self):
+        if self._lock_file is not None:
+            return
+        lock_file = open(f"{self.checkpoint_path}.lock", "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise BatchBusy(f"Batch checkpoint {self.checkpoint_path} is in use by another run.")
+        self._lock_file = lock_file
+
+    def release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def discard(self):
+        shutil.rmtree(os.path.dirname(self.checkpoint_path), ignore_errors=True)
+
+    async def receive_input(self, chunks: AsyncIterator[bytes]) -> int:
+        received = 0
+        pending = bytearray()
+        target = await asyncio.to_thread(open, self.input_path, "wb")
+        try:
+            async for chunk in chunks:
+                pending += chunk
+                received += len(chunk)
+                if len(pending) >= COPY_CHUNK_BYTES:
+                    await asyncio.to_thread(target.write, pending)
+                    pending = bytearray()
+            if pending:
+                await asyncio.to_thread(target.write, pending)
+        finally:
+            await asyncio.to_thread(target.close)
+        return received
+
+    def save(self):
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _sync_output(self):
+        self._output.flush()
+        os.fsync(self._output.fileno())
+
+    def _checkpoint(self):
+        self._sync_output()
+        self.save()
+
+    def _mark_written(self, index: int, end_offset: int):
+        if index != self.next_index:
+            self.written_ahead[index] = end_offset
+            return
+        self.next_index += 1
+        self.input_offset = end_offset
+        while self.next_index in self.written_ahead:
+            self.input_offset = self.written_ahead.pop(self.next_index)
+            self.next_index += 1
+
+    def _write(self, index: int, end_offset: int, record: bytes, succeeded: bool):
+        self._output.write(record)
+        self.output_bytes += len(record)
+        if succeeded:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        metrics_registry.inc("poe_adapter_batch_lines_total", (("outcome", "succeeded" if succeeded else "failed"),))
+        self._mark_written(index, end_offset)
+
+    def _has_room(self, pending: Dict[asyncio.Task, Tuple[int, int]]) -> bool:
+        if not pending:
+            return True
+        if self._running >= self.concurrency:
+            return False
+        if self.order == "input":
+            return len(pending) < self.settings.reorder_window
+        return len(self.written_ahead) < self.settings.reorder_window
+
+    async def _lines(self, source: BinaryIO) -> AsyncIterator[Tuple[int, int, Optional[bytes]]]:
+        index, offset = self.next_index, self.input_offset
+        while True:
+            chunk = await asyncio.to_thread(read_chunk, source, self.settings.max_line_bytes)
+            if not chunk:
+                return
+            for size, raw in chunk:
+                offset += size
+                yield index, offset, raw
+                index += 1
+
+    async def _execute(
+            self, source: BinaryIO, poe_api_key: str, session: Optional[httpx.AsyncClient],
+    ) -> AsyncIterator[bytes]:
+        pending: Dict[asyncio.Task, Tuple[int, int]] = {}
+        ordered: Deque[asyncio.Task] = deque()
+        finished: Deque[asyncio.Task] = deque()
+        wakeup = asyncio.Event()
+
+        def on_done(task: asyncio.Task):
+            self._running -= 1
+            finished.append(task)
+            wakeup.set()
+
+        last_checkpoint = time.monotonic()
+        exhausted = False
+        try:
+            async with aclosing(self._lines(source)) as lines:
+                while True:
+                    while not exhausted and self._has_room(pending):
+                        line = await anext(lines, None)
+                        if line is None:
+                            exhausted = True
+                            break
+                        index, end_offset, raw = line
+                        if index in self.written_ahead:
+                            continue
+                        if raw is not None and not raw.strip():
+                            self._mark_written(index, end_offset)
+                            continue
+                        task = asyncio.create_task(execute_line(index, raw, self.endpoint, poe_api_key, session))
+                        self._running += 1
+                        task.add_done_callback(on_done)
+                        pending[task] = (index, end_offset)
+                        if self.order == "input":
+                            ordered.append(task)
+                    if not pending and exhausted:
+                        break
+
+                    ready: List[asyncio.Task] = []
+                    if self.order == "input":
+                        finished.clear()
+                        while ordered and ordered[0].done():
+                            ready.append(ordered.popleft())
+                    else:
+                        while finished:
+                            ready.append(finished.popleft())
+                    if not ready:
+                        wakeup.clear()
+                        await wakeup.wait()
+                        continue
+
+                    for task in ready:
+                        index, end_offset = pending.pop(task)
+                        record, succeeded = task.result()
+                        self._write(index, end_offset, record, succeeded)
+                        yield record
+                    if time.monotonic() - last_checkpoint >= self.settings.checkpoint_interval:
+                        await asyncio.to_thread(self._checkpoint)
+                        last_checkpoint = time.monotonic()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def run(self, poe_api_key: str, session: Optional[httpx.AsyncClient] = None) -> AsyncIterator[bytes]:
+        self.acquire()
+        try:
+            self._output = open(self.output_path, "ab")
+            self._output.truncate(self.output_bytes)
+            with open(self.input_path, "rb") as source:
+                source.seek(self.input_offset)
+                async with aclosing(self._execute(source, poe_api_key, session)) as records:
+                    async for record in records:
+                        yield record
+            self.done = True
+            logger.info(
+                f"Batch {self.input_path} finished: {self.succeeded} succeeded, {self.failed} failed"
+            )
+        finally:
+            if self._output is not None:
+                self._checkpoint()
+                self._output.close()
+                self._output = None
+            self.release()
+
+    async def replay(self) -> AsyncIterator[bytes]:
+        remaining = self.output_bytes
+        with open(self.output_path, "rb") as f:
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(COPY_CHUNK_BYTES, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    async def stream(
+            self, poe_api_key: str, session: Optional[httpx.AsyncClient] = None, replay: bool = False,
+    ) -> AsyncIterator[bytes]:
+        self.acquire()
+        try:
+            if replay:
+                async with aclosing(self.replay()) as chunks:
+                    async for chunk in chunks:
+                        yield chunk
+            if not self.done:
+                async with aclosing(self.run(poe_api_key, session)) as records:
+                    async for record in records:
+                        yield record
+        finally:
+            self.release()
+
+
+def default_batch_dir() -> str:
+    return os.path.join(tempfile.gettempdir(), "poe-adapter-batches")
+
+
+def batch_paths(batch_id: str, settings: BatchSettings = batch_settings) -> Tuple[str, str, str]:
+    directory = os.path.join(settings.dir or default_batch_dir(), batch_id)
+    return (
+        os.path.join(directory, "input.jsonl"),
+        os.path.join(directory, "output.jsonl"),
+        os.path.join(directory, "checkpoint.json"),
+    )
+
+
+def new_batch_id() -> str:
+    return f"batch_{uuid.uuid4().hex}"
+
+
+def create_batch_job(
+        batch_id: str, endpoint: str, order: str, concurrency: int, owner: Optional[str],
+        settings: BatchSettings = batch_settings,
+) -> BatchJob:
+    input_path, output_path, checkpoint_path = batch_paths(batch_id, settings)
+    os.makedirs(os.path.dirname(input_path), exist_ok=True)
+    return BatchJob(input_path, output_path, checkpoint_path, endpoint, order, concurrency, owner, settings)
+
+
+def load_batch_job(batch_id: str, settings: BatchSettings = batch_settings) -> Optional[BatchJob]:
+    if not BATCH_ID_PATTERN.fullmatch(batch_id):
+        return None
+    return BatchJob.load(*batch_paths(batch_id, settings), settings)
+
+
+def last_modified(directory: str) -> float:
+    modified = os.stat(directory).st_mtime
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            modified = max(modified, entry.stat().st_mtime)
+    return modified
+
+
+def remove_expired_batches(settings: BatchSettings = batch_settings) -> int:
+    root = settings.dir or default_batch_dir()
+    cutoff = time.time() - settings.retention_seconds
+    try:
+        batch_ids = [name for name in os.listdir(root) if BATCH_ID_PATTERN.fullmatch(name)]
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for batch_id in batch_ids:
+        input_path, output_path, checkpoint_path = batch_paths(batch_id, settings)
+        job = BatchJob(input_path, output_path, checkpoint_path, "", "", 1, settings=settings)
+        try:
+            if last_modified(os.path.dirname(checkpoint_path)) >= cutoff:
+                continue
+            # A batch that is running or being resumed holds the lock.
+            job.acquire()
+        except (BatchBusy, FileNotFoundError):
+            continue
+        try:
+            job.discard()
+            removed += 1
+        finally:
+            job.release()
+    return removed
+
+
+async def run_batch_sweeper(settings: BatchSettings = batch_settings):
+    if settings.retention_seconds <= 0:
+        return
+    while True:
+        try:
+            removed = await asyncio.to_thread(remove_expired_batches, settings)
+            if removed:
+                logger.info(f"Removed {removed} batches unused for {settings.retention_seconds:g}s")
+        except OSError as e:
+            logger.error(f"Could not remove expired batches: {e}")
+        await asyncio.sleep(min(SWEEP_INTERVAL_SECONDS, settings.retention_seconds))
@@ -0,0 +1,325 @@
+from config.settings import ConversationSettings, conversation_settings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import fastapi_poe as fp
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+History = Tuple[fp.ProtocolMessage, ...]
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS conversations (
+        id INTEGER PRIMARY KEY,
+        parent_id INTEGER,
+        parent_length INTEGER,
+        length INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS turns (
+        conversation_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        PRIMARY KEY (conversation_id, position)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS responses (
+        id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        conversation_id INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)",
+    "CREATE INDEX IF NOT EXISTS responses_conversation ON responses (conversation_id)",
+    "CREATE INDEX IF NOT EXISTS conversations_parent ON conversations (parent_id)",
+)
+
+POINTER_BYTES = 8
+PRUNE_BATCH_ROWS = 1000
+
+
+class MemoryTier:
+    def __init__(self, max_bytes: int, ttl_seconds: float = 0.0):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.current_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[str, History, int, float]]" = OrderedDict()
+
+    def get(self, response_id: str, owner: str) -> Optional[History]:
+        entry = self._entries.get(response_id)
+        if entry is None or entry[0] != owner:
+            return None
+        if entry[3] < time.time():
+            self.current_bytes -= self._entries.pop(response_id)[2]
+            return None
+        self._entries.move_to_end(response_id)
+        return entry[1]
+
+    def put(self, response_id: str, owner: str, history: History, new_bytes: int, created_at: float):
+        size = len(response_id) + POINTER_BYTES * len(history) + new_bytes
+        if size > self.max_bytes:
+            return
+        if response_id in self._entries:
+            self.current_bytes -= self._entries.pop(response_id)[2]
+        expires_at = created_at + self.ttl_seconds if self.ttl_seconds > 0 else float("inf")
+        self._entries[response_id] = (owner, history, size, expires_at)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, _, evicted_size, _) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskTier:
+    def __init__(self, path: str, busy_timeout: float, ttl_seconds: float = 0.0, max_responses: int = 0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.ttl_seconds = ttl_seconds
+        self.max_responses = max_responses
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._connection = connection
+        return self._connection
+
+    def expired_before(self) -> float:
+        return time.time() - self.ttl_seconds if self.ttl_seconds > 0 else float("-inf")
+
+    def load(self, response_id: str, owner: str) -> Optional[Tuple[float, List[Tuple[str, str]]]]:
+        connection = self.connection
+        row = connection.execute(
+            "SELECT owner, conversation_id, length, created_at FROM responses WHERE id = ?", (response_id,)
+        ).fetchone()
+        if row is None or row[0] != owner or row[3] < self.expired_before():
+            return None
+        _, conversation_id, length, created_at = row
+
+        segments = []
+        while conversation_id is not None:
+            segments.append((conversation_id, length))
+            conversation_id, length = connection.execute(
+                "SELECT parent_id, parent_length FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+
+        turns: List[Tuple[str, str]] = []
+        for conversation_id, length in reversed(segments):
+            turns.extend(connection.execute(
+                "SELECT role, content FROM turns WHERE conversation_id = ? AND position < ? ORDER BY position",
+                (conversation_id, length),
+            ))
+        return created_at, turns
+
+    def save(
+            self, response_id: str, owner: str, previous_response_id: Optional[str],
+            new_turns: List[Tuple[str, str]], history: Sequence[fp.ProtocolMessage] = (),
+    ) -> float:
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            conversation_id = None
+            start = 0
+            parent = None
+            if previous_response_id is not None:
+                parent = connection.execute(
+                    "SELECT conversation_id, length FROM responses WHERE id = ?", (previous_response_id,)
+                ).fetchone()
+                if parent is None:
+                    # The previous response was pruned after it was loaded;
+                    # store the whole history as a new conversation.
+                    new_turns = [(message.role, message.content) for message in history] + new_turns
+            if parent is not None:
+                parent_id, parent_length = parent
+                (current_length,) = connection.execute(
+                    "SELECT length FROM conversations WHERE id = ?", (parent_id,)
+                ).fetchone()
+                if current_length == parent_length:
+                    conversation_id, start = parent_id, parent_length
+                    connection.execute(
+                        "UPDATE conversations SET length = ? WHERE id = ?", (start + len(new_turns), conversation_id)
+                    )
+                else:
+                    conversation_id = connection.execute(
+                        "INSERT INTO conversations (parent_id, parent_length, length) VALUES (?, ?, ?)",
+                        (parent_id, parent_length, len(new_turns)),
+                    ).lastrowid
+            else:
+                conversation_id = connection.execute(
+                    "INSERT INTO conversations (parent_id, parent_length, length) VALUES (NULL, NULL, ?)",
+                    (len(new_turns),),
+                ).lastrowid
+
+            connection.executemany(
+                "INSERT INTO turns (conversation_id, position, role, content) VALUES (?, ?, ?, ?)",
+                [(conversation_id, start + index, role, content) for index, (role, content) in enumerate(new_turns)],
+            )
+            created_at = time.time()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (id, owner, conversation_id, length, created_at) VALUES (?, ?, ?, ?, ?)",
+                (response_id, owner, conversation_id, start + len(new_turns), created_at),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return created_at
+
+    def _prunable(self, connection: sqlite3.Connection) -> List[Tuple[str, int]]:
+        rows = connection.execute(
+            "SELECT id, conversation_id FROM responses WHERE created_at < ? ORDER BY created_at LIMIT ?",
+            (self.expired_before(), PRUNE_BATCH_ROWS),
+        ).fetchall()
+        if rows or self.max_responses <= 0:
+            return rows
+        (count,) = connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count <= self.max_responses:
+            return []
+        return connection.execute(
+            "SELECT id, conversation_id FROM responses ORDER BY created_at LIMIT ?",
+            (min(count - self.max_responses, PRUNE_BATCH_ROWS),),
+        ).fetchall()
+
+    def _remove_orphans(self, connection: sqlite3.Connection, candidates: Set[int]) -> int:
+        # A conversation is kept while a response or a branch still points at
+        # it; removing a branch can orphan its parent in turn.
+        removed = 0
+        while candidates:
+            parents = set()
+            orphans = []
+            for conversation_id in candidates:
+                if connection.execute(
+                    "SELECT 1 FROM responses WHERE conversation_id = ? LIMIT 1", (conversation_id,)
+                ).fetchone() or connection.execute(
+                    "SELECT 1 FROM conversations WHERE parent_id = ? LIMIT 1", (conversation_id,)
+                ).fetchone():
+                    continue
+                row = connection.execute("SELECT parent_id FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+                if row is None:
+                    continue
+                orphans.append((conversation_id,))
+                if row[0] is not None:
+                    parents.add(row[0])
+            connection.executemany("DELETE FROM turns WHERE conversation_id = ?", orphans)
+            connection.executemany("DELETE FROM conversations WHERE id = ?", orphans)
+            removed += len(orphans)
+            candidates = parents
+        return removed
+
+    def prune(self) -> Tuple[int, int]:
+        connection = self.connection
+        responses = conversations = 0
+        while True:
+            # Short transactions, so saves from other workers are not held up.
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._prunable(connection)
+                connection.executemany("DELETE FROM responses WHERE id = ?", [(response_id,) for response_id, _ in rows])
+                conversations += self._remove_orphans(connection, {conversation_id for _, conversation_id in rows})
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            responses += len(rows)
+            if len(rows) < PRUNE_BATCH_ROWS:
+                return responses, conversations
+
+
+class ConversationStore:
+    def __init__(self, memory_bytes: int, disk: DiskTier):
+        self.memory = MemoryTier(memory_bytes, disk.ttl_seconds)
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-store")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def load(self, response_id: str, owner: str) -> Optional[History]:
+        history = self.memory.get(response_id, owner)
+        if history is not None:
+            self.memory_hits += 1
+            return history
+
+        stored = await self._run(self.disk.load, response_id, owner)
+        if stored is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        created_at, turns = stored
+        history = tuple(fp.ProtocolMessage(role=role, content=content) for role, content in turns)
+        self.memory.put(response_id, owner, history, sum(len(content) for _, content in turns), created_at)
+        return history
+
+    async def save(
+            self, response_id: str, owner: str, previous_response_id: Optional[str],
+            history: Sequence[fp.ProtocolMessage], new_messages: Sequence[fp.ProtocolMessage],
+    ):
+        new_turns = [(message.role, message.content) for message in new_messages]
+        created_at = await self._run(
+            self.disk.save, response_id, owner, previous_response_id if history else None, new_turns, history
+        )
+        self.memory.put(
+            response_id, owner, (*history, *new_messages), sum(len(content) for _, content in new_turns), created_at
+        )
+
+    async def prune(self) -> Tuple[int, int]:
+        return await self._run(self.disk.prune)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.current_bytes,
+            "memory_max_bytes": self.memory.max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "db_path": self.disk.path,
+        }
+
+
+def default_db_path() -> str:
+    return os.path.join(tempfile.gettempdir(), "poe-adapter-conversations.sqlite3")
+
+
+def create_conversation_store(settings: ConversationSettings) -> Optional[ConversationStore]:
+    if not settings.enabled:
+        return None
+    disk = DiskTier(
+        settings.db_path or default_db_path(), settings.busy_timeout, settings.ttl_seconds, settings.max_responses
+    )
+    return ConversationStore(settings.memory_bytes, disk)
+
+
+async def run_conversation_pruner(store: Optional[ConversationStore], settings: ConversationSettings):
+    if store is None or (settings.ttl_seconds <= 0 and settings.max_responses <= 0):
+        return
+    while True:
+        try:
+            responses, conversations = await store.prune()
+            if responses:
+                logger.info(f"Pruned {responses} stored responses and {conversations} conversations from {store.disk.path}")
+        except sqlite3.Error as e:
+            logger.error(f"Could not prune stored responses in {store.disk.path}: {e}")
+        await asyncio.sleep(settings.prune_interval)
+
+
+conversation_store = create_conversation_store(conversation_settings)
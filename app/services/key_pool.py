@@ -0,0 +1,186 @@
+from config.settings import KeyPoolSettings, key_pool_settings
+from utils.request_keys import api_key_fingerprint
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import fastapi_poe as fp
+import httpx
+import json
+import logging
+import math
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+LATENCY_FLOOR = 0.05
+
+
+class KeyHealth:
+    __slots__ = (
+        "key", "label", "settings", "in_flight", "latency", "penalty", "penalty_at",
+        "cooldown_until", "requests", "rate_limits",
+    )
+
+    def __init__(self, key: str, settings: KeyPoolSettings):
+        self.key = key
+        self.label = api_key_fingerprint(key)[:12]
+        self.settings = settings
+        self.in_flight = 0
+        self.latency = 0.0
+        self.penalty = 0.0
+        self.penalty_at = 0.0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.rate_limits = 0
+
+    def current_penalty(self, now: float) -> float:
+        if not self.penalty:
+            return 0.0
+        return self.penalty * 2 ** (-(now - self.penalty_at) / self.settings.penalty_half_life)
+
+    def score(self, now: float) -> float:
+        if now < self.cooldown_until:
+            return math.inf
+        return (self.latency + LATENCY_FLOOR) * (1 + self.in_flight) * (1 + self.current_penalty(now))
+
+    def observe_latency(self, seconds: float):
+        alpha = self.settings.latency_alpha
+        self.latency = seconds if not self.latency else self.latency + alpha * (seconds - self.latency)
+
+    def rate_limited(self, retry_after: Optional[float]) -> float:
+        now = time.monotonic()
+        self.rate_limits += 1
+        self.penalty = self.current_penalty(now) + 1
+        self.penalty_at = now
+        cooldown = retry_after if retry_after is not None else self.settings.cooldown
+        self.cooldown_until = max(self.cooldown_until, now + cooldown)
+        return cooldown
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "latency_seconds": round(self.latency, 4),
+            "penalty": round(self.current_penalty(now), 4),
+            "cooldown_seconds": round(max(self.cooldown_until - now, 0.0), 3),
+            "requests": self.requests,
+            "rate_limits": self.rate_limits,
+        }
+
+
+class KeyPool:
+    def __init__(self, name: str, keys: List[KeyHealth]):
+        self.name = name
+        self.keys = keys
+
+    def select(self) -> KeyHealth:
+        keys = self.keys
+        if len(keys) == 1:
+            return keys[0]
+        first = random.randrange(len(keys))
+        second = random.randrange(len(keys) - 1)
+        if second >= first:
+            second += 1
+        a, b = keys[first], keys[second]
+        now = time.monotonic()
+        score_a, score_b = a.score(now), b.score(now)
+        if score_a == score_b == math.inf:
+            return self._fallback(now)
+        return a if score_a <= score_b else b
+
+    def _fallback(self, now: float) -> KeyHealth:
+        # Both samples are cooling down; scan once, from a random start so the
+        # load spreads, for the first key that is not. Only when the whole
+        # pool is cooling does the key that comes back soonest win.
+        keys = self.keys
+        start = random.randrange(len(keys))
+        for index in range(start, start + len(keys)):
+            health = keys[index % len(keys)]
+            if now >= health.cooldown_until:
+                return health
+        return min(keys, key=lambda health: health.cooldown_until)
+
+    async def track(self, health: KeyHealth, partials: AsyncIterator[fp.PartialResponse]) -> AsyncIterator[fp.PartialResponse]:
+        health.requests += 1
+        health.in_flight += 1
+        started = time.perf_counter()
+        waiting = True
+        try:
+            async with aclosing(partials):
+                async for partial in partials:
+                    if waiting and partial.text:
+                        health.observe_latency(time.perf_counter() - started)
+                        waiting = False
+                    yield partial
+        except Exception:
+            if waiting:
+                health.observe_latency(time.perf_counter() - started)
+            raise
+        finally:
+            health.in_flight -= 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {health.label: health.to_dict(now) for health in self.keys}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+class KeyPoolRegistry:
+    def __init__(self, pools: Dict[str, KeyPool], client_pools: Dict[str, str]):
+        self.pools = pools
+        self._client_pools = {fingerprint: pools[name] for fingerprint, name in client_pools.items()}
+        self._keys = {health.key: health for pool in pools.values() for health in pool.keys}
+
+    def pool_for(self, poe_api_key: str) -> Optional[KeyPool]:
+        return self._client_pools.get(api_key_fingerprint(poe_api_key))
+
+    async def observe_response(self, response: httpx.Response):
+        if response.status_code != 429:
+            return
+        authorization = response.request.headers.get("authorization", "")
+        health = self._keys.get(authorization[7:] if authorization.lower().startswith("bearer ") else authorization)
+        if health is None:
+            return
+        cooldown = health.rate_limited(parse_retry_after(response.headers.get("retry-after")))
+        logger.warning(f"Upstream key {health.label} was rate limited, cooling down for {cooldown:.1f}s")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: pool.to_dict() for name, pool in self.pools.items()}
+
+
+def load_key_pools(path: str, settings: KeyPoolSettings) -> KeyPoolRegistry:
+    with open(path) as f:
+        config = json.load(f)
+    pools = {
+        name: KeyPool(name, [KeyHealth(key, settings) for key in dict.fromkeys(keys)])
+        for name, keys in config.get("pools", {}).items()
+    }
+    for name, pool in pools.items():
+        if not pool.keys:
+            raise ValueError(f"Key pool '{name}' in {path} has no keys")
+    client_pools = {fingerprint.lower(): name for fingerprint, name in config.get("clients", {}).items()}
+    for name in client_pools.values():
+        if name not in pools:
+            raise ValueError(f"Unknown key pool '{name}' referenced in {path}")
+    return KeyPoolRegistry(pools, client_pools)
+
+
+def create_key_pool_registry(settings: KeyPoolSettings) -> Optional[KeyPoolRegistry]:
+    if not settings.file:
+        return None
+    registry = load_key_pools(settings.file, settings)
+    logger.info(f"Loaded {len(registry.pools)} upstream key pools from {settings.file}")
+    return registry
+
+
+key_pool_registry = create_key_pool_registry(key_pool_settings)
@@ -0,0 +1,398 @@
+from config.settings import MetricsSettings, metrics_settings
+from bisect import bisect_left
+from contextlib import aclosing
+from fastapi_poe.client import BotError
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import fastapi_poe as fp
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+Labels = Tuple[Tuple[str, str], ...]
+Series = Tuple[str, Labels, Any]
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PARSE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+RATE_BUCKETS = (1.0, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0, 320.0, 640.0)
+
+METRIC_FAMILIES: Dict[str, Tuple[str, str, Optional[Sequence[float]]]] = {
+    "poe_adapter_time_to_first_token_seconds": ("histogram", "Time from opening an upstream response to its first text chunk.", LATENCY_BUCKETS),
+    "poe_adapter_inter_token_seconds": ("histogram", "Gap between consecutive upstream text chunks.", GAP_BUCKETS),
+    "poe_adapter_upstream_duration_seconds": ("histogram", "Duration of upstream responses that ran to completion or failed.", LATENCY_BUCKETS),
+    "poe_adapter_request_parse_seconds": ("histogram", "Time spent reading, parsing and mapping a request body.", PARSE_BUCKETS),
+    "poe_adapter_output_tokens_per_second": ("histogram", "Output tokens per second measured from the first token.", RATE_BUCKETS),
+    "poe_adapter_output_tokens_total": ("counter", "Output tokens produced.", None),
+    "poe_adapter_upstream_errors_total": ("counter", "Upstream failures by kind (error_response, bot_error, exception) and type.", None),
+    "poe_adapter_active_streams": ("gauge", "Upstream responses currently in flight.", None),
+    "poe_adapter_upstream_hedges_total": ("counter", "Hedged upstream requests by the attempt that produced the first token (primary, hedge).", None),
+    "poe_adapter_route_selections_total": ("counter", "Model alias requests by the bot that served them.", None),
+    "poe_adapter_route_fallbacks_total": ("counter", "Model alias requests that fell back because a bot failed before its first token.", None),
+    "poe_adapter_upstream_key_in_flight": ("gauge", "Upstream calls in flight per pooled key.", None),
+    "poe_adapter_upstream_key_requests_total": ("counter", "Upstream calls per pooled key.", None),
+    "poe_adapter_upstream_key_rate_limits_total": ("counter", "Rate-limit responses per pooled key.", None),
+    "poe_adapter_upstream_retries_total": ("counter", "Upstream requests retried after a transient error before the first token, by error.", None),
+    "poe_adapter_streams_total": ("counter", "Client streams by outcome (completed, cancelled).", None),
+    "poe_adapter_upstream_pool_connections_total": ("counter", "Upstream requests by connection reuse (hit, miss).", None),
+    "poe_adapter_admission_requests_total": ("counter", "Admission decisions by outcome (admitted, queued, rejected).", None),
+    "poe_adapter_admission_wait_seconds_total": ("counter", "Total time requests waited for an admission slot.", None),
+    "poe_adapter_admission_wait_seconds": ("histogram", "Time each admitted request waited for its admission slots.", LATENCY_BUCKETS),
+    "poe_adapter_admission_queue_depth": ("gauge", "Requests waiting for an admission slot, by scope (key, bot) and name.", None),
+    "poe_adapter_admission_active": ("gauge", "Admitted requests holding a slot, by scope (key, bot) and name.", None),
+    "poe_adapter_response_cache_lookups_total": ("counter", "Response cache lookups by result (hit, miss).", None),
+    "poe_adapter_response_cache_bytes": ("gauge", "Bytes held by the response cache.", None),
+    "poe_adapter_single_flight_requests_total": ("counter", "Single-flight requests by role (started, joined).", None),
+    "poe_adapter_log_records_dropped_total": ("counter", "Log records dropped because the log queue was full.", None),
+    "poe_adapter_output_limit_hits_total": ("counter", "Responses cut short by max_output_tokens or a stop sequence, by endpoint and reason.", None),
+    "poe_adapter_compression_input_bytes_total": ("counter", "Response bytes before compression, by encoding.", None),
+    "poe_adapter_compression_output_bytes_total": ("counter", "Response bytes after compression, by encoding.", None),
+    "poe_adapter_websocket_responses_total": ("counter", "Responses streamed over WebSocket by outcome (completed, cancelled, failed).", None),
+    "poe_adapter_message_cache_lookups_total": ("counter", "Mapped request messages by prefix cache result (hit, miss).", None),
+    "poe_adapter_message_cache_bytes": ("gauge", "Approximate bytes held by the message prefix cache.", None),
+    "poe_adapter_conversation_lookups_total": ("counter", "previous_response_id lookups by result (memory, disk, miss).", None),
+    "poe_adapter_conversation_memory_bytes": ("gauge", "Approximate bytes held by the in-memory conversation tier.", None),
+    "poe_adapter_batch_lines_total": ("counter", "Batch lines written by outcome (succeeded, failed).", None),
+}
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class UpstreamObserver:
+    def __init__(self, registry: "MetricsRegistry", endpoint: str, bot_name: str):
+        self.registry = registry
+        self.labels: Labels = (("endpoint", endpoint), ("bot", registry.bot_label(bot_name)))
+        self.ttft = registry.histogram("poe_adapter_time_to_first_token_seconds", self.labels)
+        self.gap = registry.histogram("poe_adapter_inter_token_seconds", self.labels)
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def _error(self, kind: str, error_type: str):
+        self.registry.inc("poe_adapter_upstream_errors_total", self.labels + (("kind", kind), ("type", error_type)))
+
+    @staticmethod
+    def _bot_error_type(error: BotError) -> str:
+        if error.args and isinstance(error.args[0], str):
+            try:
+                return str(json.loads(error.args[0]).get("error_type") or "bot_error")
+            except (ValueError, AttributeError):
+                pass
+        return "bot_error"
+
+    async def track(self, partials: AsyncIterator[fp.PartialResponse]) -> AsyncIterator[fp.PartialResponse]:
+        self.registry.add("poe_adapter_active_streams", self.labels, 1)
+        try:
+            async with aclosing(partials):
+                async for partial in partials:
+                    if isinstance(partial, fp.ErrorResponse):
+                        self._error("error_response", str(partial.error_type or "unknown"))
+                    elif partial.text:
+                        now = time.perf_counter()
+                        if self.last_token_at is None:
+                            self.first_token_at = now
+                            self.ttft.observe(now - self.started_at)
+                        else:
+                            self.gap.observe(now - self.last_token_at)
+                        self.last_token_at = now
+                    yield partial
+            self._finish()
+        except BotError as e:
+            self._error("bot_error", self._bot_error_type(e))
+            self._finish()
+            raise
+        except Exception as e:
+            self._error("exception", type(e).__name__)
+            self._finish()
+            raise
+        finally:
+            self.registry.add("poe_adapter_active_streams", self.labels, -1)
+
+    def _finish(self):
+        self.finished_at = time.perf_counter()
+        self.registry.histogram("poe_adapter_upstream_duration_seconds", self.labels).observe(self.finished_at - self.started_at)
+
+    def add_output_tokens(self, output_tokens: int):
+        self.registry.inc("poe_adapter_output_tokens_total", self.labels, output_tokens)
+        if self.first_token_at is None or self.finished_at is None:
+            return
+        elapsed = self.finished_at - self.first_token_at
+        if elapsed > 0:
+            self.registry.histogram("poe_adapter_output_tokens_per_second", self.labels).observe(output_tokens / elapsed)
+
+
+class MetricsRegistry:
+    def __init__(self, max_bots: int):
+        self.max_bots = max_bots
+        self._bots = set()
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._values: Dict[Tuple[str, Labels], float] = {}
+        self._collectors: List[Callable[[], Iterable[Series]]] = []
+
+    def bot_label(self, bot_name: str) -> str:
+        if bot_name in self._bots:
+            return bot_name
+        if len(self._bots) >= self.max_bots:
+            return "other"
+        self._bots.add(bot_name)
+        return bot_name
+
+    def histogram(self, name: str, labels: Labels) -> Histogram:
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = Histogram(METRIC_FAMILIES[name][2])
+            self._histograms[(name, labels)] = histogram
+        return histogram
+
+    def add(self, name: str, labels: Labels, amount: float):
+        key = (name, labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def inc(self, name: str, labels: Labels, amount: float = 1):
+        self.add(name, labels, amount)
+
+    def add_collector(self, collector: Callable[[], Iterable[Series]]):
+        self._collectors.append(collector)
+
+    def observe_upstream(self, endpoint: str, bot_name: str) -> UpstreamObserver:
+        return UpstreamObserver(self, endpoint, bot_name)
+
+    def observe_parse(self, endpoint: str, seconds: float):
+        self.histogram("poe_adapter_request_parse_seconds", (("endpoint", endpoint),)).observe(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        series: List[Series] = [(name, labels, value) for (name, labels), value in self._values.items()]
+        series.extend(
+            (name, labels, {"counts": list(histogram.counts), "sum": histogram.sum})
+            for (name, labels), histogram in self._histograms.items()
+        )
+        for collector in self._collectors:
+            try:
+                series.extend(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        return {"pid": os.getpid(), "written_at": time.time(), "series": series}
+
+
+def process_start_time(pid: int) -> Optional[int]:
+    # Field 22 of /proc/<pid>/stat, in clock ticks since boot; with the pid it
+    # names one process even after the pid is reused.
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def is_alive(pid: int, started: Optional[int] = None) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return started is None or process_start_time(pid) in (None, started)
+
+
+class MetricsStore:
+    RETIRED_FILE = "retired.json"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.started = process_start_time(os.getpid())
+        self.path = os.path.join(directory, f"{os.getpid()}-{self.started or 0}.json")
+        self.lock_path = os.path.join(directory, "retire.lock")
+        self.retired_path = os.path.join(directory, self.RETIRED_FILE)
+
+    def _write_json(self, path: str, data: Dict[str, Any]):
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    def write(self, snapshot: Dict[str, Any]):
+        self._write_json(self.path, {**snapshot, "started": self.started})
+
+    def _read_snapshots(self) -> Dict[str, Dict[str, Any]]:
+        snapshots = {}
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, file_name)) as f:
+                    snapshots[file_name] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def read_all(self) -> List[Dict[str, Any]]:
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            snapshots = self._read_snapshots()
+            retired = snapshots.pop(self.RETIRED_FILE, None) or {"series": [], "folded": []}
+            dead = [
+                file_name for file_name, snapshot in snapshots.items()
+                if not is_alive(snapshot["pid"], snapshot.get("started"))
+            ]
+            if dead:
+                retired = self._retire(retired, {file_name: snapshots.pop(file_name) for file_name in dead})
+        return [*snapshots.values(), retired]
+
+    def _retire(self, retired: Dict[str, Any], dead: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        # Counters and histograms of exited workers are added to the retired
+        # totals once; a snapshot that was folded but not yet removed is only
+        # removed.
+        folded = set(retired["folded"])
+        pending = [snapshot for file_name, snapshot in dead.items() if file_name not in folded]
+        merged = aggregate([retired, *pending])
+        retired = {
+            "series": [
+                (name, labels, value) for (name, labels), value in merged.items()
+                if METRIC_FAMILIES[name][0] != "gauge"
+            ],
+            "folded": sorted(dead),
+        }
+        self._write_json(self.retired_path, retired)
+        for file_name in dead:
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except FileNotFoundError:
+                pass
+        return retired
+
+
+def aggregate(snapshots: List[Dict[str, Any]]) -> Dict[Tuple[str, Labels], Any]:
+    merged: Dict[Tuple[str, Labels], Any] = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["series"]:
+            family = METRIC_FAMILIES.get(name)
+            if family is None:
+                continue
+            key = (name, tuple(tuple(label) for label in labels))
+            if family[0] == "histogram":
+                current = merged.setdefault(key, {"counts": [0] * len(value["counts"]), "sum": 0.0})
+                current["counts"] = [a + b for a, b in zip(current["counts"], value["counts"])]
+                current["sum"] += value["sum"]
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(merged: Dict[Tuple[str, Labels], Any]) -> str:
+    by_family: Dict[str, List[Tuple[Labels, Any]]] = {}
+    for (name, labels), value in merged.items():
+        by_family.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRIC_FAMILIES.items():
+        entries = by_family.get(name)
+        if not entries:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in sorted(entries, key=lambda entry: entry[0]):
+            if metric_type != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ["+Inf"], value["counts"]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_number(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+METRICS_DIR_PREFIX = "poe-adapter-metrics-"
+
+
+def default_metrics_dir() -> str:
+    # Workers share their uvicorn master's directory. The master's start time
+    # keeps a later master that is given the same pid away from old snapshots.
+    master = os.getppid()
+    return os.path.join(tempfile.gettempdir(), f"{METRICS_DIR_PREFIX}{master}-{process_start_time(master) or 0}")
+
+
+def remove_stale_metrics_dirs():
+    root = tempfile.gettempdir()
+    for name in os.listdir(root):
+        if not name.startswith(METRICS_DIR_PREFIX):
+            continue
+        master, _, started = name[len(METRICS_DIR_PREFIX):].partition("-")
+        if not (master.isdigit() and started.isdigit()):
+            continue
+        if not is_alive(int(master), int(started) or None):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def create_metrics_store(settings: MetricsSettings) -> MetricsStore:
+    if settings.dir:
+        return MetricsStore(settings.dir)
+    remove_stale_metrics_dirs()
+    return MetricsStore(default_metrics_dir())
+
+
+async def flush_metrics(registry: MetricsRegistry, store: MetricsStore):
+    await asyncio.to_thread(store.write, registry.snapshot())
+
+
+async def run_metrics_flusher(registry: MetricsRegistry, store: MetricsStore, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_metrics(registry, store)
+        except OSError as e:
+            logger.error(f"Could not write metrics snapshot to {store.path}: {e}")
+
+
+async def collect_metrics(registry: MetricsRegistry, store: Optional[MetricsStore]) -> str:
+    if store is None:
+        # No lifespan ran, so nothing is shared across workers; serve this
+        # process alone.
+        return render(aggregate([registry.snapshot()]))
+    await flush_metrics(registry, store)
+    snapshots = await asyncio.to_thread(store.read_all)
+    return render(aggregate(snapshots))
+
+
+metrics_registry = MetricsRegistry(metrics_settings.max_bots)
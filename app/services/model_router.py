@@ -0,0 +1,147 @@
+from config.settings import RoutingSettings, routing_settings
+from services.metrics import metrics_registry
+from services.upstream_policy import read_until_first_token
+from utils.streaming import close_stream
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import fastapi_poe as fp
+import json
+import logging
+import os
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+OpenBot = Callable[[str], AsyncIterator[fp.PartialResponse]]
+
+
+class BotStats:
+    __slots__ = ("samples", "ttft", "error_rate")
+
+    def __init__(self):
+        self.samples = 0
+        self.ttft = 0.0
+        self.error_rate = 0.0
+
+    def observe(self, alpha: float, ttft: Optional[float], failed: bool):
+        self.samples += 1
+        if ttft is not None:
+            self.ttft = ttft if not self.ttft else self.ttft + alpha * (ttft - self.ttft)
+        self.error_rate += alpha * ((1.0 if failed else 0.0) - self.error_rate)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"samples": self.samples, "ttft_seconds": round(self.ttft, 4), "error_rate": round(self.error_rate, 4)}
+
+
+def load_routes(path: str) -> Dict[str, List[str]]:
+    with open(path) as f:
+        config = json.load(f)
+    routes = {}
+    for alias, bots in config.get("aliases", {}).items():
+        if not isinstance(bots, list) or not bots or not all(isinstance(bot, str) and bot for bot in bots):
+            raise ValueError(f"Alias '{alias}' in {path} must map to a non-empty list of bot names")
+        routes[alias] = list(dict.fromkeys(bots))
+    return routes
+
+
+class ModelRouter:
+    def __init__(self, settings: RoutingSettings):
+        self.settings = settings
+        self.routes: Dict[str, List[str]] = {}
+        self.stats: Dict[str, BotStats] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.reload()
+
+    def reload(self):
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.settings.file).st_mtime
+            if mtime == self._mtime:
+                return
+            routes = load_routes(self.settings.file)
+        except (OSError, ValueError) as e:
+            if self._mtime is None:
+                raise
+            logger.error(f"Keeping the previous routing table, could not reload {self.settings.file}: {e}")
+            return
+        self._mtime = mtime
+        self.routes = routes
+        for bots in routes.values():
+            for bot in bots:
+                self.stats.setdefault(bot, BotStats())
+        logger.info(f"Loaded {len(routes)} model aliases from {self.settings.file}")
+
+    def score(self, bot: str) -> float:
+        stats = self.stats[bot]
+        if stats.samples < self.settings.min_samples:
+            return 0.0
+        return stats.ttft + self.settings.error_penalty * stats.error_rate
+
+    def candidates(self, model: str) -> Optional[List[str]]:
+        if time.monotonic() - self._checked_at >= self.settings.reload_interval:
+            self.reload()
+        bots = self.routes.get(model)
+        if bots is None or len(bots) == 1 or random.random() < self.settings.explore_rate:
+            return bots
+        return sorted(bots, key=self.score)
+
+    def observe(self, bot: str, ttft: Optional[float], failed: bool):
+        stats = self.stats.get(bot)
+        if stats is not None:
+            stats.observe(self.settings.alpha, ttft, failed)
+
+    async def stream(self, alias: str, candidates: List[str], open_bot: OpenBot) -> AsyncIterator[fp.PartialResponse]:
+        for index, bot in enumerate(candidates):
+            started = time.perf_counter()
+            partials = open_bot(bot)
+            try:
+                buffered = await read_until_first_token(partials)
+            except Exception as e:
+                await close_stream(partials)
+                self.observe(bot, None, failed=True)
+                if index == len(candidates) - 1:
+                    raise
+                metrics_registry.inc(
+                    "poe_adapter_route_fallbacks_total", (("alias", alias), ("bot", metrics_registry.bot_label(bot)))
+                )
+                logger.warning(f"Bot {bot} failed before its first token for '{alias}', falling back to {candidates[index + 1]}: {e}")
+                continue
+            except BaseException:
+                await close_stream(partials)
+                raise
+            break
+
+        metrics_registry.inc("poe_adapter_route_selections_total", (("alias", alias), ("bot", metrics_registry.bot_label(bot))))
+        ttft = time.perf_counter() - started if buffered and buffered[-1].text else None
+        failed = False
+        try:
+            async with aclosing(partials):
+                for partial in buffered:
+                    yield partial
+                async for partial in partials:
+                    yield partial
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.observe(bot, ttft, failed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "aliases": self.routes,
+            "bots": {bot: stats.to_dict() for bot, stats in self.stats.items()},
+        }
+
+
+def create_model_router(settings: RoutingSettings) -> Optional[ModelRouter]:
+    if not settings.file:
+        return None
+    return ModelRouter(settings)
+
+
+model_router = create_model_router(routing_settings)
@@ -0,0 +1,132 @@
+from config.settings import usage_settings
+from services.metrics import metrics_registry
+from utils.tokenizers import PIECE_PATTERN, get_tokenizer
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, Optional, Sequence, Tuple
+
+import fastapi_poe as fp
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+STOP = "stop"
+MAX_OUTPUT_TOKENS = "max_output_tokens"
+
+
+class StopMatcher:
+    def __init__(self, stops: Sequence[str]):
+        self.stops = tuple(stops)
+        self.longest = max(len(stop) for stop in self.stops)
+        self.held = ""
+
+    def _partial_match(self, text: str) -> int:
+        for size in range(min(len(text), self.longest - 1), 0, -1):
+            suffix = text[-size:]
+            if any(stop.startswith(suffix) for stop in self.stops):
+                return size
+        return 0
+
+    def feed(self, text: str) -> Tuple[str, bool]:
+        text = self.held + text
+        found = min((index for index in (text.find(stop) for stop in self.stops) if index >= 0), default=-1)
+        if found >= 0:
+            self.held = ""
+            return text[:found], True
+        held = self._partial_match(text)
+        self.held = text[len(text) - held:] if held else ""
+        return text[:len(text) - held], False
+
+    def flush(self) -> str:
+        text, self.held = self.held, ""
+        return text
+
+
+class TokenBudget:
+    def __init__(self, bot_name: str, max_tokens: int):
+        self.tokenizer = get_tokenizer(bot_name, usage_settings.use_tiktoken)
+        self.max_tokens = max_tokens
+        self.tokens = 0
+        self._tail = ""
+
+    def feed(self, text: str) -> Tuple[str, bool]:
+        combined = self._tail + text
+        complete, tail = self.tokenizer.count_complete(combined)
+        if self.tokens + complete + (self.tokenizer.count(tail) if tail else 0) <= self.max_tokens:
+            self.tokens += complete
+            self._tail = tail
+            return text, False
+        remaining = self.max_tokens - self.tokens
+        offset = len(self._tail)
+        for piece in PIECE_PATTERN.finditer(combined):
+            remaining -= self.tokenizer.count(piece.group())
+            if remaining < 0:
+                return text[:max(piece.start() - offset, 0)], True
+        return text, True
+
+
+class OutputLimiter:
+    def __init__(self, bot_name: str, endpoint: str, max_tokens: Optional[int] = None, stop: Sequence[str] = ()):
+        self.endpoint = endpoint
+        self.stop = StopMatcher(stop) if stop else None
+        self.budget = TokenBudget(bot_name, max_tokens) if max_tokens is not None else None
+        self.reason: Optional[str] = None
+
+    def feed(self, text: str) -> str:
+        stopped = False
+        if self.stop is not None:
+            text, stopped = self.stop.feed(text)
+        if self.budget is not None and text:
+            text, exhausted = self.budget.feed(text)
+            if exhausted:
+                self.reason = MAX_OUTPUT_TOKENS
+                return text
+        if stopped:
+            self.reason = STOP
+        return text
+
+    def flush(self) -> str:
+        if self.stop is None:
+            return ""
+        text = self.stop.flush()
+        if self.budget is not None and text:
+            text, exhausted = self.budget.feed(text)
+            if exhausted:
+                self.reason = MAX_OUTPUT_TOKENS
+        return text
+
+    @property
+    def truncated(self) -> bool:
+        return self.reason == MAX_OUTPUT_TOKENS
+
+    def finish_reason(self) -> str:
+        return "length" if self.truncated else "stop"
+
+    def incomplete_details(self) -> Optional[Dict[str, str]]:
+        return {"reason": MAX_OUTPUT_TOKENS} if self.truncated else None
+
+    def wrap(self, partials: AsyncIterator[fp.PartialResponse]) -> AsyncIterator[fp.PartialResponse]:
+        if self.stop is None and self.budget is None:
+            return partials
+        return self._limit(partials)
+
+    async def _limit(self, partials: AsyncIterator[fp.PartialResponse]) -> AsyncIterator[fp.PartialResponse]:
+        async with aclosing(partials):
+            async for partial in partials:
+                if type(partial) is not fp.PartialResponse or not partial.text \
+                        or partial.is_suggested_reply or partial.is_replace_response:
+                    yield partial
+                    continue
+                text = self.feed(partial.text)
+                if text:
+                    yield fp.PartialResponse(text=text)
+                if self.reason is not None:
+                    metrics_registry.inc("poe_adapter_output_limit_hits_total", (("endpoint", self.endpoint), ("reason", self.reason)))
+                    logger.info(f"Stopping upstream for {self.endpoint} early: {self.reason} reached")
+                    return
+        text = self.flush()
+        if text:
+            yield fp.PartialResponse(text=text)
+        if self.reason is not None:
+            metrics_registry.inc("poe_adapter_output_limit_hits_total", (("endpoint", self.endpoint), ("reason", self.reason)))
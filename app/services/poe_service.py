@@ -1,16 +1,32 @@
-from typing import List
-from utils.sse_utils import SSEFormatter
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+from utils.sse_utils import EncodedText, SSEFormatter, SSEFrameTemplate
+from utils.text_buffer import TextBuffer
+from utils.stream_flush import coalesce_partials
+from config.settings import upstream_settings
+from services.response_cache import response_cache
+from services.single_flight import single_flight_group
+from services.token_usage import UsageTracker
+from services.metrics import metrics_registry
+from services.conversation_store import conversation_store
+from services.truncation import truncate_for_bot
+from services.upstream_policy import upstream_policy
+from services.key_pool import key_pool_registry
+from services.model_router import model_router
+from services.output_limits import OutputLimiter
+from utils.request_keys import api_key_fingerprint, make_request_key
+from utils.tracing import span, timed_frame, traced_partials
 from models.openai_types import ResponseStatus, ResponseTypes, ResponseBase
 from models.openai_types import ItemBase, OutputItem, PartBase, ContentPart
 from models.openai_types import OutputTextDelta, OutputText, ErrorBase
 from models.openai_types import MessageBase, ChoiceBase, ChatCompletionBase
 from models.openai_types import DeltaBase, ChoiceDelta, ChoiceMessage
-from fastapi_poe.client import BotError
+from fastapi_poe.client import PROTOCOL_VERSION, BotError
+from contextlib import aclosing
 
 import fastapi_poe as fp
+import httpx
 import uuid
 import time
-import asyncio
 import logging
 import json
 
@@ -18,41 +34,153 @@ import json
 logger = logging.getLogger(__name__)
 
 
-DEFAULT_SUCCESS_USAGE = {
-    "input_tokens": 37, "output_tokens": 11,
-    "output_tokens_details": {"reasoning_tokens": 0}, "total_tokens": 48
-}
 DEFAULT_ERROR_USAGE = {
     "input_tokens": 0, "output_tokens": 0,
     "output_tokens_details": {"reasoning_tokens": 0}, "total_tokens": 0
 }
 
 
+def request_bot(
+        protocol_messages: List[fp.ProtocolMessage], bot_name: str, api_key: str,
+        session: Optional[httpx.AsyncClient],
+) -> AsyncIterator[fp.PartialResponse]:
+    if upstream_policy is None:
+        return fp.get_bot_response(
+            messages=protocol_messages, bot_name=bot_name, api_key=api_key,
+            session=session, base_url=upstream_settings.base_url
+        )
+    # The upstream policy owns retries. The library's own second try would
+    # repeat each attempt on the same key and bot after a 0.5s sleep that
+    # also lands in the first-token timings.
+    query = fp.QueryRequest(
+        query=protocol_messages, user_id="", conversation_id="", message_id="",
+        version=PROTOCOL_VERSION, type="query",
+    )
+    return fp.stream_request(
+        query, bot_name, api_key, session=session, base_url=upstream_settings.base_url, num_tries=1
+    )
+
+
+def open_upstream(
+        bot_name: str, poe_api_key: str,
+        protocol_messages: List[fp.ProtocolMessage],
+        instructions_str: Optional[str],
+        session: Optional[httpx.AsyncClient] = None,
+) -> AsyncIterator[fp.PartialResponse]:
+    cache_key = None
+    if response_cache is not None:
+        cache_key = make_request_key(bot_name, protocol_messages, instructions_str, poe_api_key)
+        cached_chunks = response_cache.get(cache_key)
+        if cached_chunks is not None:
+            logger.info(f"Serving {bot_name} response from cache")
+            return response_cache.replay(cached_chunks)
+
+    key_pool = key_pool_registry.pool_for(poe_api_key) if key_pool_registry is not None else None
+    candidates = model_router.candidates(bot_name) if model_router is not None else None
+
+    def open_bot(target_bot: str) -> AsyncIterator[fp.PartialResponse]:
+        if key_pool is None:
+            return request_bot(protocol_messages, target_bot, poe_api_key, session)
+        health = key_pool.select()
+        return key_pool.track(health, request_bot(protocol_messages, target_bot, health.key, session))
+
+    def open_attempt() -> AsyncIterator[fp.PartialResponse]:
+        if candidates is None:
+            return open_bot(bot_name)
+        return model_router.stream(bot_name, candidates, open_bot)
+
+    def open_partials() -> AsyncIterator[fp.PartialResponse]:
+        if upstream_policy is not None:
+            partials = upstream_policy.stream(bot_name, open_attempt)
+        else:
+            partials = open_attempt()
+        if cache_key is not None:
+            return response_cache.record(cache_key, partials)
+        return partials
+
+    if single_flight_group is not None:
+        flight_key = make_request_key(bot_name, protocol_messages, instructions_str, poe_api_key)
+        return single_flight_group.subscribe(flight_key, open_partials)
+    return open_partials()
+
+
+def compile_output_text_delta_frame(item_id: str) -> SSEFrameTemplate:
+    def render_frame(text: str) -> str:
+        delta_data = OutputTextDelta(
+            type=ResponseTypes.OUTPUT_TEXT_DELTA.value,
+            item_id=item_id,
+            delta=text
+        )
+        return SSEFormatter.format_reponse(ResponseTypes.OUTPUT_TEXT_DELTA.value, delta_data.to_dict())
+    return SSEFrameTemplate.compile(render_frame)
+
+
+def compile_chat_chunk_frame(
+        base_response_args: Dict[str, Any],
+        system_fingerprint: str,
+        role: Optional[str] = None
+) -> SSEFrameTemplate:
+    def render_frame(text: str) -> str:
+        delta_payload = DeltaBase(role=role, content=text).to_dict()
+        choice_data = ChoiceDelta(
+            delta=delta_payload,
+            index=0,
+            )
+        chat_completion_data = ChatCompletionBase(
+            **base_response_args,
+            choices=[choice_data.to_dict()],
+            system_fingerprint=system_fingerprint
+        )
+        return SSEFormatter.format_chat_completion(chat_completion_data.to_dict())
+    return SSEFrameTemplate.compile(render_frame)
+
+
+async def store_response(
+        response_id: str, poe_api_key: str, previous_response_id: Optional[str],
+        history: Sequence[fp.ProtocolMessage], protocol_messages: List[fp.ProtocolMessage], output_text: str,
+):
+    try:
+        await conversation_store.save(
+            response_id, api_key_fingerprint(poe_api_key), previous_response_id, history,
+            [*protocol_messages, fp.ProtocolMessage(role="bot", content=output_text)]
+        )
+    except Exception as e:
+        logger.error(f"Could not store response {response_id}: {e}")
+
+
 async def get_poe_response_streaming(
         bot_name: str, poe_api_key: str,
         protocol_messages: List[fp.ProtocolMessage],
         instructions_str: str,
         request_model_name: str,
+        session: Optional[httpx.AsyncClient] = None,
+        previous_response_id: Optional[str] = None,
+        history: Sequence[fp.ProtocolMessage] = (),
+        store: bool = False,
+        truncation: str = "disabled",
+        max_output_tokens: Optional[int] = None,
+        stop: Sequence[str] = (),
+        response_id: Optional[str] = None,
 ):
     temp, top_p_val = 1.0, 1.0
 
-    response_id = f"resp-{uuid.uuid4().hex}"
+    response_id = response_id or f"resp-{uuid.uuid4().hex}"
     created_at = int(time.time())
     base_response_args = {
         "response_id": response_id, "model_name": request_model_name,
         "created_at": created_at, "instructions_str": instructions_str,
-        "temperature": temp, "top_p": top_p_val
+        "temperature": temp, "top_p": top_p_val,
+        "previous_response_id": previous_response_id, "store": store,
+        "truncation": truncation, "max_output_tokens": max_output_tokens
     }
 
     sse_formatter = SSEFormatter()
     try:
         created_payload = ResponseBase(**base_response_args, status=ResponseStatus.IN_PROGRESS.value)
         yield sse_formatter.format_reponse(ResponseTypes.CREATED.value, {'type': ResponseTypes.CREATED.value, 'response': created_payload.to_dict()})
-        await asyncio.sleep(0.01)
 
         in_progress_payload = ResponseBase(**base_response_args, status=ResponseStatus.IN_PROGRESS.value)
         yield sse_formatter.format_reponse(ResponseTypes.CREATED.value, {'type': ResponseTypes.IN_PROGRESS.value, 'response': in_progress_payload.to_dict()})
-        await asyncio.sleep(0.01)
 
         item_id = f"msg-{uuid.uuid4().hex}"
         item_base_payload = ItemBase(
@@ -62,7 +190,6 @@ async def get_poe_response_streaming(
             )
         output_item_added_payload = OutputItem(type=ResponseTypes.OUTPUT_ITEM_ADDED.value, item=item_base_payload.to_dict())
         yield sse_formatter.format_reponse(ResponseTypes.OUTPUT_ITEM_ADDED.value, output_item_added_payload.to_dict())
-        await asyncio.sleep(0.01)
 
         part_base_payload = PartBase(type="output_text")
         content_part_payload = ContentPart(
@@ -71,56 +198,61 @@ async def get_poe_response_streaming(
             part=part_base_payload.to_dict()
             )
         yield sse_formatter.format_reponse(ResponseTypes.CONTENT_PART_ADDED.value, content_part_payload.to_dict())
-        await asyncio.sleep(0.01)
         
-        accumulated_text = ""
-        async for partial in fp.get_bot_response(
-            messages=protocol_messages, bot_name=bot_name, api_key=poe_api_key
-        ):
-            if isinstance(partial, fp.PartialResponse) and partial.text:
-                accumulated_text += partial.text
-                delta_data = OutputTextDelta(
-                    type=ResponseTypes.OUTPUT_TEXT_DELTA.value,
-                    item_id=item_id,
-                    delta=partial.text
-                )
-                yield sse_formatter.format_reponse(ResponseTypes.OUTPUT_TEXT_DELTA.value, delta_data.to_dict())
-                await asyncio.sleep(0.01)
-            elif isinstance(partial, fp.ErrorResponse):
-                error_text_from_poe = f"Poe ErrorResponse: {partial.text} (Code: {partial.error_code}, Type: {partial.error_type})"
-                logger.error(error_text_from_poe)
-                error_obj_payload = ErrorBase(
-                    type=str(partial.error_type) if partial.error_type else "upstream_error",
-                    message=partial.text or "Unknown error from Poe ErrorResponse"
-                    )
-                completed_error_payload = ResponseBase(
-                    **base_response_args,
-                    status="failed",
-                    error_obj=error_obj_payload.to_dict(),
-                    usage_obj=DEFAULT_ERROR_USAGE
-                    )
-                yield sse_formatter.format_reponse(ResponseTypes.COMPLETED.value, {'type': ResponseTypes.COMPLETED.value, 'response': completed_error_payload.to_dict()})
-                return
-
+        delta_frame = timed_frame(compile_output_text_delta_frame(item_id))
+        upstream_messages = [*history, *protocol_messages]
+        if truncation == "auto":
+            with span("truncate"):
+                upstream_messages = await truncate_for_bot(bot_name, upstream_messages)
+        usage_tracker = UsageTracker(bot_name, upstream_messages)
+        observer = metrics_registry.observe_upstream("/v1/responses", bot_name)
+        limiter = OutputLimiter(bot_name, "/v1/responses", max_output_tokens, stop)
+        text_buffer = TextBuffer()
+        async with aclosing(coalesce_partials(limiter.wrap(observer.track(traced_partials(open_upstream(
+            bot_name, poe_api_key, upstream_messages, instructions_str, session
+        )))))) as partials:
+            async for partial in partials:
+                if isinstance(partial, fp.PartialResponse) and partial.text:
+                    text_buffer.append(partial.text)
+                    usage_tracker.feed(partial.text)
+                    yield delta_frame.render(partial.text)
+                elif isinstance(partial, fp.ErrorResponse):
+                    error_text_from_poe = f"Poe ErrorResponse: {partial.text} (Code: {partial.error_code}, Type: {partial.error_type})"
+                    logger.error(error_text_from_poe)
+                    error_obj_payload = ErrorBase(
+                        type=str(partial.error_type) if partial.error_type else "upstream_error",
+                        message=partial.text or "Unknown error from Poe ErrorResponse"
+                        )
+                    completed_error_payload = ResponseBase(
+                        **base_response_args,
+                        status="failed",
+                        error_obj=error_obj_payload.to_dict(),
+                        usage_obj=DEFAULT_ERROR_USAGE
+                        )
+                    yield sse_formatter.format_reponse(ResponseTypes.COMPLETED.value, {'type': ResponseTypes.COMPLETED.value, 'response': completed_error_payload.to_dict()})
+                    return
+
+        # The done events below all carry the full text. It is JSON-encoded
+        # once and spliced into each frame in place of a placeholder.
+        final_text = EncodedText(text_buffer.chunks())
         output_text_done_payload = OutputText(
             type=ResponseTypes.OUTPUT_TEXT_DONE.value,
-            item_id=item_id, text=accumulated_text
+            item_id=item_id, text=final_text.placeholder
             )
-        yield sse_formatter.format_reponse(ResponseTypes.OUTPUT_TEXT_DONE.value, output_text_done_payload.to_dict())
-        await asyncio.sleep(0.01)
+        yield final_text.render(sse_formatter.format_reponse(ResponseTypes.OUTPUT_TEXT_DONE.value, output_text_done_payload.to_dict()))
 
-        part_base_payload = PartBase(type="output_text", text=accumulated_text)
+        part_base_payload = PartBase(type="output_text", text=final_text.placeholder)
         content_part_done_payload = ContentPart(
             type=ResponseTypes.CONTENT_PART_DONE.value,
             item_id=item_id,
             part=part_base_payload.to_dict()
         )
-        yield sse_formatter.format_reponse(ResponseTypes.CONTENT_PART_DONE.value, content_part_done_payload.to_dict())
-        await asyncio.sleep(0.01)
+        yield final_text.render(sse_formatter.format_reponse(ResponseTypes.CONTENT_PART_DONE.value, content_part_done_payload.to_dict()))
 
+        final_status = ResponseStatus.INCOMPLETE.value if limiter.truncated else ResponseStatus.COMPLETED.value
         item_base_payload = ItemBase(
             id=item_id, type="message",
-            status=ResponseStatus.COMPLETED.value,
+            status=final_status,
             role="assistant",
             content= [part_base_payload.to_dict()]
             )
@@ -128,14 +260,21 @@ async def get_poe_response_streaming(
             type=ResponseTypes.OUTPUT_ITEM_DONE.value,
             item=item_base_payload.to_dict()
             )
-        yield sse_formatter.format_reponse(ResponseTypes.OUTPUT_ITEM_DONE.value, output_item_done_payload.to_dict())
-        await asyncio.sleep(0.01)
-
+        yield final_text.render(sse_formatter.format_reponse(ResponseTypes.OUTPUT_ITEM_DONE.value, output_item_done_payload.to_dict()))
+
+        with span("usage"):
+            usage = await usage_tracker.response_usage()
+        observer.add_output_tokens(usage["output_tokens"])
+        if store:
+            with span("store"):
+                await store_response(response_id, poe_api_key, previous_response_id, history, protocol_messages, text_buffer.take())
         response_completed_payload = ResponseBase(
-            **base_response_args, status=ResponseStatus.COMPLETED.value,
-            output_list=[item_base_payload.to_dict()], usage_obj=DEFAULT_SUCCESS_USAGE
+            **base_response_args, status=final_status,
+            output_list=[item_base_payload.to_dict()], usage_obj=usage,
+            incomplete_details=limiter.incomplete_details()
         )
-        yield sse_formatter.format_reponse(ResponseTypes.COMPLETED.value, {'type': ResponseTypes.COMPLETED.value, 'response': response_completed_payload.to_dict()})
+        final_event = ResponseTypes.INCOMPLETE.value if limiter.truncated else ResponseTypes.COMPLETED.value
+        yield final_text.render(sse_formatter.format_reponse(final_event, {'type': final_event, 'response': response_completed_payload.to_dict()}))
     
     except BotError as e:
         logger.error(f"Handling BotError from Poe: {str(e)}")
@@ -186,7 +325,14 @@ async def get_poe_response_non_streaming(
         bot_name: str, poe_api_key: str,
         protocol_messages: List[fp.ProtocolMessage],
         instructions_str: str,
-        request_model_name: str
+        request_model_name: str,
+        session: Optional[httpx.AsyncClient] = None,
+        previous_response_id: Optional[str] = None,
+        history: Sequence[fp.ProtocolMessage] = (),
+        store: bool = False,
+        truncation: str = "disabled",
+        max_output_tokens: Optional[int] = None,
+        stop: Sequence[str] = (),
 ):
     temp, top_p_val = 1.0, 1.0
 
@@ -195,41 +341,61 @@ async def get_poe_response_non_streaming(
     base_response_args = {
         "response_id": response_id, "model_name": request_model_name,
         "created_at": created_at, "instructions_str": instructions_str,
-        "temperature": temp, "top_p": top_p_val
+        "temperature": temp, "top_p": top_p_val,
+        "previous_response_id": previous_response_id, "store": store,
+        "truncation": truncation, "max_output_tokens": max_output_tokens
     }
-    accumulated_text = ""
-    async for partial in fp.get_bot_response(
-        messages=protocol_messages, bot_name=bot_name, api_key=poe_api_key
-    ):
-        if isinstance(partial, fp.PartialResponse) and partial.text:
-            accumulated_text += partial.text
+    upstream_messages = [*history, *protocol_messages]
+    if truncation == "auto":
+        with span("truncate"):
+            upstream_messages = await truncate_for_bot(bot_name, upstream_messages)
+    usage_tracker = UsageTracker(bot_name, upstream_messages)
+    observer = metrics_registry.observe_upstream("/v1/responses", bot_name)
+    limiter = OutputLimiter(bot_name, "/v1/responses", max_output_tokens, stop)
+    text_buffer = TextBuffer()
+    async with aclosing(limiter.wrap(observer.track(traced_partials(open_upstream(
+        bot_name, poe_api_key, upstream_messages, instructions_str, session
+    ))))) as partials:
+        async for partial in partials:
+            if isinstance(partial, fp.PartialResponse) and partial.text:
+                text_buffer.append(partial.text)
+                usage_tracker.feed(partial.text)
             
-        elif isinstance(partial, fp.ErrorResponse):
-            error_text_from_poe = f"Poe ErrorResponse: {partial.text} (Code: {partial.error_code}, Type: {partial.error_type})"
-            logger.error(error_text_from_poe)
-            error_obj_payload = ErrorBase(
-                type=str(partial.error_type) if partial.error_type else "upstream_error",
-                message=partial.text or "Unknown error from Poe ErrorResponse"
-                )
-            completed_error_payload = ResponseBase(
-                **base_response_args,
-                status="failed",
-                error_obj=error_obj_payload.to_dict(),
-                usage_obj=DEFAULT_ERROR_USAGE
-                )
-            return completed_error_payload.to_dict()
+            elif isinstance(partial, fp.ErrorResponse):
+                error_text_from_poe = f"Poe ErrorResponse: {partial.text} (Code: {partial.error_code}, Type: {partial.error_type})"
+                logger.error(error_text_from_poe)
+                error_obj_payload = ErrorBase(
+                    type=str(partial.error_type) if partial.error_type else "upstream_error",
+                    message=partial.text or "Unknown error from Poe ErrorResponse"
+                    )
+                completed_error_payload = ResponseBase(
+                    **base_response_args,
+                    status="failed",
+                    error_obj=error_obj_payload.to_dict(),
+                    usage_obj=DEFAULT_ERROR_USAGE
+                    )
+                return completed_error_payload.to_dict()
         
     item_id = f"msg-{uuid.uuid4().hex}"
-    part_base_payload = PartBase(type="output_text", text=accumulated_text)
+    output_text = text_buffer.take()
+    part_base_payload = PartBase(type="output_text", text=output_text)
+    final_status = ResponseStatus.INCOMPLETE.value if limiter.truncated else ResponseStatus.COMPLETED.value
     item_base_payload = ItemBase(
         id=item_id, type="message",
-        status=ResponseStatus.COMPLETED.value,
+        status=final_status,
         role="assistant",
         content= [part_base_payload.to_dict()]
         )
+    with span("usage"):
+        usage = await usage_tracker.response_usage()
+    observer.add_output_tokens(usage["output_tokens"])
+    if store:
+        with span("store"):
+            await store_response(response_id, poe_api_key, previous_response_id, history, protocol_messages, output_text)
     response_completed_payload = ResponseBase(
-        **base_response_args, status=ResponseStatus.COMPLETED.value,
-        output_list=[item_base_payload.to_dict()], usage_obj=DEFAULT_SUCCESS_USAGE
+        **base_response_args, status=final_status,
+        output_list=[item_base_payload.to_dict()], usage_obj=usage,
+        incomplete_details=limiter.incomplete_details()
         )
     return response_completed_payload.to_dict()
 
@@ -237,7 +403,10 @@ async def get_poe_response_non_streaming(
 async def get_poe_chat_completion_non_streaming(
         bot_name: str, poe_api_key: str,
         protocol_messages: List[fp.ProtocolMessage],
-        request_model_name: str
+        request_model_name: str,
+        session: Optional[httpx.AsyncClient] = None,
+        max_tokens: Optional[int] = None,
+        stop: Sequence[str] = (),
 ):
     response_id = f"chatcmpl-{uuid.uuid4().hex}"
     system_fingerprint = f"fp_{uuid.uuid4().hex[:10]}"
@@ -248,35 +417,44 @@ async def get_poe_chat_completion_non_streaming(
         "created_at": created_at 
     }
 
-    accumulated_text = ""
-    async for partial in fp.get_bot_response(
-        messages=protocol_messages, bot_name=bot_name, api_key=poe_api_key
-    ):
-        if isinstance(partial, fp.PartialResponse) and partial.text:
-            accumulated_text += partial.text
+    usage_tracker = UsageTracker(bot_name, protocol_messages)
+    observer = metrics_registry.observe_upstream("/v1/chat/completions", bot_name)
+    limiter = OutputLimiter(bot_name, "/v1/chat/completions", max_tokens, stop)
+    text_buffer = TextBuffer()
+    async with aclosing(limiter.wrap(observer.track(traced_partials(open_upstream(
+        bot_name, poe_api_key, protocol_messages, None, session
+    ))))) as partials:
+        async for partial in partials:
+            if isinstance(partial, fp.PartialResponse) and partial.text:
+                text_buffer.append(partial.text)
+                usage_tracker.feed(partial.text)
             
-        elif isinstance(partial, fp.ErrorResponse):
-            error_text_from_poe = f"Poe ErrorResponse: {partial.text} (Code: {partial.error_code}, Type: {partial.error_type})"
-            logger.error(error_text_from_poe)
-            error_obj_payload = MessageBase(
-                refusal=partial.text or "Unknown error from Poe ErrorResponse",
-                role="assistant")
-            choice_payload = ChoiceMessage(
-                message=error_obj_payload.to_dict(exclude={"content"}),
-                finish_reason="stop")
-            completed_error_payload = ChatCompletionBase(
-                **base_response_args,
-                choices=[choice_payload.to_dict()],
-                system_fingerprint=system_fingerprint
-            )
-            return completed_error_payload.to_dict()
+            elif isinstance(partial, fp.ErrorResponse):
+                error_text_from_poe = f"Poe ErrorResponse: {partial.text} (Code: {partial.error_code}, Type: {partial.error_type})"
+                logger.error(error_text_from_poe)
+                error_obj_payload = MessageBase(
+                    refusal=partial.text or "Unknown error from Poe ErrorResponse",
+                    role="assistant")
+                choice_payload = ChoiceMessage(
+                    message=error_obj_payload.to_dict(exclude={"content"}),
+                    finish_reason="stop")
+                completed_error_payload = ChatCompletionBase(
+                    **base_response_args,
+                    choices=[choice_payload.to_dict()],
+                    system_fingerprint=system_fingerprint
+                )
+                return completed_error_payload.to_dict()
 
-    message_payload = MessageBase(content=accumulated_text, role="assistant")
-    choice_payload = ChoiceMessage(message=message_payload.to_dict(), finish_reason="stop")
+    message_payload = MessageBase(content=text_buffer.take(), role="assistant")
+    choice_payload = ChoiceMessage(message=message_payload.to_dict(), finish_reason=limiter.finish_reason())
+    with span("usage"):
+        usage = await usage_tracker.chat_usage()
+    observer.add_output_tokens(usage["completion_tokens"])
     response_completed_payload = ChatCompletionBase(
         **base_response_args,
         choices=[choice_payload.to_dict()],
-        system_fingerprint=system_fingerprint
+        system_fingerprint=system_fingerprint,
+        usage=usage
     )
     
     return response_completed_payload.to_dict()
@@ -285,7 +463,10 @@ async def get_poe_chat_completion_non_streaming(
 async def get_poe_chat_completion_streaming(
         bot_name: str, poe_api_key: str,
         protocol_messages: List[fp.ProtocolMessage],
-        request_model_name: str
+        request_model_name: str,
+        session: Optional[httpx.AsyncClient] = None,
+        max_tokens: Optional[int] = None,
+        stop: Sequence[str] = (),
 ):
     response_id = f"chatcmpl-{uuid.uuid4().hex}"
     system_fingerprint = f"fp_{uuid.uuid4().hex[:10]}"
@@ -298,58 +479,54 @@ async def get_poe_chat_completion_streaming(
     }
     sse_formatter = SSEFormatter()
     
+    first_chunk_frame = timed_frame(compile_chat_chunk_frame(base_response_args, system_fingerprint, role="assistant"))
+    chunk_frame = timed_frame(compile_chat_chunk_frame(base_response_args, system_fingerprint))
+
     is_first_chunk = True
-    accumulated_text = ""
-    async for partial in fp.get_bot_response(
-        messages=protocol_messages, bot_name=bot_name, api_key=poe_api_key
-    ):
-        if isinstance(partial, fp.PartialResponse) and partial.text:
-            accumulated_text += partial.text
-
-            if is_first_chunk:
-                delta_payload = DeltaBase(
-                    role="assistant",
-                    content=partial.text).to_dict()
-                is_first_chunk = False
-            else:
-                delta_payload = DeltaBase(content=partial.text).to_dict()
-
-            choice_data = ChoiceDelta(
-                delta=delta_payload,
-                index=0,
+    usage_tracker = UsageTracker(bot_name, protocol_messages)
+    observer = metrics_registry.observe_upstream("/v1/chat/completions", bot_name)
+    limiter = OutputLimiter(bot_name, "/v1/chat/completions", max_tokens, stop)
+    async with aclosing(coalesce_partials(limiter.wrap(observer.track(traced_partials(open_upstream(
+        bot_name, poe_api_key, protocol_messages, None, session
+    )))))) as partials:
+        async for partial in partials:
+            if isinstance(partial, fp.PartialResponse) and partial.text:
+                usage_tracker.feed(partial.text)
+
+                if is_first_chunk:
+                    yield first_chunk_frame.render(partial.text)
+                    is_first_chunk = False
+                else:
+                    yield chunk_frame.render(partial.text)
+
+            elif isinstance(partial, fp.ErrorResponse):
+                error_text_from_poe = f"Poe ErrorResponse: {partial.text} (Code: {partial.error_code}, Type: {partial.error_type})"
+                logger.error(error_text_from_poe)
+                error_obj_payload = MessageBase(refusal=partial.text or "Unknown error from Poe ErrorResponse")
+                choice_payload = ChoiceBase(message=error_obj_payload.to_dict(exclude={"content"}))
+                completed_error_payload = ChatCompletionBase(
+                    **base_response_args,
+                    choices=[choice_payload.to_dict()],
+                    system_fingerprint=system_fingerprint,
+                    object="chat.completion.chunk"
                 )
-            chat_completion_data = ChatCompletionBase(
-                **base_response_args,
-                choices=[choice_data.to_dict()],
-                system_fingerprint=system_fingerprint
-            )
-            yield sse_formatter.format_chat_completion(chat_completion_data.to_dict())
-            await asyncio.sleep(0.01)
-
-        elif isinstance(partial, fp.ErrorResponse):
-            error_text_from_poe = f"Poe ErrorResponse: {partial.text} (Code: {partial.error_code}, Type: {partial.error_type})"
-            logger.error(error_text_from_poe)
-            error_obj_payload = MessageBase(refusal=partial.text or "Unknown error from Poe ErrorResponse")
-            choice_payload = ChoiceBase(message=error_obj_payload.to_dict(exclude={"content"}))
-            completed_error_payload = ChatCompletionBase(
-                **base_response_args,
-                choices=[choice_payload.to_dict()],
-                system_fingerprint=system_fingerprint,
-                object="chat.completion.chunk"
-            )
-            yield sse_formatter.format_chat_completion(completed_error_payload.to_dict())
-            return
+                yield sse_formatter.format_chat_completion(completed_error_payload.to_dict())
+                return
         
     final_choice = ChoiceDelta(
         delta={},
         index=0,
-        finish_reason="stop"
+        finish_reason=limiter.finish_reason()
     )
+    with span("usage"):
+        usage = await usage_tracker.chat_usage()
+    observer.add_output_tokens(usage["completion_tokens"])
     final_chunk = ChatCompletionBase(
         **base_response_args,
         choices=[final_choice.to_dict()],
         system_fingerprint=system_fingerprint,
-        object="chat.completion.chunk"
+        object="chat.completion.chunk",
+        usage=usage
     )
     yield sse_formatter.format_chat_completion(final_chunk.to_dict())
 
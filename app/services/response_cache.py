@@ -0,0 +1,82 @@
+from config.settings import CacheSettings, cache_settings
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional, Tuple
+
+import fastapi_poe as fp
+import sys
+import time
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[str, ...], int]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Tuple[str, ...]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, chunks, size = entry
+        if expires_at < time.monotonic():
+            self._evict(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return chunks
+
+    def put(self, key: str, chunks: Tuple[str, ...]) -> None:
+        size = sys.getsizeof(key) + sum(sys.getsizeof(chunk) for chunk in chunks)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, chunks, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def to_dict(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    async def replay(self, chunks: Tuple[str, ...]) -> AsyncIterator[fp.PartialResponse]:
+        for chunk in chunks:
+            yield fp.PartialResponse(text=chunk)
+
+    async def record(self, key: str, partials: AsyncIterator[fp.PartialResponse]) -> AsyncIterator[fp.PartialResponse]:
+        chunks: List[str] = []
+        cacheable = True
+        async with aclosing(partials):
+            async for partial in partials:
+                if isinstance(partial, fp.ErrorResponse) or partial.is_suggested_reply or partial.is_replace_response:
+                    cacheable = False
+                elif partial.text and not isinstance(partial, fp.MetaResponse):
+                    chunks.append(partial.text)
+                yield partial
+        if cacheable and chunks:
+            self.put(key, tuple(chunks))
+
+
+def create_response_cache(settings: CacheSettings) -> Optional[ResponseCache]:
+    if not settings.enabled:
+        return None
+    return ResponseCache(settings.max_bytes, settings.ttl_seconds)
+
+
+response_cache = create_response_cache(cache_settings)
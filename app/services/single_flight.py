@@ -0,0 +1,126 @@
+from config.settings import SingleFlightSettings, single_flight_settings
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional
+
+import fastapi_poe as fp
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    def __init__(self, group: "SingleFlightGroup", key: str, partials: AsyncIterator[fp.PartialResponse]):
+        self.group = group
+        self.key = key
+        self.items: List[fp.PartialResponse] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(partials))
+
+    async def _run(self, partials: AsyncIterator[fp.PartialResponse]):
+        try:
+            async with aclosing(partials):
+                async for partial in partials:
+                    self.items.append(partial)
+                    self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.group.finish(self)
+            self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def replay(self) -> AsyncIterator[fp.PartialResponse]:
+        index = 0
+        while True:
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+    def leave(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self._task.done():
+            self.group.finish(self)
+            logger.info(f"All subscribers left single-flight {self.key[:12]}, cancelling upstream")
+            self._task.cancel()
+
+
+class Subscription:
+    # Counts as a subscriber from the moment it is handed out, so closing it
+    # before the first read still lets the flight be cancelled; a generator's
+    # body, and its finally, would not run until then.
+    def __init__(self, flight: Flight):
+        self.flight = flight
+        self.partials = flight.replay()
+        self.released = False
+        flight.subscribers += 1
+
+    def _release(self):
+        if not self.released:
+            self.released = True
+            self.flight.leave()
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> fp.PartialResponse:
+        try:
+            return await self.partials.__anext__()
+        except BaseException:
+            self._release()
+            raise
+
+    async def aclose(self):
+        try:
+            await self.partials.aclose()
+        finally:
+            self._release()
+
+
+class SingleFlightGroup:
+    def __init__(self):
+        self.started = 0
+        self.joined = 0
+        self._flights: Dict[str, Flight] = {}
+
+    def subscribe(self, key: str, open_partials) -> Subscription:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(self, key, open_partials())
+            self._flights[key] = flight
+            self.started += 1
+        else:
+            self.joined += 1
+        return Subscription(flight)
+
+    def finish(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def to_dict(self):
+        return {"in_flight": len(self._flights), "started": self.started, "joined": self.joined}
+
+
+def create_single_flight_group(settings: SingleFlightSettings) -> Optional[SingleFlightGroup]:
+    if not settings.enabled:
+        return None
+    return SingleFlightGroup()
+
+
+single_flight_group = create_single_flight_group(single_flight_settings)
@@ -0,0 +1,116 @@
+from config.settings import usage_settings
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from utils.tokenizers import get_tokenizer
+from utils.text_buffer import TextBuffer
+
+import fastapi_poe as fp
+import asyncio
+import threading
+
+
+MESSAGE_OVERHEAD_TOKENS = 3
+PROMPT_OVERHEAD_TOKENS = 3
+
+token_executor = ThreadPoolExecutor(
+    max_workers=usage_settings.tokenizer_threads, thread_name_prefix="tokenizer"
+)
+
+
+class MessageTokenCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[Tuple[Any, int, int], int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, tokenizer, content: str) -> int:
+        key = (tokenizer, len(content), hash(content))
+        with self._lock:
+            tokens = self._counts.get(key)
+            if tokens is not None:
+                self._counts.move_to_end(key)
+                return tokens
+        tokens = MESSAGE_OVERHEAD_TOKENS + tokenizer.count(content)
+        with self._lock:
+            self._counts[key] = tokens
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+
+message_token_cache = MessageTokenCache(usage_settings.message_cache_size)
+
+
+def count_input_tokens(bot_name: str, protocol_messages: List[fp.ProtocolMessage]) -> int:
+    tokenizer = get_tokenizer(bot_name, usage_settings.use_tiktoken)
+    return PROMPT_OVERHEAD_TOKENS + sum(message_token_cache.count(tokenizer, msg.content) for msg in protocol_messages)
+
+
+def start_input_token_count(bot_name: str, protocol_messages: List[fp.ProtocolMessage]) -> asyncio.Future:
+    return asyncio.get_running_loop().run_in_executor(
+        token_executor, count_input_tokens, bot_name, protocol_messages
+    )
+
+
+class IncrementalTokenCounter:
+    def __init__(self, bot_name: str, offload_chars: Optional[int] = None):
+        self.tokenizer = get_tokenizer(bot_name, usage_settings.use_tiktoken)
+        self.offload_chars = usage_settings.offload_chars if offload_chars is None else offload_chars
+        self.tokens = 0
+        self._tail = ""
+        # While a count is running, deltas keep arriving; the buffer holds
+        # them as UTF-8 instead of one str object per delta.
+        self._pending = TextBuffer()
+        self._job: Optional[asyncio.Future] = None
+
+    def feed(self, text: str):
+        self._pending.append(text)
+        if self._pending.chars >= self.offload_chars and (self._job is None or self._job.done()):
+            self._job = asyncio.get_running_loop().run_in_executor(
+                token_executor, self._consume, self._pending.take(), False
+            )
+
+    def _consume(self, text: str, final: bool):
+        text = self._tail + text
+        if final:
+            self.tokens += self.tokenizer.count(text) if text else 0
+            self._tail = ""
+            return
+        tokens, self._tail = self.tokenizer.count_complete(text)
+        self.tokens += tokens
+
+    async def total(self) -> int:
+        if self._job is not None:
+            await self._job
+        await asyncio.get_running_loop().run_in_executor(
+            token_executor, self._consume, self._pending.take(), True
+        )
+        return self.tokens
+
+
+class UsageTracker:
+    def __init__(self, bot_name: str, protocol_messages: List[fp.ProtocolMessage]):
+        self._input_tokens = start_input_token_count(bot_name, protocol_messages)
+        self.output = IncrementalTokenCounter(bot_name)
+
+    def feed(self, text: str):
+        self.output.feed(text)
+
+    async def counts(self):
+        return await self._input_tokens, await self.output.total()
+
+    async def response_usage(self) -> Dict[str, Any]:
+        input_tokens, output_tokens = await self.counts()
+        return {
+            "input_tokens": input_tokens, "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens
+        }
+
+    async def chat_usage(self) -> Dict[str, Any]:
+        input_tokens, output_tokens = await self.counts()
+        return {
+            "prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        }
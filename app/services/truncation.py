@@ -0,0 +1,57 @@
+from config.settings import TruncationSettings, truncation_settings, usage_settings
+from services.token_usage import PROMPT_OVERHEAD_TOKENS, message_token_cache, token_executor
+from typing import List, Tuple
+from utils.tokenizers import get_tokenizer
+
+import fastapi_poe as fp
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def context_budget(bot_name: str, settings: TruncationSettings = truncation_settings) -> int:
+    lowered = bot_name.lower()
+    for prefix, tokens in settings.budgets_by_prefix:
+        if lowered.startswith(prefix):
+            return tokens
+    return settings.default_budget
+
+
+def truncate_messages(
+        bot_name: str, protocol_messages: List[fp.ProtocolMessage],
+        settings: TruncationSettings = truncation_settings,
+) -> Tuple[List[fp.ProtocolMessage], int]:
+    tokenizer = get_tokenizer(bot_name, usage_settings.use_tiktoken)
+    remaining = context_budget(bot_name, settings) - settings.reserve_tokens - PROMPT_OVERHEAD_TOKENS
+    for msg in protocol_messages:
+        if msg.role == "system":
+            remaining -= message_token_cache.count(tokenizer, msg.content)
+
+    first_kept = len(protocol_messages)
+    for index in range(len(protocol_messages) - 1, -1, -1):
+        msg = protocol_messages[index]
+        if msg.role == "system":
+            continue
+        tokens = message_token_cache.count(tokenizer, msg.content)
+        if tokens > remaining and first_kept < len(protocol_messages):
+            break
+        remaining -= tokens
+        first_kept = index
+
+    dropped = sum(1 for msg in protocol_messages[:first_kept] if msg.role != "system")
+    if not dropped:
+        return protocol_messages, 0
+    kept = [msg for msg in protocol_messages[:first_kept] if msg.role == "system"]
+    kept.extend(protocol_messages[first_kept:])
+    return kept, dropped
+
+
+async def truncate_for_bot(bot_name: str, protocol_messages: List[fp.ProtocolMessage]) -> List[fp.ProtocolMessage]:
+    kept, dropped = await asyncio.get_running_loop().run_in_executor(
+        token_executor, truncate_messages, bot_name, protocol_messages
+    )
+    if dropped:
+        logger.info(f"Truncated {dropped} of {len(protocol_messages)} messages to fit the context budget of '{bot_name}'")
+    return kept
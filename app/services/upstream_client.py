@@ -0,0 +1,156 @@
+from config.settings import StartupSettings, UpstreamSettings
+from services.key_pool import key_pool_registry
+from utils.startup import startup_timer
+from utils.tracing import current_trace
+from contextlib import suppress
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+import httpx
+import asyncio
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+DONE_EVENT = b"event: done"
+
+TRACED_UPSTREAM_STEPS = {
+    "connection.connect_tcp": "upstream_connect",
+    "connection.start_tls": "upstream_tls",
+    "http11.receive_response_headers": "upstream_response_headers",
+}
+
+
+class UpstreamPoolStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class DrainingResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, drain_timeout: float, background_tasks: Set[asyncio.Task]):
+        self._stream = stream
+        self._drain_timeout = drain_timeout
+        self._background_tasks = background_tasks
+        self._iterator: Optional[AsyncIterator[bytes]] = None
+        self._exhausted = False
+        self._done_seen = False
+        self._tail = b""
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._iterator is None:
+            self._iterator = self._stream.__aiter__()
+        async for chunk in self._iterator:
+            if not self._done_seen:
+                self._done_seen = DONE_EVENT in self._tail + chunk
+                self._tail = chunk[-len(DONE_EVENT):]
+            yield chunk
+        self._exhausted = True
+
+    async def aclose(self) -> None:
+        if self._iterator is None or self._exhausted or not self._done_seen or self._drain_timeout <= 0:
+            await self._stream.aclose()
+            return
+        task = asyncio.create_task(self._drain_and_close())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _drain(self) -> None:
+        async for _ in self._iterator:
+            pass
+
+    async def _drain_and_close(self) -> None:
+        with suppress(Exception):
+            await asyncio.wait_for(self._drain(), self._drain_timeout)
+        with suppress(Exception):
+            await self._stream.aclose()
+
+
+class CountingTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: UpstreamPoolStats, drain_timeout: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+        self.drain_timeout = drain_timeout
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        connected = False
+        parent_trace = request.extensions.get("trace")
+        request_trace = current_trace.get()
+        step_starts: Dict[str, float] = {}
+        request_started = time.perf_counter()
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            nonlocal connected
+            if event_name == "connection.connect_tcp.started":
+                connected = True
+            if request_trace is not None:
+                step, _, phase = event_name.rpartition(".")
+                if step in TRACED_UPSTREAM_STEPS:
+                    if phase == "started":
+                        step_starts[step] = time.perf_counter()
+                    elif phase == "complete" and step in step_starts:
+                        request_trace.add(TRACED_UPSTREAM_STEPS[step], step_starts.pop(step), time.perf_counter())
+            if parent_trace is not None:
+                await parent_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            if connected:
+                self.stats.misses += 1
+            raise
+
+        if connected:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        if request_trace is not None:
+            request_trace.add("upstream_request", request_started, time.perf_counter(), {"new_connection": connected})
+        response.stream = DrainingResponseStream(response.stream, self.drain_timeout, self._background_tasks)
+        return response
+
+
+def create_upstream_client(settings: UpstreamSettings, stats: UpstreamPoolStats) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.max_connections,
+        max_keepalive_connections=settings.max_keepalive_connections,
+        keepalive_expiry=settings.keepalive_expiry,
+    )
+    timeout = httpx.Timeout(settings.read_timeout, connect=settings.connect_timeout)
+    event_hooks = {}
+    if key_pool_registry is not None:
+        event_hooks["response"] = [key_pool_registry.observe_response]
+    return httpx.AsyncClient(
+        transport=CountingTransport(stats, drain_timeout=settings.drain_timeout, limits=limits),
+        limits=limits,
+        timeout=timeout,
+        event_hooks=event_hooks,
+    )
+
+
+async def warm_upstream_pool(session: httpx.AsyncClient, settings: StartupSettings, base_url: str) -> int:
+    if settings.warm_connections <= 0:
+        return 0
+    with startup_timer.phase("warm_pool"):
+        results = await asyncio.gather(
+            *(session.head(base_url, timeout=settings.warm_timeout) for _ in range(settings.warm_connections)),
+            return_exceptions=True,
+        )
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        logger.warning(f"Could not open {len(failures)} of {len(results)} upstream connections at startup: {failures[0]!r}")
+    warmed = len(results) - len(failures)
+    logger.info(f"Opened {warmed} upstream connections in {startup_timer.phases['warm_pool'] * 1000:.0f}ms")
+    return warmed
@@ -0,0 +1,189 @@
+from config.settings import HedgeSettings, RetrySettings, hedge_settings, retry_settings
+from services.metrics import metrics_registry
+from utils.streaming import close_stream
+from fastapi_poe.client import BotError, BotErrorNoRetry
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+import fastapi_poe as fp
+import asyncio
+import httpx
+import logging
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+SAMPLE_WINDOW = 200
+MAX_TRACKED_BOTS = 1000
+
+OpenAttempt = Callable[[], AsyncIterator[fp.PartialResponse]]
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, BotErrorNoRetry):
+        return False
+    return isinstance(error, (BotError, httpx.TransportError))
+
+
+class FirstTokenTracker:
+    def __init__(self, window: int = SAMPLE_WINDOW, max_bots: int = MAX_TRACKED_BOTS):
+        self.window = window
+        self.max_bots = max_bots
+        self._samples: Dict[str, Deque[Tuple[float, bool]]] = {}
+
+    def observe(self, bot_name: str, seconds: float, censored: bool = False):
+        samples = self._samples.get(bot_name)
+        if samples is None:
+            if len(self._samples) >= self.max_bots:
+                return
+            samples = self._samples[bot_name] = deque(maxlen=self.window)
+        samples.append((seconds, censored))
+
+    def percentile(self, bot_name: str, percentile: float, min_samples: int) -> Optional[float]:
+        samples = self._samples.get(bot_name)
+        if samples is None or len(samples) < max(min_samples, 1):
+            return None
+        # Kaplan-Meier estimate: a censored sample was abandoned before its
+        # first token, so it only says the first token takes at least that
+        # long. Without censored samples this is the nearest-rank percentile.
+        ordered = sorted(samples)
+        at_risk = len(ordered)
+        survival = 1.0
+        target = 1 - percentile / 100 + 1e-9
+        for seconds, censored in ordered:
+            if not censored:
+                survival *= 1 - 1 / at_risk
+                if survival <= target:
+                    return seconds
+            at_risk -= 1
+        return ordered[-1][0]
+
+
+async def read_until_first_token(partials: AsyncIterator[fp.PartialResponse]) -> List[fp.PartialResponse]:
+    buffered = []
+    async for partial in partials:
+        buffered.append(partial)
+        if partial.text or isinstance(partial, fp.ErrorResponse):
+            break
+    return buffered
+
+
+class Attempt:
+    def __init__(self, open_attempt: OpenAttempt):
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.partials = open_attempt()
+        self.task = asyncio.ensure_future(read_until_first_token(self.partials))
+        self.task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self.finished_at = time.perf_counter()
+
+    async def abandon(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        await close_stream(self.partials)
+
+
+class UpstreamPolicy:
+    def __init__(self, hedge: HedgeSettings, retry: RetrySettings):
+        self.hedge = hedge
+        self.retry = retry
+        self.first_tokens = FirstTokenTracker()
+
+    def hedge_delay(self, bot_name: str) -> Optional[float]:
+        if not self.hedge.enabled:
+            return None
+        observed = self.first_tokens.percentile(bot_name, self.hedge.percentile, self.hedge.min_samples)
+        delay = self.hedge.fallback_delay if observed is None else observed
+        return min(max(delay, self.hedge.min_delay), self.hedge.max_delay)
+
+    def observe_first_tokens(self, bot_name: str, attempts: List[Attempt]):
+        # Losers count too: only timing winners would leave out exactly the
+        # slow attempts and pull the hedge delay down over time.
+        now = time.perf_counter()
+        for attempt in attempts:
+            if not attempt.task.done():
+                self.first_tokens.observe(bot_name, now - attempt.started_at, censored=True)
+            elif not attempt.task.cancelled() and attempt.task.exception() is None:
+                buffered = attempt.task.result()
+                if buffered and buffered[-1].text:
+                    self.first_tokens.observe(bot_name, attempt.finished_at - attempt.started_at)
+
+    def backoff(self, retry: int) -> float:
+        return random.uniform(0, min(self.retry.max_backoff, self.retry.backoff * 2 ** retry))
+
+    async def _first_token(
+            self, bot_name: str, open_attempt: OpenAttempt,
+    ) -> Tuple[AsyncIterator[fp.PartialResponse], List[fp.PartialResponse]]:
+        attempts = [Attempt(open_attempt)]
+        winner: Optional[Attempt] = None
+        try:
+            delay = self.hedge_delay(bot_name)
+            if delay is not None:
+                await asyncio.wait([attempts[0].task], timeout=delay)
+                if not attempts[0].task.done():
+                    logger.info(f"No first token from {bot_name} after {delay:.2f}s, sending a hedged request")
+                    attempts.append(Attempt(open_attempt))
+
+            pending = list(attempts)
+            error: Optional[BaseException] = None
+            while pending and winner is None:
+                await asyncio.wait([attempt.task for attempt in pending], return_when=asyncio.FIRST_COMPLETED)
+                for attempt in [attempt for attempt in pending if attempt.task.done()]:
+                    pending.remove(attempt)
+                    if attempt.task.exception() is None:
+                        winner = attempt
+                        break
+                    error = error or attempt.task.exception()
+            if winner is None:
+                raise error
+        finally:
+            self.observe_first_tokens(bot_name, attempts)
+            await asyncio.shield(asyncio.gather(*(attempt.abandon() for attempt in attempts if attempt is not winner)))
+
+        buffered = winner.task.result()
+        if len(attempts) > 1:
+            outcome = "primary" if winner is attempts[0] else "hedge"
+            metrics_registry.inc("poe_adapter_upstream_hedges_total", (("bot", metrics_registry.bot_label(bot_name)), ("winner", outcome)))
+        return winner.partials, buffered
+
+    async def stream(self, bot_name: str, open_attempt: OpenAttempt) -> AsyncIterator[fp.PartialResponse]:
+        retry = 0
+        while True:
+            try:
+                partials, buffered = await self._first_token(bot_name, open_attempt)
+                break
+            except Exception as e:
+                if retry >= self.retry.attempts or not is_transient(e):
+                    raise
+                delay = self.backoff(retry)
+                retry += 1
+                metrics_registry.inc(
+                    "poe_adapter_upstream_retries_total",
+                    (("bot", metrics_registry.bot_label(bot_name)), ("error", type(e).__name__)),
+                )
+                logger.warning(
+                    f"Retrying {bot_name} in {delay:.2f}s after {type(e).__name__} before first token "
+                    f"(retry {retry} of {self.retry.attempts})"
+                )
+                await asyncio.sleep(delay)
+
+        async with aclosing(partials):
+            for partial in buffered:
+                yield partial
+            async for partial in partials:
+                yield partial
+
+
+def create_upstream_policy(hedge: HedgeSettings, retry: RetrySettings) -> Optional[UpstreamPolicy]:
+    if not hedge.enabled and retry.attempts <= 0:
+        return None
+    return UpstreamPolicy(hedge, retry)
+
+
+upstream_policy = create_upstream_policy(hedge_settings, retry_settings)
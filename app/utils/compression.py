@@ -0,0 +1,184 @@
+from config.settings import CompressionSettings
+from services.metrics import metrics_registry
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Callable, Dict, List, Optional
+
+import logging
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class GzipEncoder:
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        # Z_SYNC_FLUSH ends the chunk on a byte boundary so the client can
+        # decode it now, while the window still spans earlier chunks.
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    def __init__(self, brotli, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self, zstandard, level: int):
+        self.flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(self.flush_mode)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+def available_encoders(settings: CompressionSettings) -> Dict[str, Callable[[], object]]:
+    encoders: Dict[str, Callable[[], object]] = {}
+    for name in settings.encoding_order:
+        if name == "gzip":
+            encoders[name] = lambda: GzipEncoder(settings.gzip_level)
+        elif name == "br":
+            try:
+                import brotli
+            except ImportError:
+                logger.info("brotli is not installed, 'br' compression is disabled")
+                continue
+            encoders[name] = lambda: BrotliEncoder(brotli, settings.brotli_quality)
+        elif name == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                logger.info("zstandard is not installed, 'zstd' compression is disabled")
+                continue
+            encoders[name] = lambda: ZstdEncoder(zstandard, settings.zstd_level)
+        else:
+            raise ValueError(f"Unknown compression encoding '{name}', expected 'zstd', 'br' or 'gzip'")
+    return encoders
+
+
+def negotiate_encoding(accept_encoding: str, offered: List[str]) -> Optional[str]:
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        weights[name.strip().lower()] = quality
+    wildcard = weights.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for name in offered:
+        quality = weights.get(name, wildcard)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoders: Dict[str, Callable[[], object]], encoding: str, min_size: int):
+        self.app = app
+        self.encoders = encoders
+        self.encoding = encoding
+        self.min_size = min_size
+        self.send: Send = None
+        self.start: Optional[Message] = None
+        self.encoder = None
+        self.buffered: Optional[List[bytes]] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        try:
+            await self.app(scope, receive, self.send_compressed)
+        finally:
+            if self.bytes_in:
+                labels = (("encoding", self.encoding),)
+                metrics_registry.inc("poe_adapter_compression_input_bytes_total", labels, self.bytes_in)
+                metrics_registry.inc("poe_adapter_compression_output_bytes_total", labels, self.bytes_out)
+
+    async def send_compressed(self, message: Message):
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(scope=message)
+            if "content-encoding" in headers or message["status"] in (204, 304) \
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+                await self.send(message)
+                return
+            headers.add_vary_header("Accept-Encoding")
+            length = headers.get("content-length")
+            if length is not None and int(length) < self.min_size:
+                await self.send(message)
+                return
+            self.start = message
+            headers["content-encoding"] = self.encoding
+            self.encoder = self.encoders[self.encoding]()
+            if "content-length" in headers:
+                # A body of known size is usually a single JSONResponse
+                # message; compress it whole and send the new length.
+                self.buffered = []
+                return
+            await self.send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.encoder is None:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        self.bytes_in += len(body)
+        if self.buffered is not None:
+            self.buffered.append(body)
+            if more_body:
+                return
+            compressed = self.encoder.compress(b"".join(self.buffered)) + self.encoder.finish()
+            self.buffered = None
+            MutableHeaders(scope=self.start)["content-length"] = str(len(compressed))
+            await self.send(self.start)
+        else:
+            # Each body message of a stream holds whole SSE events, so
+            # flushing here keeps event boundaries and latency unchanged.
+            compressed = self.encoder.compress(body) if body else b""
+            if not more_body:
+                compressed += self.encoder.finish()
+        self.bytes_out += len(compressed)
+        await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, settings: CompressionSettings):
+        self.app = app
+        self.encoders = available_encoders(settings)
+        self.offered = list(self.encoders)
+        self.min_size = settings.min_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""), self.offered)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await CompressionResponder(self.app, self.encoders, encoding, self.min_size)(scope, receive, send)
@@ -0,0 +1,64 @@
+from config.settings import LogSettings
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, TextIO
+
+import atexit
+import json
+import logging
+import queue
+import sys
+
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogListener(QueueListener):
+    def stop(self) -> None:
+        if self._thread is not None:
+            super().stop()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_log = getattr(record, "request_log", None)
+        if request_log:
+            payload.update(request_log)
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def configure_logging(settings: LogSettings, stream: Optional[TextIO] = None) -> LogListener:
+    stream_handler = logging.StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if settings.json_format else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.queue_size)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.handlers[:] = [DroppingQueueHandler(log_queue)]
+
+    listener = LogListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
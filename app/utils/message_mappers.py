@@ -0,0 +1,103 @@
+from config.settings import MapperSettings, mapper_settings
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import fastapi_poe as fp
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+POE_ROLES = ("system", "user", "bot")
+DEFAULT_INSTRUCTIONS = "You are a helpful assistant."
+
+ENTRY_OVERHEAD_BYTES = 256
+
+PrefixKey = Tuple[int, str, str]
+
+
+def to_poe_role(role: str, warn_unknown: bool = False) -> str:
+    if role == "assistant":
+        return "bot"
+    if role not in POE_ROLES:
+        if warn_unknown:
+            logger.warning(f"Warning: Unknown role '{role}', defaulting to 'user'.")
+        return "user"
+    return role
+
+
+def build_protocol_message(role: str, content: str) -> fp.ProtocolMessage:
+    return fp.ProtocolMessage(role=role, content=content)
+
+
+class MessageInterner:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._next_id = 1
+        self._entries: "OrderedDict[PrefixKey, Tuple[int, fp.ProtocolMessage, int]]" = OrderedDict()
+
+    def build(self, turns: Iterable[Tuple[str, str]]) -> List[fp.ProtocolMessage]:
+        entries = self._entries
+        protocol_messages = []
+        parent = 0
+        for role, content in turns:
+            key = (parent, role, content)
+            entry = entries.get(key)
+            if entry is None:
+                self.misses += 1
+                entry = (self._next_id, build_protocol_message(role, content), len(content) + ENTRY_OVERHEAD_BYTES)
+                self._next_id += 1
+                if entry[2] <= self.max_bytes:
+                    entries[key] = entry
+                    self.current_bytes += entry[2]
+                    while self.current_bytes > self.max_bytes:
+                        _, (_, _, evicted_size) = entries.popitem(last=False)
+                        self.current_bytes -= evicted_size
+            else:
+                self.hits += 1
+                entries.move_to_end(key)
+            parent = entry[0]
+            protocol_messages.append(entry[1])
+        return protocol_messages
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def build_protocol_messages(
+        turns: Iterable[Tuple[str, str]], interner: Optional[MessageInterner],
+) -> List[fp.ProtocolMessage]:
+    if interner is None:
+        return [build_protocol_message(role, content) for role, content in turns]
+    return interner.build(turns)
+
+
+def create_message_interner(settings: MapperSettings) -> Optional[MessageInterner]:
+    if settings.cache_bytes <= 0:
+        return None
+    return MessageInterner(settings.cache_bytes)
+
+
+message_interner = create_message_interner(mapper_settings)
+
+
+def map_input_messages(
+        turns: Iterable[Tuple[str, str]], interner: Optional[MessageInterner] = message_interner,
+) -> Tuple[List[fp.ProtocolMessage], str]:
+    poe_turns = []
+    instructions_str = DEFAULT_INSTRUCTIONS
+    for role, text_content in turns:
+        if role == "system":
+            instructions_str = text_content
+        poe_turns.append((to_poe_role(role, warn_unknown=True), text_content))
+    return build_protocol_messages(poe_turns, interner), instructions_str
+
+
+def map_chat_messages(
+        turns: Iterable[Tuple[str, str]], interner: Optional[MessageInterner] = message_interner,
+) -> List[fp.ProtocolMessage]:
+    return build_protocol_messages(((to_poe_role(role), content) for role, content in turns), interner)
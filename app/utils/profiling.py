@@ -0,0 +1,51 @@
+from typing import Optional
+
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+
+
+logger = logging.getLogger(__name__)
+
+
+PROFILE_FORMATS = ("pstats", "text")
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class WorkerProfiler:
+    def __init__(self):
+        self.running = False
+
+    async def capture(self, seconds: float) -> cProfile.Profile:
+        if self.running:
+            raise ProfilerBusy("A profile is already being captured on this worker.")
+        self.running = True
+        profiler = cProfile.Profile()
+        logger.info(f"Profiling this worker for {seconds:.1f}s")
+        try:
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+        finally:
+            self.running = False
+        profiler.create_stats()
+        return profiler
+
+
+def render_profile(profiler: cProfile.Profile, profile_format: str, limit: Optional[int] = None) -> bytes:
+    if profile_format == "pstats":
+        return marshal.dumps(profiler.stats)
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(limit)
+    return output.getvalue().encode("utf-8")
+
+
+worker_profiler = WorkerProfiler()
@@ -0,0 +1,26 @@
+from typing import List, Optional
+
+import fastapi_poe as fp
+import hashlib
+import json
+
+
+def api_key_fingerprint(poe_api_key: str) -> str:
+    return hashlib.sha256(poe_api_key.encode("utf-8")).hexdigest()
+
+
+def make_request_key(
+        bot_name: str,
+        protocol_messages: List[fp.ProtocolMessage],
+        instructions_str: Optional[str] = None,
+        poe_api_key: Optional[str] = None,
+) -> str:
+    canonical = json.dumps(
+        [bot_name, instructions_str, [[msg.role, msg.content] for msg in protocol_messages]],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    digest = hashlib.sha256(canonical.encode("utf-8"))
+    if poe_api_key is not None:
+        digest.update(b"\0")
+        digest.update(poe_api_key.encode("utf-8"))
+    return digest.hexdigest()
@@ -1,7 +1,9 @@
 from pydantic import BaseModel
-from typing import Any
+from typing import Any, Callable, Iterable
+from json.encoder import encode_basestring_ascii
 
 import json
+import uuid
 
 
 class SSEFormatter(BaseModel):
@@ -13,4 +15,35 @@ class SSEFormatter(BaseModel):
     @staticmethod
     def format_chat_completion(data: Any) -> str:
         data_json = json.dumps(data) if not isinstance(data, str) else data
-        return f"data: {data_json}\n\n"
\ No newline at end of file
+        return f"data: {data_json}\n\n"
+
+
+class SSEFrameTemplate:
+    def __init__(self, prefix: bytes, suffix: bytes):
+        self.prefix = prefix
+        self.suffix = suffix
+
+    @classmethod
+    def compile(cls, render_frame: Callable[[str], str]) -> "SSEFrameTemplate":
+        placeholder = f"__sse_text_{uuid.uuid4().hex}__"
+        prefix, suffix = render_frame(placeholder).split(json.dumps(placeholder))
+        return cls(prefix.encode("utf-8"), suffix.encode("utf-8"))
+
+    def render(self, text: str) -> bytes:
+        return self.prefix + encode_basestring_ascii(text).encode("ascii") + self.suffix
+
+
+class EncodedText:
+    def __init__(self, chunks: Iterable[str]):
+        self.placeholder = f"__sse_text_{uuid.uuid4().hex}__"
+        self._marker = json.dumps(self.placeholder)
+        # Escaping chunk by chunk gives the same bytes as escaping the joined
+        # text, without building the joined text first.
+        self.encoded = bytearray(b'"')
+        for chunk in chunks:
+            self.encoded += encode_basestring_ascii(chunk)[1:-1].encode("ascii")
+        self.encoded += b'"'
+
+    def render(self, frame: str) -> bytes:
+        prefix, suffix = frame.split(self._marker)
+        return b"".join((prefix.encode("utf-8"), self.encoded, suffix.encode("utf-8")))
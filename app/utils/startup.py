@@ -0,0 +1,134 @@
+from contextlib import AsyncExitStack, contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import asyncio
+import importlib
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+ROOT_PAYLOAD = {"message": "API is running", "endpoint": "/v1/responses"}
+ROOT_BODY = json.dumps(ROOT_PAYLOAD, separators=(",", ":")).encode("utf-8")
+
+
+def process_age() -> Optional[float]:
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"), 0.0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.interpreter = process_age()
+        self.phases: Dict[str, float] = {}
+        self.ready: Optional[float] = None
+
+    def elapsed(self) -> float:
+        return (self.interpreter or 0.0) + time.perf_counter() - self.started_at
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def mark_ready(self):
+        self.ready = self.elapsed()
+        phases = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.to_dict()["phases"].items())
+        logger.info(f"Startup phases: {phases}; ready after {self.ready * 1000:.0f}ms")
+
+    def to_dict(self) -> Dict[str, Any]:
+        phases = {} if self.interpreter is None else {"interpreter": self.interpreter}
+        phases.update(self.phases)
+        return {
+            "phases": {name: round(seconds, 4) for name, seconds in phases.items()},
+            "ready_seconds": None if self.ready is None else round(self.ready, 4),
+        }
+
+
+startup_timer = StartupTimer()
+
+
+def load_application(target: str):
+    module_name, _, attribute = target.partition(":")
+    with startup_timer.phase("imports"):
+        return getattr(importlib.import_module(module_name), attribute)
+
+
+async def send_plain(send, status: int, body: bytes, content_type: bytes, head: bool = False):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode("ascii"))],
+    })
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+class DeferredApp:
+    def __init__(self, target: str):
+        self.target = target
+        self.app = None
+        self.error: Optional[BaseException] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._loader: Optional[asyncio.Task] = None
+        self._lifespans = AsyncExitStack()
+
+    def _start_loading(self, lifespan: bool):
+        self._ready = asyncio.Event()
+        self._loader = asyncio.create_task(self._load(lifespan))
+        logger.info(f"Answering / while {self.target} loads in the background")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(scope, receive, send)
+            return
+        if self._ready is None:
+            # No lifespan scope arrives with --lifespan off; load on the first
+            # request and, as without deferral, skip the app's lifespan.
+            self._start_loading(lifespan=False)
+        if self.app is None and self.error is None and scope["type"] == "http" \
+                and scope["path"] == "/" and scope["method"] in ("GET", "HEAD"):
+            await send_plain(send, 200, ROOT_BODY, b"application/json", head=scope["method"] == "HEAD")
+            return
+        await self._ready.wait()
+        if self.app is None:
+            if scope["type"] == "http":
+                await send_plain(send, 503, b"Application failed to start", b"text/plain; charset=utf-8")
+            return
+        await self.app(scope, receive, send)
+
+    async def _load(self, lifespan: bool):
+        try:
+            app = await asyncio.to_thread(load_application, self.target)
+            if lifespan:
+                await self._lifespans.enter_async_context(app.router.lifespan_context(app))
+            self.app = app
+            startup_timer.mark_ready()
+        except Exception as e:
+            self.error = e
+            logger.exception(f"Could not load {self.target}")
+        finally:
+            self._ready.set()
+
+    async def _lifespan(self, scope, receive, send):
+        await receive()
+        self._start_loading(lifespan=True)
+        await send({"type": "lifespan.startup.complete"})
+        await receive()
+        if not self._loader.done():
+            await self._loader
+        await self._lifespans.aclose()
+        await send({"type": "lifespan.shutdown.complete"})
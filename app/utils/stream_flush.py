@@ -0,0 +1,143 @@
+from config.settings import StreamSettings, stream_settings
+from contextlib import aclosing
+from enum import Enum
+from typing import AsyncIterator, List, Optional
+
+import fastapi_poe as fp
+import asyncio
+
+
+class FlushPolicy(Enum):
+    IMMEDIATE = "immediate"
+    WINDOW = "window"
+    BYTES = "bytes"
+
+
+_END = object()
+# Partials the window pump may read ahead of a slow client before it stops
+# pulling from upstream.
+_WINDOW_READ_AHEAD = 32
+
+
+def _is_plain_text(partial: fp.PartialResponse) -> bool:
+    return (
+        type(partial) is fp.PartialResponse
+        and bool(partial.text)
+        and not partial.is_suggested_reply
+        and not partial.is_replace_response
+    )
+
+
+def _merged(buffer: List[str]) -> fp.PartialResponse:
+    text = "".join(buffer)
+    buffer.clear()
+    return fp.PartialResponse(text=text)
+
+
+async def _pump(partials: AsyncIterator[fp.PartialResponse], queue: asyncio.Queue):
+    cancelled = False
+    try:
+        async with aclosing(partials):
+            async for partial in partials:
+                await queue.put(partial)
+    except asyncio.CancelledError:
+        # Only the reader cancels the pump, and then nobody waits for _END.
+        cancelled = True
+        raise
+    finally:
+        if not cancelled:
+            await queue.put(_END)
+
+
+async def _coalesce_window(partials: AsyncIterator[fp.PartialResponse], window_seconds: float):
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=_WINDOW_READ_AHEAD)
+    pump = asyncio.create_task(_pump(partials, queue))
+    buffer: List[str] = []
+    deadline: Optional[float] = None
+    is_first_text = True
+    try:
+        while True:
+            if deadline is None or not queue.empty():
+                item = await queue.get()
+            else:
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    deadline = None
+                    yield _merged(buffer)
+                    continue
+
+            if item is _END:
+                if buffer:
+                    yield _merged(buffer)
+                await pump
+                return
+
+            if _is_plain_text(item):
+                if is_first_text:
+                    is_first_text = False
+                    yield item
+                    continue
+                if not buffer:
+                    deadline = loop.time() + window_seconds
+                buffer.append(item.text)
+                if loop.time() >= deadline:
+                    deadline = None
+                    yield _merged(buffer)
+                continue
+
+            if buffer:
+                deadline = None
+                yield _merged(buffer)
+            yield item
+    finally:
+        if not pump.done():
+            pump.cancel()
+            await asyncio.gather(pump, return_exceptions=True)
+
+
+async def _coalesce_bytes(partials: AsyncIterator[fp.PartialResponse], max_bytes: int):
+    buffer: List[str] = []
+    buffered_bytes = 0
+    is_first_text = True
+    try:
+        async with aclosing(partials):
+            async for partial in partials:
+                if _is_plain_text(partial):
+                    if is_first_text:
+                        is_first_text = False
+                        yield partial
+                        continue
+                    buffer.append(partial.text)
+                    buffered_bytes += len(partial.text.encode("utf-8"))
+                    if buffered_bytes >= max_bytes:
+                        buffered_bytes = 0
+                        yield _merged(buffer)
+                    continue
+
+                if buffer:
+                    buffered_bytes = 0
+                    yield _merged(buffer)
+                yield partial
+    except Exception:
+        if buffer:
+            yield _merged(buffer)
+        raise
+
+    if buffer:
+        yield _merged(buffer)
+
+
+def coalesce_partials(
+        partials: AsyncIterator[fp.PartialResponse],
+        settings: Optional[StreamSettings] = None,
+) -> AsyncIterator[fp.PartialResponse]:
+    settings = settings or stream_settings
+    policy = FlushPolicy(settings.flush_policy)
+
+    if policy is FlushPolicy.WINDOW and settings.flush_window_ms > 0:
+        return _coalesce_window(partials, settings.flush_window_ms / 1000)
+    if policy is FlushPolicy.BYTES and settings.flush_max_bytes > 0:
+        return _coalesce_bytes(partials, settings.flush_max_bytes)
+    return partials
@@ -0,0 +1,70 @@
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from collections import Counter
+from typing import Any, AsyncIterator, Dict
+
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class StreamStats:
+    def __init__(self):
+        self.active = 0
+        self.completed: Counter = Counter()
+        self.cancelled: Counter = Counter()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "completed": dict(self.completed),
+            "cancelled": dict(self.cancelled),
+        }
+
+
+stream_stats = StreamStats()
+
+
+async def close_stream(stream: AsyncIterator[Any]):
+    aclose = getattr(stream, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+class CancellableStreamingResponse(StreamingResponse):
+    async def _close(self, *tasks: asyncio.Future):
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await close_stream(self.body_iterator)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        route = scope.get("route")
+        path = getattr(route, "path", None) or scope.get("path", "")
+        stream_task = asyncio.ensure_future(self.stream_response(send))
+        listen_task = asyncio.ensure_future(self.listen_for_disconnect(receive))
+        stream_stats.active += 1
+        try:
+            await asyncio.wait((stream_task, listen_task), return_when=asyncio.FIRST_COMPLETED)
+            disconnected = not stream_task.done()
+        finally:
+            stream_stats.active -= 1
+            stream_task.cancel()
+            listen_task.cancel()
+            await asyncio.shield(self._close(stream_task, listen_task))
+
+        if not disconnected:
+            error = stream_task.exception()
+            if isinstance(error, OSError):
+                disconnected = True
+            elif error is not None:
+                raise error
+
+        if disconnected:
+            stream_stats.cancelled[path] += 1
+            logger.info(f"Client disconnected from {path}, upstream stream closed")
+        else:
+            stream_stats.completed[path] += 1
+
+        if self.background is not None:
+            await self.background()
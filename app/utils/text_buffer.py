@@ -0,0 +1,29 @@
+from typing import Iterator
+
+import codecs
+
+
+class TextBuffer:
+    __slots__ = ("data", "chars")
+
+    def __init__(self):
+        # UTF-8 keeps mostly-ASCII text at one byte per character; a str
+        # built with += is widened to four bytes by a single emoji.
+        self.data = bytearray()
+        self.chars = 0
+
+    def append(self, text: str):
+        self.data += text.encode("utf-8")
+        self.chars += len(text)
+
+    def chunks(self, size: int = 65536) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        with memoryview(self.data) as view:
+            for start in range(0, len(view), size):
+                yield decoder.decode(view[start:start + size])
+
+    def take(self) -> str:
+        text = self.data.decode("utf-8")
+        self.data = bytearray()
+        self.chars = 0
+        return text
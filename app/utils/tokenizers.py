@@ -0,0 +1,106 @@
+from functools import lru_cache
+from typing import Tuple
+
+import logging
+import math
+import re
+
+
+logger = logging.getLogger(__name__)
+
+
+PIECE_PATTERN = re.compile(
+    r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+(?!\S)|\s+",
+    re.IGNORECASE,
+)
+
+# Ends just before the last horizontal whitespace that follows a non-space
+# character; no piece of either pattern spans that boundary.
+LAST_WORD_BOUNDARY = re.compile(r"(?s:.*)\S(?=[^\S\r\n])")
+
+BOT_TOKENIZER_FAMILIES = (
+    ("gpt-4o", "o200k_base"),
+    ("gpt-4.1", "o200k_base"),
+    ("gpt-5", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("o3", "o200k_base"),
+    ("o4", "o200k_base"),
+    ("gpt-", "cl100k_base"),
+    ("claude", "claude"),
+    ("gemini", "gemini"),
+)
+
+CHARS_PER_TOKEN = {
+    "o200k_base": 4.2,
+    "cl100k_base": 4.0,
+    "claude": 3.5,
+    "gemini": 4.0,
+    "default": 4.0,
+}
+
+
+class HeuristicTokenizer:
+    def __init__(self, family: str, chars_per_token: float):
+        self.family = family
+        self.chars_per_token = chars_per_token
+
+    def _piece_tokens(self, piece: str) -> int:
+        if piece.isascii():
+            return max(1, math.ceil(len(piece) / self.chars_per_token))
+        ascii_chars = sum(1 for char in piece if char.isascii())
+        return max(1, math.ceil(ascii_chars / self.chars_per_token) + len(piece) - ascii_chars)
+
+    def count(self, text: str) -> int:
+        piece_tokens = self._piece_tokens
+        return sum(piece_tokens(piece) for piece in PIECE_PATTERN.findall(text))
+
+    def count_complete(self, text: str) -> Tuple[int, str]:
+        # The last piece can still grow and the one before it can still
+        # change: a trailing "'" becomes a contraction, and a whitespace run
+        # gives its last space to the next word.
+        pieces = list(PIECE_PATTERN.finditer(text))
+        if len(pieces) < 2:
+            return 0, text
+        piece_tokens = self._piece_tokens
+        return sum(piece_tokens(piece.group()) for piece in pieces[:-2]), text[pieces[-2].start():]
+
+
+class TiktokenTokenizer:
+    def __init__(self, family: str, encoding):
+        self.family = family
+        self.encoding = encoding
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode_ordinary(text))
+
+    def count_complete(self, text: str) -> Tuple[int, str]:
+        # tiktoken splits with its own pattern, so only cut where that pattern
+        # cannot join the text on both sides.
+        boundary = LAST_WORD_BOUNDARY.match(text)
+        if boundary is None:
+            return 0, text
+        return self.count(text[:boundary.end()]), text[boundary.end():]
+
+
+def tokenizer_family(bot_name: str) -> str:
+    lowered = bot_name.lower()
+    for prefix, family in BOT_TOKENIZER_FAMILIES:
+        if lowered.startswith(prefix):
+            return family
+    return "default"
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(family: str, use_tiktoken: bool = False):
+    if use_tiktoken and family.endswith("_base"):
+        try:
+            import tiktoken
+            return TiktokenTokenizer(family, tiktoken.get_encoding(family))
+        except Exception as e:
+            logger.info(f"Using heuristic token counts for '{family}' ({type(e).__name__}: {e})")
+    return HeuristicTokenizer(family, CHARS_PER_TOKEN.get(family, CHARS_PER_TOKEN["default"]))
+
+
+@lru_cache(maxsize=1024)
+def get_tokenizer(bot_name: str, use_tiktoken: bool = False):
+    return load_tokenizer(tokenizer_family(bot_name), use_tiktoken)
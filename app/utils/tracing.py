@@ -0,0 +1,189 @@
+from config.settings import TraceSettings, trace_settings
+from utils.log_pipeline import DroppingQueueHandler, LogListener
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from contextlib import aclosing, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+
+class Trace:
+    __slots__ = ("trace_id", "started_at", "spans", "totals")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.perf_counter()
+        self.spans: List[Tuple[str, float, float, Dict[str, Any]]] = []
+        self.totals: Dict[str, List[float]] = {}
+
+    def add(self, name: str, started: float, ended: float, attributes: Optional[Dict[str, Any]] = None):
+        self.spans.append((name, started, ended, attributes or {}))
+
+    def accumulate(self, name: str, seconds: float):
+        total = self.totals.get(name)
+        if total is None:
+            self.totals[name] = [1, seconds]
+        else:
+            total[0] += 1
+            total[1] += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        spans = [
+            {
+                "name": name,
+                "start_ms": round((started - self.started_at) * 1000, 3),
+                "duration_ms": round((ended - started) * 1000, 3),
+                **attributes,
+            }
+            for name, started, ended, attributes in sorted(self.spans, key=lambda span: span[1])
+        ]
+        spans.extend(
+            {"name": name, "count": int(count), "total_ms": round(seconds * 1000, 3)}
+            for name, (count, seconds) in self.totals.items()
+        )
+        return {"trace_id": self.trace_id, "spans": spans}
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.perf_counter(), attributes)
+
+
+class TimedFrame:
+    def __init__(self, frame, trace: Trace, name: str):
+        self.frame = frame
+        self.trace = trace
+        self.name = name
+
+    def render(self, text: str) -> bytes:
+        started = time.perf_counter()
+        rendered = self.frame.render(text)
+        self.trace.accumulate(self.name, time.perf_counter() - started)
+        return rendered
+
+
+def timed_frame(frame, name: str = "sse_serialize"):
+    trace = current_trace.get()
+    return frame if trace is None else TimedFrame(frame, trace, name)
+
+
+async def _traced_partials(partials: AsyncIterator[Any], trace: Trace) -> AsyncIterator[Any]:
+    started = time.perf_counter()
+    waiting = True
+    try:
+        async with aclosing(partials):
+            async for partial in partials:
+                if waiting and partial.text:
+                    trace.add("upstream_first_token", started, time.perf_counter())
+                    waiting = False
+                yield partial
+    finally:
+        trace.add("upstream_stream", started, time.perf_counter())
+
+
+def traced_partials(partials: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    trace = current_trace.get()
+    return partials if trace is None else _traced_partials(partials, trace)
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False, separators=(",", ":"))
+
+
+def default_trace_file() -> str:
+    return os.path.join(tempfile.gettempdir(), "poe-adapter-traces.jsonl")
+
+
+class RequestTracer:
+    def __init__(self, settings: TraceSettings):
+        self.sample_rate = settings.sample_rate
+        if settings.exporter == "file":
+            handler = logging.FileHandler(settings.file or default_trace_file(), encoding="utf-8")
+        elif settings.exporter == "stdout":
+            handler = logging.StreamHandler(sys.stdout)
+        else:
+            raise ValueError(f"Unknown TRACE_EXPORTER '{settings.exporter}', expected 'stdout' or 'file'")
+        handler.setFormatter(JsonLineFormatter())
+        trace_queue: queue.Queue = queue.Queue(maxsize=settings.queue_size)
+        self.handler = DroppingQueueHandler(trace_queue)
+        self.exporter = logging.Logger("poe_adapter.traces")
+        self.exporter.addHandler(self.handler)
+        self.listener = LogListener(trace_queue, handler)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def export(self, trace: Trace, scope: Scope, status: Optional[int], response_started: Optional[float]):
+        ended = time.perf_counter()
+        route = scope.get("route")
+        self.exporter.info({
+            "time": time.time(),
+            "method": scope.get("method"),
+            "path": getattr(route, "path", None) or scope.get("path", ""),
+            "status": status,
+            "duration_ms": round((ended - trace.started_at) * 1000, 3),
+            "response_start_ms": None if response_started is None else round((response_started - trace.started_at) * 1000, 3),
+            "pid": os.getpid(),
+            **trace.to_dict(),
+        })
+
+
+class TracingMiddleware:
+    def __init__(self, app: ASGIApp, tracer: RequestTracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.tracer.sampled():
+            await self.app(scope, receive, send)
+            return
+        trace = Trace()
+        status: Optional[int] = None
+        response_started: Optional[float] = None
+
+        async def traced_send(message: Message):
+            nonlocal status, response_started
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_started = time.perf_counter()
+            await send(message)
+
+        token = current_trace.set(trace)
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            current_trace.reset(token)
+            self.tracer.export(trace, scope, status, response_started)
+
+
+def create_request_tracer(settings: TraceSettings) -> Optional[RequestTracer]:
+    if settings.sample_rate <= 0:
+        return None
+    return RequestTracer(settings)
+
+
+request_tracer = create_request_tracer(trace_settings)